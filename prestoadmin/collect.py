@@ -18,24 +18,29 @@ Module for gathering various debug information for incident reporting
 using presto-admin
 """
 
+import datetime
+import inspect
 import logging
 import json
+import re
 import shutil
 import tarfile
+from StringIO import StringIO
 
 import requests
-from fabric.contrib.files import append
 from fabric.context_managers import settings, hide
-from fabric.operations import os, get, run
+from fabric.operations import os, get, put, run, sudo
 from fabric.tasks import execute
-from fabric.api import env, runs_once, task
+from fabric.api import env, parallel, runs_once, task
 from fabric.utils import abort, warn
 
 from prestoadmin.prestoclient import PrestoClient
-from prestoadmin.server import get_presto_version, get_catalog_info_from
+from prestoadmin.server import get_catalog_info_from
+from prestoadmin.util import log_slicer
 from prestoadmin.util.base_config import requires_config
 from prestoadmin.util.filesystem import ensure_directory_exists
-from prestoadmin.util.local_config_util import get_log_directory
+from prestoadmin.util.local_config_util import get_log_directory, get_log_offsets_path
+from prestoadmin.util.package_facts import PRESTO_PACKAGE_NAMES
 from prestoadmin.util.remote_config_util import lookup_server_log_file,\
     lookup_launcher_log_file,  lookup_port, lookup_catalog_directory
 from prestoadmin.standalone.config import StandaloneConfig
@@ -52,6 +57,21 @@ PRESTOADMIN_LOG_NAME = 'presto-admin.log'
 _LOGGER = logging.getLogger(__name__)
 QUERY_REQUEST_EXT = 'v1/query/'
 NODES_REQUEST_EXT = 'v1/node'
+LOG_TIME_FORMATS = ['%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S',
+                    '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S']
+LOG_DURATION = re.compile(r'^(\d+)([smhd])$')
+LOG_SIZE = re.compile(r'^(\d+)([kmg]?)$', re.IGNORECASE)
+SYSTEM_INFO_SECTIONS = ['platform', 'java_version', 'presto_version']
+SYSTEM_INFO_SECTION = re.compile(r'^==> (\w+) <==$')
+# Prints each piece of system information after a header line. The presto
+# rpm has had several names, and rpm prints why a query failed to stdout, so
+# only the output of the query that succeeds is printed.
+SYSTEM_INFO_PROBE = ("echo '==> platform <=='; uname -a; "
+                     "echo '==> java_version <=='; java -version 2>&1; "
+                     "echo '==> presto_version <=='; "
+                     "for name in %s; do "
+                     "version=$(rpm -q --qf '%%{VERSION}\\n' $name) && echo \"$version\" && break; "
+                     "done; true" % ' '.join(PRESTO_PACKAGE_NAMES))
 
 __all__ = ['logs', 'query_info', 'system_info']
 
@@ -62,19 +82,46 @@ __all__ = ['logs', 'query_info', 'system_info']
 def logs(dest_dir=TMP_PRESTO_DEBUG):
     """
     Gather all the server logs and presto-admin log and create a tar file.
+    The logs of each node are compressed on the node, and are stored in the
+    tar file as <node>.tar.gz.
 
     Parameters:
         dest_dir - logs destination dir.  default /tmp/presto-debug
+        --since=TIME (optional) - only collect log entries from TIME on,
+            where TIME is a time such as "2019-10-01 12:00", or a duration
+            before now such as 30m, 2h or 1d
+        --until=TIME (optional) - only collect log entries up to TIME
+        --max-log-size=SIZE (optional) - collect at most SIZE bytes of the
+            newest log entries from each node, such as 500M
+        --incremental (optional) - only collect the log entries written
+            since the last incremental collection
     """
+    slicer_options = log_slicer_options()
+    log_offsets = None
+    if env.get('incremental_logs'):
+        if env.get('log_until'):
+            abort('--until can not be used with --incremental, because the '
+                  'entries after it would not be collected by the next run.')
+        log_offsets = load_log_offsets()
     downloaded_logs_location = os.path.join(dest_dir, "logs")
     ensure_directory_exists(downloaded_logs_location)
 
     print 'Downloading logs from all the nodes...'
-    execute(get_remote_log_files, downloaded_logs_location, roles=env.roles)
+    new_offsets = execute(get_remote_log_files, downloaded_logs_location, slicer_options,
+                          log_offsets, roles=env.roles)
+    if log_offsets is not None:
+        # A host that failed returns None, or an exception when run in
+        # parallel, and keeps its old offsets.
+        for host, host_offsets in new_offsets.items():
+            if isinstance(host_offsets, dict):
+                log_offsets[host] = host_offsets
+        save_log_offsets(log_offsets)
 
     copy_admin_log(downloaded_logs_location)
     logs_tar_file_location = os.path.join(dest_dir, OUTPUT_FILENAME_FOR_LOGS)
-    make_tarfile(logs_tar_file_location, downloaded_logs_location)
+    # Most of the archive is the nodes' logs, which are compressed already.
+    make_tarfile(logs_tar_file_location, downloaded_logs_location,
+                 compresslevel=1)
     print 'logs archive created: ' + logs_tar_file_location
 
 
@@ -82,8 +129,8 @@ def copy_admin_log(log_folder):
     shutil.copy(os.path.join(get_log_directory(), PRESTOADMIN_LOG_NAME), log_folder)
 
 
-def make_tarfile(output_filename, source_dir):
-    tar = tarfile.open(output_filename, 'w:gz')
+def make_tarfile(output_filename, source_dir, compresslevel=9):
+    tar = tarfile.open(output_filename, 'w:gz', compresslevel=compresslevel)
 
     try:
         tar.add(source_dir, arcname=os.path.basename(source_dir))
@@ -91,14 +138,157 @@ def make_tarfile(output_filename, source_dir):
         tar.close()
 
 
-def get_remote_log_files(dest_path):
-    remote_server_log = lookup_server_log_file(env.host)
-    _LOGGER.debug('Logs to be archived on host ' + env.host + ': ' + remote_server_log)
-    get_files(remote_server_log + '*', dest_path)
+def log_slicer_options():
+    """
+    Returns the log_slicer options for the --since, --until and
+    --max-log-size options, or an empty list if none of them are given.
+    """
+    options = []
+    if env.get('log_since'):
+        options.append('--since=' + parse_log_time(env.log_since))
+    if env.get('log_until'):
+        options.append('--until=' + parse_log_time(env.log_until, end_of_day=True))
+    if env.get('max_log_size'):
+        options.append('--max-bytes=%d' % parse_log_size(env.max_log_size))
+    return options
+
+
+def load_log_offsets():
+    """
+    Returns the offsets up to which each host's logs have been collected by
+    an incremental collection, keyed by host and then by inode.
+    """
+    try:
+        with open(get_log_offsets_path()) as f:
+            return json.load(f)
+    except IOError:
+        return {}
+    except ValueError:
+        warn('Could not read %s. Collecting the logs in full.' % get_log_offsets_path())
+        return {}
+
+
+def save_log_offsets(log_offsets):
+    offsets_path = get_log_offsets_path()
+    ensure_directory_exists(os.path.dirname(offsets_path))
+    temp_path = offsets_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(log_offsets, f)
+    os.rename(temp_path, offsets_path)
 
-    remote_launcher_log = lookup_launcher_log_file(env.host)
-    _LOGGER.debug('LOG directory to be archived on host ' + env.host + ': ' + remote_launcher_log)
-    get_files(remote_launcher_log + '*', dest_path)
+
+def parse_log_time(value, end_of_day=False):
+    """
+    Returns value, either a time or a duration before now, in the form that
+    log_slicer takes. Dates without a time are the start of the day, or the
+    end of it if end_of_day is set.
+    """
+    match = LOG_DURATION.match(value)
+    if match:
+        seconds = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}[match.group(2)]
+        return '-%d' % (int(match.group(1)) * seconds)
+    for time_format in LOG_TIME_FORMATS:
+        try:
+            parsed = datetime.datetime.strptime(value, time_format)
+        except ValueError:
+            continue
+        if end_of_day and time_format == '%Y-%m-%d':
+            parsed = parsed.replace(hour=23, minute=59, second=59)
+        return parsed.strftime(log_slicer.TIMESTAMP_FORMAT)
+    abort('Invalid log time %s. Use a time such as "2019-10-01 12:00" or a '
+          'duration such as 2h.' % value)
+
+
+def parse_log_size(value):
+    match = LOG_SIZE.match(value)
+    if not match:
+        abort('Invalid log size %s. Use a number of bytes such as 500M.' % value)
+    unit = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}[match.group(2).lower()]
+    return int(match.group(1)) * unit
+
+
+def get_remote_log_files(dest_path, slicer_options=None, log_offsets=None):
+    """
+    Compresses the server and launcher logs of the current host into a
+    <host>.tar.gz on the host, and downloads that to dest_path, so that the
+    logs are never copied uncompressed. If there are slicer_options, only
+    the part of the logs that they select is archived, by log_slicer.
+
+    If log_offsets is given, only the bytes after the offsets it holds for
+    the host are archived, and the new offsets of the host's logs are
+    returned.
+    """
+    log_patterns = [lookup_server_log_file(env.host) + '*',
+                    lookup_launcher_log_file(env.host) + '*']
+    _LOGGER.debug('Logs to be archived on host ' + env.host + ': ' + ' '.join(log_patterns))
+
+    with hide('stdout'):
+        remote_dir = run('mktemp -d %s.XXXXXXXX' % TMP_PRESTO_DEBUG_REMOTE)
+    try:
+        remote_archive = os.path.join(remote_dir, env.host + '.tar.gz')
+        remote_offsets = os.path.join(remote_dir, 'offsets.json')
+        if log_offsets is not None:
+            put(StringIO(json.dumps(log_offsets.get(env.host, {}))), remote_offsets)
+            slicer_options = (slicer_options or []) + ['--offsets=' + remote_offsets]
+        if slicer_options:
+            remote_script = os.path.join(remote_dir, 'log_slicer.py')
+            put(StringIO(inspect.getsource(log_slicer)), remote_script)
+            command = slice_logs_command(remote_script, slicer_options, log_patterns,
+                                         remote_archive, env.host)
+        else:
+            command = archive_logs_command(log_patterns, remote_archive, env.host)
+        with settings(hide('stdout', 'warnings'), warn_only=True):
+            result = sudo(command)
+        for line in result.splitlines():
+            if line.startswith(log_slicer.MISSING_PATTERN_PREFIX):
+                missing_pattern = line[len(log_slicer.MISSING_PATTERN_PREFIX):]
+                warn('remote path ' + missing_pattern + ' not found on ' + env.host)
+            else:
+                _LOGGER.debug('Archiving logs on %s: %s' % (env.host, line))
+        if not result.succeeded:
+            warn('Could not archive the logs on ' + env.host)
+            return
+        get(remote_archive, os.path.join(dest_path, env.host + '.tar.gz'))
+        if log_offsets is not None:
+            new_offsets = StringIO()
+            get(remote_offsets, new_offsets)
+            return json.loads(new_offsets.getvalue())
+    finally:
+        run('rm -rf ' + remote_dir)
+
+
+def archive_logs_command(log_patterns, archive, host):
+    """
+    Returns a shell command that gzips the files matching the glob patterns
+    into the tar file archive, under a directory named host, and prints the
+    patterns that match no files, after log_slicer.MISSING_PATTERN_PREFIX.
+
+    A running server appends to its log while it is archived, which makes
+    tar exit with status 1 after archiving what was there, so that status is
+    taken as success.
+    """
+    quoted_patterns = ' '.join("'%s'" % pattern for pattern in log_patterns)
+    return ("files=''; "
+            "for pattern in %(patterns)s; do "
+            "matches=$(ls -d $pattern 2>/dev/null); "
+            "if [ -z \"$matches\" ]; then echo \"%(prefix)s$pattern\"; fi; "
+            "files=\"$files $matches\"; "
+            "done; "
+            "tar --warning=no-file-changed -czPf %(archive)s --transform 's,^.*/,%(host)s/,' "
+            "--files-from /dev/null $files; "
+            "[ $? -le 1 ] && chmod 644 %(archive)s") % {
+                'patterns': quoted_patterns, 'archive': archive, 'host': host,
+                'prefix': log_slicer.MISSING_PATTERN_PREFIX}
+
+
+def slice_logs_command(script, slicer_options, log_patterns, archive, host):
+    """
+    Returns a shell command that runs the log_slicer script with whichever
+    python the node has.
+    """
+    quoted_args = ' '.join("'%s'" % arg for arg in
+                           slicer_options + [archive, host] + log_patterns)
+    return '"$(command -v python || command -v python3)" %s %s' % (script, quoted_args)
 
 
 def get_files(remote_path, local_path):
@@ -205,48 +395,71 @@ def system_info():
 
     _LOGGER.debug('Gathered catalog information in file: ' + catalog_file_name)
 
-    execute(get_catalog_configs, downloaded_sys_info_loc, roles=env.roles)
     execute(get_system_info, downloaded_sys_info_loc, roles=env.roles)
 
     make_tarfile(OUTPUT_FILENAME_FOR_SYS_INFO, downloaded_sys_info_loc)
     print 'System info archive created: ' + OUTPUT_FILENAME_FOR_SYS_INFO
 
 
+@parallel
 def get_system_info(download_location):
+    """
+    Gathers the system information of the current host with a single probe,
+    writes it to system_info.json and version_info.txt in a directory named
+    after the host in download_location, and downloads the host's catalog
+    configs there.
+    """
+    system_info = probe_system_info()
+    system_info['presto_admin_version'] = prestoadmin.__version__
+    host_location = os.path.join(download_location, env.host)
+    ensure_directory_exists(host_location)
+
+    with open(os.path.join(host_location, 'system_info.json'), 'w') as out_file:
+        out_file.write(json.dumps(system_info, indent=4, sort_keys=True))
+
+    version_file_name = os.path.join(host_location, 'version_info.txt')
+    with open(version_file_name, 'w') as out_file:
+        out_file.write('platform information : %s\n'
+                       'Java version: %s\n'
+                       'Presto-admin version: %s\n'
+                       'Presto server version: %s\n'
+                       % (system_info['platform'], system_info['java_version'],
+                          system_info['presto_admin_version'],
+                          system_info['presto_version']))
 
-    run("mkdir -p " + TMP_PRESTO_DEBUG_REMOTE)
+    _LOGGER.debug('Gathered version information in file: ' + version_file_name)
 
-    version_file_name = os.path.join(TMP_PRESTO_DEBUG_REMOTE, 'version_info.txt')
-    run('rm -f ' + version_file_name)
+    get_catalog_configs(download_location)
 
-    append(version_file_name, "platform information : " +
-           get_platform_information() + '\n')
-    append(version_file_name, 'Java version: ' + get_java_version() + '\n')
-    append(version_file_name, 'Presto-admin version: ' +
-           prestoadmin.__version__ + '\n')
-    append(version_file_name, 'Presto server version: ' +
-           get_presto_version() + '\n')
 
-    _LOGGER.debug('Gathered version information in file: ' + version_file_name)
+def probe_system_info():
+    """
+    Returns the platform, java version and presto version of the current
+    host, read with one remote command.
+    """
+    with settings(hide('warnings', 'stdout'), warn_only=True):
+        output = run(SYSTEM_INFO_PROBE)
+    _LOGGER.debug('system info of %s: %s' % (env.host, output))
+    return parse_system_info(output)
+
 
-    get_files(version_file_name, download_location)
+def parse_system_info(output):
+    """
+    Returns the sections of the output of SYSTEM_INFO_PROBE, keyed by their
+    names, without their surrounding whitespace.
+    """
+    system_info = dict((name, '') for name in SYSTEM_INFO_SECTIONS)
+    name = None
+    for line in output.splitlines():
+        match = SYSTEM_INFO_SECTION.match(line)
+        if match:
+            name = match.group(1)
+        elif name:
+            system_info[name] += line + '\n'
+    return dict((name, value.strip()) for name, value in system_info.items())
 
 
 def get_catalog_configs(dest_path):
     remote_catalog_dir = lookup_catalog_directory(env.host)
     _LOGGER.debug('catalogs to be archived on host ' + env.host + ': ' + remote_catalog_dir)
     get_files(remote_catalog_dir, dest_path)
-
-
-def get_platform_information():
-    with settings(hide('warnings', 'stdout'), warn_only=True):
-        platform_info = run('uname -a')
-        _LOGGER.debug('platform info: ' + platform_info)
-        return platform_info
-
-
-def get_java_version():
-    with settings(hide('warnings', 'stdout'), warn_only=True):
-        version = run('java -version')
-        _LOGGER.debug('java version: ' + version)
-        return version
@@ -30,6 +30,8 @@ import prestoadmin.deploy
 from prestoadmin.standalone.config import StandaloneConfig
 from prestoadmin.util import constants
 from prestoadmin.util.base_config import requires_config
+from prestoadmin.util.presto_config import PrestoConfig
+from prestoadmin.util.remote_config_util import clear_config_snapshot
 from prestoadmin.util.constants import CONFIG_PROPERTIES, LOG_PROPERTIES, \
     JVM_CONFIG, NODE_PROPERTIES
 
@@ -110,6 +112,8 @@ def gather_config_directory():
 def deploy_config_directory(tarfile):
     sudo('tar -C "%s" -x -v -f "%s" ; rm "%s"' %
          (constants.REMOTE_CONF_DIR, tarfile, tarfile))
+    clear_config_snapshot(env.host)
+    PrestoConfig.clear_coordinator_config_cache(env.host)
 
 
 def configuration_fetch(file_name, config_destination, should_warn=True):
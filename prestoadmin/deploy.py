@@ -17,16 +17,22 @@
 Common module for deploying the presto configuration
 """
 
+import base64
 import logging
 import os
+import tarfile
+import time
+from StringIO import StringIO
 
 from fabric.contrib import files
-from fabric.context_managers import settings
+from fabric.context_managers import settings, hide
 from fabric.contrib.files import exists
 from fabric.operations import sudo, abort
 from fabric.api import env
 
 from prestoadmin.util import constants
+from prestoadmin.util.presto_config import PrestoConfig
+from prestoadmin.util.remote_config_util import clear_config_snapshot
 from prestoadmin.standalone.config import PRESTO_STANDALONE_USER_GROUP
 import coordinator as coord
 import prestoadmin.util.fabricapi as util
@@ -34,6 +40,12 @@ import workers as w
 
 _LOGGER = logging.getLogger(__name__)
 
+# The archive is sent base64 encoded as part of the command, which is passed
+# to the remote shell as a single argument. Linux limits a single argument to
+# 128KB, so anything bigger is deployed one file at a time.
+MAX_INLINE_ARCHIVE_SIZE = 96 * 1024
+MISSING_OWNER_CODE = 42
+
 
 def coordinator():
     """
@@ -58,9 +70,14 @@ def workers():
 
 def configure_presto(conf, remote_dir):
     print("Deploying configuration on: " + env.host)
-    deploy(dict((name, output_format(content)) for (name, content)
-                in conf.iteritems() if name != "node.properties"), remote_dir)
-    deploy_node_properties(output_format(conf['node.properties']), remote_dir)
+    confs = dict((name, output_format(content)) for (name, content)
+                 in conf.iteritems() if name != "node.properties")
+    node_properties = output_format(conf['node.properties'])
+    if not deploy_archive(confs, node_properties, remote_dir):
+        deploy(confs, remote_dir)
+        deploy_node_properties(node_properties, remote_dir)
+    clear_config_snapshot(env.host)
+    PrestoConfig.clear_coordinator_config_cache(env.host)
 
 
 def output_format(conf):
@@ -99,6 +116,81 @@ def deploy(confs, remote_dir):
                              owner=PRESTO_STANDALONE_USER_GROUP, mode=600)
 
 
+def build_config_archive(confs, user_group, mode=0600):
+    """
+    Returns a gzipped tar archive, as a string, of the files in confs, a dict
+    of file name to content, owned by user_group and with the given mode.
+    """
+    user, group = user_group.split(':')
+    archive = StringIO()
+    tar = tarfile.open(fileobj=archive, mode='w:gz')
+    try:
+        for name, content in sorted(confs.iteritems()):
+            # Match the trailing newline added by echo in write_to_remote_file
+            data = content + '\n'
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = mode
+            info.uname = user
+            info.gname = group
+            info.mtime = time.time()
+            tar.addfile(info, StringIO(data))
+    finally:
+        tar.close()
+    return archive.getvalue()
+
+
+def deploy_archive(confs, node_properties, remote_dir):
+    """
+    Deploys the files in confs and node.properties to remote_dir with a
+    single command. The files are unpacked into a staging directory next to
+    remote_dir and then renamed into place, and the node.id lines already in
+    node.properties, if any, are kept as they are.
+
+    Returns False, without deploying anything, if the files are too large to
+    send in one command.
+    """
+    confs = dict(confs)
+    confs['node.properties'] = node_properties
+    payload = base64.b64encode(
+        build_config_archive(confs, PRESTO_STANDALONE_USER_GROUP))
+    if len(payload) > MAX_INLINE_ARCHIVE_SIZE:
+        _LOGGER.info("Configuration archive is %d bytes; deploying one file "
+                     "at a time" % len(payload))
+        return False
+
+    _LOGGER.info("Deploying configurations for " + str(confs.keys()))
+    user, group = PRESTO_STANDALONE_USER_GROUP.split(':')
+    node_file_path = os.path.join(remote_dir, 'node.properties')
+    command = (
+        "( getent passwd {user} >/dev/null || exit {missing_owner_code} ) && "
+        "mkdir -p {remote_dir} && "
+        "staging=$(mktemp -d {remote_dir}/.deploy-XXXXXXXX) && "
+        "trap 'rm -rf \"$staging\"' EXIT && "
+        "echo '{payload}' | base64 -d | tar -x -z -C \"$staging\" && "
+        "node_id=$(grep -s 'node.id' {node_file_path}; true) && "
+        "node_id=${{node_id:-node.id=$(uuidgen)}} && "
+        "{{ echo \"$node_id\"; cat \"$staging/node.properties\"; }} "
+        "> \"$staging/node.id.properties\" && "
+        "mv -f \"$staging/node.id.properties\" \"$staging/node.properties\" && "
+        "chown {user_group} \"$staging\"/* && "
+        "chmod 600 \"$staging\"/* && "
+        "mv -f \"$staging\"/* {remote_dir}/").format(
+            user=user, user_group=PRESTO_STANDALONE_USER_GROUP,
+            missing_owner_code=MISSING_OWNER_CODE, remote_dir=remote_dir,
+            node_file_path=node_file_path, payload=payload)
+
+    # Don't echo the encoded archive.
+    with settings(hide('running'), warn_only=True):
+        result = sudo(command)
+    if result.return_code == MISSING_OWNER_CODE:
+        abort("User %s does not exist. Make sure the Presto server RPM "
+              "is installed and try again" % user)
+    elif result.failed:
+        abort("Failed to deploy configuration to %s" % remote_dir)
+    return True
+
+
 def secure_create_file(filepath, user_group, mode=600):
     user, group = user_group.split(':')
     missing_owner_code = 42
@@ -15,14 +15,14 @@
 
 """Monkey patches needed to change logging and error handling in Fabric"""
 import traceback
-import sys
 import logging
+import os
+import time
 from traceback import format_exc
 
 from fabric import state
 from fabric.context_managers import settings
 from fabric.exceptions import NetworkError
-from fabric.job_queue import JobQueue
 from fabric.tasks import _is_task, WrappedCallableTask, requires_parallel
 from fabric.task_utils import crawl, parse_kwargs
 from fabric.utils import error
@@ -32,6 +32,9 @@ import fabric.tasks
 from fabric.network import needs_host, to_dict, disconnect_all
 
 from prestoadmin.util import exception
+from prestoadmin.util.timing import record_command, record_task, \
+    record_transfer
+from prestoadmin.util.worker_pool import WorkerPool
 
 
 _LOGGER = logging.getLogger(__name__)
@@ -39,6 +42,8 @@ old_warn = fabric.utils.warn
 old_abort = fabric.utils.abort
 old_run = fabric.operations.run
 old_sudo = fabric.operations.sudo
+old_put = fabric.operations.put
+old_get = fabric.operations.get
 
 
 # Need to monkey patch Fabric's warn method in order to print out
@@ -63,15 +68,20 @@ fabric.api.abort = abort
 
 
 # Monkey patch run and sudo so that the stdout and stderr
-# also go to the logs.
+# also go to the logs, and so that they can be timed along with put and get.
 @needs_host
 def run(command, shell=True, pty=True, combine_stderr=None, quiet=False,
         warn_only=False, stdout=None, stderr=None, timeout=None,
         shell_escape=None):
-    out = old_run(command, shell=shell, pty=pty,
-                  combine_stderr=combine_stderr, quiet=quiet,
-                  warn_only=warn_only, stdout=stdout, stderr=stderr,
-                  timeout=timeout, shell_escape=shell_escape)
+    start = time.time()
+    out = None
+    try:
+        out = old_run(command, shell=shell, pty=pty,
+                      combine_stderr=combine_stderr, quiet=quiet,
+                      warn_only=warn_only, stdout=stdout, stderr=stderr,
+                      timeout=timeout, shell_escape=shell_escape)
+    finally:
+        record_command('run', command, start, out)
     log_output(out)
     return out
 
@@ -84,10 +94,16 @@ fabric.api.run = run
 def sudo(command, shell=True, pty=True, combine_stderr=None, user=None,
          quiet=False, warn_only=False, stdout=None, stderr=None, group=None,
          timeout=None, shell_escape=None):
-    out = old_sudo(command, shell=shell, pty=pty,
-                   combine_stderr=combine_stderr, user=user, quiet=quiet,
-                   warn_only=warn_only, stdout=stdout, stderr=stderr,
-                   group=group, timeout=timeout, shell_escape=shell_escape)
+    start = time.time()
+    out = None
+    try:
+        out = old_sudo(command, shell=shell, pty=pty,
+                       combine_stderr=combine_stderr, user=user, quiet=quiet,
+                       warn_only=warn_only, stdout=stdout, stderr=stderr,
+                       group=group, timeout=timeout,
+                       shell_escape=shell_escape)
+    finally:
+        record_command('sudo', command, start, out)
     log_output(out)
     return out
 
@@ -96,12 +112,97 @@ fabric.operations.sudo = sudo
 fabric.api.sudo = sudo
 
 
+def put(local_path=None, remote_path=None, use_sudo=False,
+        mirror_local_mode=False, mode=None, use_glob=True, temp_dir=""):
+    start = time.time()
+    paths = None
+    try:
+        paths = old_put(local_path=local_path, remote_path=remote_path,
+                        use_sudo=use_sudo, mirror_local_mode=mirror_local_mode,
+                        mode=mode, use_glob=use_glob, temp_dir=temp_dir)
+    finally:
+        record_transfer('put', str(local_path), start, paths,
+                        bytes_out=_file_size(local_path))
+    return paths
+
+
+fabric.operations.put = put
+fabric.api.put = put
+
+
+def get(remote_path, local_path=None, use_sudo=False, temp_dir=""):
+    start = time.time()
+    paths = None
+    try:
+        paths = old_get(remote_path, local_path=local_path,
+                        use_sudo=use_sudo, temp_dir=temp_dir)
+    finally:
+        record_transfer('get', remote_path, start, paths,
+                        bytes_in=sum(_file_size(path)
+                                     for path in paths or []))
+    return paths
+
+
+fabric.operations.get = get
+fabric.api.get = get
+
+
+def _file_size(path):
+    if isinstance(path, basestring) and os.path.isfile(path):
+        return os.path.getsize(path)
+    return 0
+
+
 def log_output(out):
     _LOGGER.info('\nCOMMAND: ' + out.command + '\nFULL COMMAND: ' +
                  out.real_command + '\nSTDOUT: ' + out + '\nSTDERR: ' +
                  out.stderr)
 
 
+def _task_reference(task, command):
+    """
+    Returns task in a form that can be pickled if the worker pool needs to
+    send it to a worker session: the task's name if execute() was called with
+    one, or the callable fabric wrapped if it was called with a function.
+    """
+    if isinstance(command, basestring) and \
+            crawl(command, state.commands) is task:
+        return command
+    if isinstance(task, WrappedCallableTask):
+        return task.wrapped
+    return task
+
+
+def _run_task(task, args, kwargs, env):
+    """
+    Body of a parallel job. Expands the env it's given to ensure parallel,
+    linewise, etc are all set correctly and explicitly; such changes are
+    naturally insulated from the parent process. Exceptions are logged here
+    and sent back to the parent by the worker pool.
+    """
+    if isinstance(task, basestring):
+        task = crawl(task, state.commands)
+    if not _is_task(task):
+        task = WrappedCallableTask(task)
+    state.env.update(env)
+    try:
+        return _run_timed(task, args, kwargs)
+    except BaseException:
+        _LOGGER.error(traceback.format_exc())
+        raise
+
+
+def _run_timed(task, args, kwargs):
+    start = time.time()
+    succeeded = False
+    try:
+        result = task.run(*args, **kwargs)
+        succeeded = True
+        return result
+    finally:
+        record_task(start, succeeded)
+
+
 # Monkey patch _execute and execute so that we can handle errors differently
 def _execute(task, host, my_env, args, kwargs, jobs, queue, multiprocessing):
     """
@@ -120,44 +221,17 @@ def _execute(task, host, my_env, args, kwargs, jobs, queue, multiprocessing):
     if queue is not None:  # Since queue is only set for parallel
         name = local_env['host_string']
 
-        # Wrap in another callable that:
-        # * expands the env it's given to ensure parallel, linewise, etc are
-        # all set correctly and explicitly. Such changes are naturally
-        # insulted from the parent process.
-        # * nukes the connection cache to prevent shared-access problems
-        # * knows how to send the tasks' return value back over a Queue
-        # * captures exceptions raised by the task
-        def inner(args, kwargs, queue, name, env):
-            state.env.update(env)
-
-            def submit(result):
-                queue.put({'name': name, 'result': result})
-
-            try:
-                state.connections.clear()
-                submit(task.run(*args, **kwargs))
-            except BaseException, e:
-                _LOGGER.error(traceback.format_exc())
-                submit(e)
-                sys.exit(1)
-
-        # Stuff into Process wrapper
-        kwarg_dict = {
+        # Add to the pool; a worker process runs it once the pool is started
+        jobs.append(name, _run_task, {
+            'task': _task_reference(task, my_env['command']),
             'args': args,
             'kwargs': kwargs,
-            'queue': queue,
-            'name': name,
             'env': local_env,
-        }
-        p = multiprocessing.Process(target=inner, kwargs=kwarg_dict)
-        # Name/id is host string
-        p.name = name
-        # Add to queue
-        jobs.append(p)
+        })
     # Handle serial execution
     else:
         with settings(**local_env):
-            return task.run(*args, **kwargs)
+            return _run_timed(task, args, kwargs)
 
 
 def execute(task, *args, **kwargs):
@@ -215,11 +289,9 @@ def execute(task, *args, **kwargs):
 
     # Get pool size for this task
     pool_size = task.get_pool_size(my_env['all_hosts'], state.env.pool_size)
-    # Set up job queue in case parallel is needed
+    # Set up worker pool in case parallel is needed
     queue = multiprocessing.Queue() if parallel else None
-    jobs = JobQueue(pool_size, queue)
-    if state.output.debug:
-        jobs._debug = True
+    jobs = WorkerPool(pool_size, queue)
 
     # Call on host list
     if my_env['all_hosts']:
@@ -246,7 +318,7 @@ def execute(task, *args, **kwargs):
             if state.env.eagerly_disconnect:
                 disconnect_all()
 
-        # If running in parallel, block until job queue is emptied
+        # If running in parallel, block until the worker pool is drained
         if jobs:
             jobs.close()
             # Abort if any children did not exit cleanly (fail-fast).
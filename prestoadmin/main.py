@@ -67,6 +67,7 @@ from prestoadmin.util.application import entry_point
 from prestoadmin.util.fabric_application import FabricApplication
 from prestoadmin.util.hiddenoptgroup import HiddenOptionGroup
 from prestoadmin.util.parser import LoggingOptionParser
+from prestoadmin.util import presto_config, timing, worker_pool
 
 # One-time calculation of "all internal callables" to avoid doing this on every
 # check of a given fabfile callable (in is_classic_task()).
@@ -316,6 +317,91 @@ def parser_for_options():
         help=SUPPRESS_HELP
     )
 
+    parser.add_option(
+        '--rpm-relay',
+        type='int',
+        metavar='N',
+        dest='rpm_relay_seeds',
+        default=None,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--since',
+        metavar='TIME',
+        dest='log_since',
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--until',
+        metavar='TIME',
+        dest='log_until',
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--max-log-size',
+        metavar='SIZE',
+        dest='max_log_size',
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--watch',
+        action='store_true',
+        dest='watch_status',
+        default=False,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--json',
+        action='store_true',
+        dest='status_json',
+        default=False,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--status-ttl',
+        type='int',
+        metavar='SECONDS',
+        dest='status_ttl',
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--incremental',
+        action='store_true',
+        dest='incremental_logs',
+        default=False,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--timing-report',
+        action='store_true',
+        dest='timing_report',
+        default=False,
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--trace-file',
+        metavar='PATH',
+        dest='trace_file',
+        help=SUPPRESS_HELP
+    )
+
+    parser.add_option(
+        '--query-max-wait',
+        type='float',
+        metavar='SECONDS',
+        dest='query_max_wait',
+        help=SUPPRESS_HELP
+    )
+
     parser.add_option(
         '--no-config-update',
         action='store_true',
@@ -573,6 +659,32 @@ def run_tasks(task_list):
                 sys.stderr.write('Invalid argument --nodeps to task: %s\n'
                                  % name)
                 display_command(name, 2)
+            rpm_relay_tasks = ['package.install', 'server.install']
+            relay_seeds = state.env.get('rpm_relay_seeds')
+            if relay_seeds is not None and name.strip() not in rpm_relay_tasks:
+                sys.stderr.write('Invalid argument --rpm-relay to task: %s\n'
+                                 % name)
+                display_command(name, 2)
+            if relay_seeds is not None and relay_seeds < 1:
+                sys.stderr.write('--rpm-relay must be at least 1\n')
+                display_command(name, 2)
+            query_max_wait = state.env.get('query_max_wait')
+            if query_max_wait is not None and query_max_wait <= 0:
+                sys.stderr.write('--query-max-wait must be greater than 0\n')
+                display_command(name, 2)
+            for option, key in [('--since', 'log_since'), ('--until', 'log_until'),
+                                ('--max-log-size', 'max_log_size'),
+                                ('--incremental', 'incremental_logs')]:
+                if state.env.get(key) and name.strip() != 'collect.logs':
+                    sys.stderr.write('Invalid argument %s to task: %s\n'
+                                     % (option, name))
+                    display_command(name, 2)
+            for option, key in [('--watch', 'watch_status'), ('--json', 'status_json'),
+                                ('--status-ttl', 'status_ttl')]:
+                if state.env.get(key) and name.strip() != 'server.status':
+                    sys.stderr.write('Invalid argument %s to task: %s\n'
+                                     % (option, name))
+                    display_command(name, 2)
 
             return execute(
                 name,
@@ -907,8 +1019,29 @@ def main(args=sys.argv[1:]):
     names = ", ".join(x[0] for x in commands_to_run)
     _LOGGER.debug("Commands to run: %s" % names)
 
+    # Keep one worker process, and so one SSH connection, per host for all
+    # of the parallel work done by the commands.
+    if not state.env.eagerly_disconnect:
+        worker_pool.start_session(state.env.pool_size)
+    # Read the coordinator's config once for all of the commands and hosts.
+    presto_config.start_config_cache()
+
     # At this point all commands must exist, so execute them in order.
-    return _exit_code(run_tasks(commands_to_run))
+    try:
+        return _exit_code(run_tasks(commands_to_run))
+    finally:
+        records = timing.take_records()
+        if state.env.timing_report:
+            timing.print_timing_report(records)
+        if state.env.get('trace_file'):
+            _write_trace_file(state.env.trace_file, records)
+
+
+def _write_trace_file(path, records):
+    try:
+        timing.write_trace_file(path, records)
+    except (IOError, OSError) as e:
+        warn('Could not write the trace file %s: %s' % (path, e))
 
 
 if __name__ == "__main__":
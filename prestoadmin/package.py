@@ -18,16 +18,19 @@ Module for rpm package deploy and install using presto-admin
 import logging
 
 from fabric.context_managers import settings, hide, shell_env
-from fabric.decorators import task, runs_once
-from fabric.operations import sudo, put, os, local
+from fabric.decorators import task, runs_once, parallel
+from fabric.operations import sudo, put, os, local, run
 from fabric.state import env
 from fabric.tasks import execute
-from fabric.utils import abort
+from fabric.utils import abort, warn
 
 from prestoadmin.util import constants
 from prestoadmin.standalone.config import StandaloneConfig
 from prestoadmin.util.base_config import requires_config
 from prestoadmin.util.fabricapi import get_host_list
+from prestoadmin.util.filesystem import read_sidecar, sha256_of_file, \
+    write_sidecar
+from prestoadmin.util.package_facts import clear_package_facts
 
 _LOGGER = logging.getLogger(__name__)
 __all__ = ['install', 'uninstall']
@@ -45,12 +48,30 @@ def install(local_path):
         --nodeps (optional): Flag to indicate if rpm install
             should ignore checking package dependencies. Equivalent
             to adding --nodeps flag to rpm -i.
+        --rpm-relay=N (optional): Copy the rpm to N nodes, which relay it
+            to the other nodes over ssh instead of all of them getting it
+            from this host. The nodes log in to each other with the keys
+            in your ssh agent, which is forwarded to them, so root on any
+            node can use your agent while the rpm is relayed.
     """
     check_if_valid_rpm(local_path)
+    local_checksum(local_path)
+    if env.get('rpm_relay_seeds'):
+        relay(local_path, get_host_list(), env.rpm_relay_seeds)
     return execute(deploy_install, local_path, hosts=get_host_list())
 
 
 def check_if_valid_rpm(local_path):
+    """
+    Aborts if rpm -K finds the rpm at local_path corrupted. An rpm that has
+    passed is recorded in a sidecar file along with its sha256 checksum, and
+    isn't checked again until its size or modification time changes.
+    """
+    facts = read_sidecar(local_path)
+    if facts and facts.get('rpm_verified'):
+        _LOGGER.info("Rpm %s was already verified" % local_path)
+        return
+
     _LOGGER.info("Checking rpm checksum to see if it is corrupted")
     with settings(hide('warnings', 'stdout'), warn_only=True):
         result = local('rpm -K --nosignature ' + local_path, capture=True)
@@ -58,6 +79,9 @@ def check_if_valid_rpm(local_path):
         abort("Corrupted RPM. Try downloading the RPM again.")
     elif result.stderr:
         abort(result.stderr)
+    else:
+        write_sidecar(local_path, {'rpm_verified': True,
+                                   'sha256': sha256_of_file(local_path)})
 
 
 def deploy_install(local_path):
@@ -74,9 +98,25 @@ def deploy_action(local_path, rpm_action):
 
 
 def deploy(local_path=None):
+    """
+    Copies the rpm at local_path to the packages directory of the current
+    host, unless the host already has a copy with the same sha256 checksum,
+    such as when an install or upgrade is retried after failing on some of
+    the hosts.
+    """
     if not os.path.isfile(local_path):
         abort('RPM file not found at %s.' % local_path)
 
+    remote_path = _rpm_path(os.path.basename(local_path))
+    checksum = local_checksum(local_path)
+    if _has_checksum(remote_path, checksum):
+        _LOGGER.info("Rpm %s already deployed on %s" % (remote_path, env.host))
+        print("Package already deployed on: " + env.host)
+        return
+    _upload(local_path, remote_path, checksum)
+
+
+def _upload(local_path, remote_path, checksum):
     _LOGGER.info("Deploying rpm on %s..." % env.host)
     print("Deploying rpm on %s..." % env.host)
     sudo('mkdir -p ' + constants.REMOTE_PACKAGES_PATH)
@@ -86,11 +126,135 @@ def deploy(local_path=None):
         ret_list = put(local_path, constants.REMOTE_PACKAGES_PATH,
                        use_sudo=True, temp_dir='/tmp')
     if ret_list.succeeded:
+        if not _has_checksum(remote_path, checksum):
+            abort('Checksum mismatch for %s on %s' % (remote_path, env.host))
         print("Package deployed successfully on: " + env.host)
 
 
+def plan_relay_rounds(hosts, seeds):
+    """
+    Plans the distribution of a file from the admin host to hosts in rounds,
+    where every host that has the file by the end of a round sends it to one
+    other host in the next round, and the admin host sends it to up to seeds
+    hosts in every round. The number of hosts with the file roughly doubles
+    every round, so the number of rounds grows with log(len(hosts)).
+
+    Returns a list of rounds, each a list of (source, target) pairs, where a
+    source of None is the admin host.
+    """
+    if seeds < 1:
+        raise ValueError('Need at least one seed host, got %s' % seeds)
+    pending = list(hosts)
+    holders = []
+    rounds = []
+    while pending:
+        transfers = [(None, pending.pop(0))
+                     for _ in range(min(seeds, len(pending)))]
+        for holder in holders:
+            if not pending:
+                break
+            transfers.append((holder, pending.pop(0)))
+        holders.extend(target for _, target in transfers)
+        rounds.append(transfers)
+    return rounds
+
+
+def relay(local_path, hosts, seeds):
+    """
+    Copies the rpm at local_path to hosts as planned by plan_relay_rounds,
+    so that the admin host sends it to a few seed hosts, which send it on to
+    the rest. Hosts copy to each other with scp, using the admin host's ssh
+    agent, which is forwarded to them. A host that can't get the rpm from
+    another host gets it from the admin host instead. The checksum of the
+    rpm is verified on every host.
+
+    deploy() doesn't copy the rpm again to the hosts it was relayed to, as
+    they have a copy with the same checksum, but still copies it to any host
+    that didn't get it.
+    """
+    checksum = local_checksum(local_path)
+    rounds = plan_relay_rounds(hosts, seeds)
+    _LOGGER.info('Relaying %s to %d hosts in %d rounds' %
+                 (local_path, len(hosts), len(rounds)))
+    for transfers in rounds:
+        sources = dict((target, source) for source, target in transfers)
+        execute(_relay_hop, local_path, checksum, sources,
+                hosts=[target for _, target in transfers])
+
+
+@parallel
+def _relay_hop(local_path, checksum, sources):
+    source = sources[env.host]
+    remote_path = _rpm_path(os.path.basename(local_path))
+    if _has_checksum(remote_path, checksum):
+        print("Package already deployed on: " + env.host)
+        return
+    if source is not None:
+        if _copy_from_host(source, remote_path) and \
+                _has_checksum(remote_path, checksum):
+            print("Package relayed from %s to %s" % (source, env.host))
+            return
+        warn('Could not relay %s from %s to %s; copying it from this host'
+             % (remote_path, source, env.host))
+
+    _upload(local_path, remote_path, checksum)
+
+
+def _copy_from_host(source, remote_path):
+    """
+    Copies remote_path from source to the current host with scp. The copy is
+    staged in a private temporary directory on the current host, and the
+    hosts verify each other's keys against the known_hosts of the user on
+    source.
+    """
+    target = env.host
+    with settings(hide('warnings', 'running', 'stdout'), warn_only=True):
+        temp_dir = run('mktemp -d /tmp/prestoadmin-relay.XXXXXXXXXXXXXX')
+    if not temp_dir.succeeded:
+        return False
+    temp_path = os.path.join(temp_dir, os.path.basename(remote_path))
+    try:
+        with settings(hide('warnings', 'running', 'stdout'), warn_only=True,
+                      forward_agent=True, host_string='%s@%s:%s' % (env.user, source, env.port)):
+            copied = run('scp -q -o BatchMode=yes -P %s %s %s@%s:%s' %
+                         (env.port, remote_path, env.user, target, temp_path))
+        if not copied.succeeded:
+            return False
+        with settings(hide('warnings', 'running', 'stdout'), warn_only=True):
+            return sudo('mkdir -p %s && mv -f %s %s' %
+                        (constants.REMOTE_PACKAGES_PATH, temp_path,
+                         remote_path)).succeeded
+    finally:
+        with settings(hide('warnings', 'running', 'stdout'), warn_only=True):
+            run('rm -rf %s' % temp_dir)
+
+
+def _has_checksum(remote_path, checksum):
+    with settings(hide('warnings', 'running', 'stdout'), warn_only=True):
+        result = sudo('sha256sum %s' % remote_path)
+    return result.succeeded and result.split()[0] == checksum
+
+
+def local_checksum(local_path):
+    """
+    Returns the sha256 checksum of the rpm at local_path, taken from the
+    sidecar written by check_if_valid_rpm if there is one. The checksum is
+    kept in env, so that it is computed once by the task that fans out to the
+    hosts rather than once per host.
+    """
+    checksums = env.get('rpm_checksums') or {}
+    if local_path not in checksums:
+        facts = read_sidecar(local_path) or {}
+        checksums = dict(checksums)
+        checksums[local_path] = facts.get('sha256') or \
+            sha256_of_file(local_path)
+        env.rpm_checksums = checksums
+    return checksums[local_path]
+
+
 def _rpm_install(package_path):
     nodeps = _nodeps_rpm_option()
+    clear_package_facts(env.host)
 
     if 'java_home' not in env or env.java_home is None:
         return sudo('rpm -i %s%s' % (nodeps, package_path))
@@ -127,6 +291,7 @@ def rpm_upgrade(rpm_name):
 
 
 def _rpm_upgrade(package_name):
+    clear_package_facts(env.host)
     return sudo('rpm -U %s%s' % (_nodeps_rpm_option(), package_name))
 
 
@@ -161,4 +326,5 @@ def is_rpm_installed(package_name):
 
 
 def _rpm_uninstall(package_name):
+    clear_package_facts(env.host)
     return sudo('rpm -e %s%s' % (_nodeps_rpm_option(), package_name))
@@ -20,8 +20,10 @@ import jks
 import json
 import logging
 import os
+import select
 import socket
 import textwrap
+import time
 import urlparse
 import datetime
 import jwt
@@ -44,11 +46,51 @@ NUM_ROWS = 1000
 DATA_RESP = "data"
 NEXT_URI_RESP = "nextUri"
 
+# After the first response in a row without new rows for a query, wait before
+# following its nextUri, starting at POLL_INITIAL_INTERVAL seconds and doubling
+# up to POLL_MAX_INTERVAL.
+POLL_INITIAL_INTERVAL = 0.05
+POLL_MAX_INTERVAL = 1.0
+
 CERTIFICATE_ALIAS = 'certificate_alias'
 
+# Requests that can be sent again when a connection fails, as the server
+# handles a repeated one the same way.
+IDEMPOTENT_METHODS = ['GET', 'DELETE']
+# Other requests aren't sent on a connection that has been idle for longer
+# than this many seconds, as the server may be about to close it.
+MAX_IDLE_FOR_UNSAFE_REQUESTS = 30
+
+
+class PollStats(object):
+    """
+    Number of requests, bytes received and time taken by one query.
+    """
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.waited = 0.0
+        self.start = time.time()
+
+    def add_response(self, answer):
+        self.requests += 1
+        self.bytes += len(answer)
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def __str__(self):
+        return '%d requests, %d bytes, %.3fs elapsed, %.3fs waiting' % (
+            self.requests, self.bytes, self.elapsed(), self.waited)
+
 
 class PrestoClient:
-    def __init__(self, server, user, coordinator_config=None):
+    def __init__(self, server, user, coordinator_config=None, max_wait=None):
+        """
+        max_wait is the longest time in seconds to wait for a query to finish.
+        It defaults to the --query-max-wait option, and None waits as long as
+        it takes.
+        """
         # immutable stuff
         self.server = server
         self.user = user
@@ -56,6 +98,9 @@ class PrestoClient:
             coordinator_config = PrestoConfig.coordinator_config()
         self.coordinator_config = coordinator_config
         self.port = PrestoClient._get_configured_port(self.coordinator_config)
+        if max_wait is None:
+            max_wait = env.get('query_max_wait')
+        self.max_wait = max_wait
 
         # mutable stuff
         self.ca_file_path = ""
@@ -63,6 +108,10 @@ class PrestoClient:
         self.rows = []
         self.next_uri = ''
         self.response_from_server = {}
+        self.query_failed = False
+        self.poll_stats = PollStats()
+        self._connection = None
+        self._last_used = 0
 
     @staticmethod
     def _remove_silently(path):
@@ -72,6 +121,7 @@ class PrestoClient:
             pass
 
     def close(self):
+        self._close_connection()
         PrestoClient._remove_silently(self.ca_file_path)
 
     def _clear_old_results(self):
@@ -84,6 +134,9 @@ class PrestoClient:
         if self.response_from_server:
             self.response_from_server = {}
 
+        self.query_failed = False
+        self.poll_stats = PollStats()
+
     def run_sql(self, sql, schema="default", catalog="hive"):
         """
         Execute a query connecting to Presto server using passed parameters.
@@ -103,6 +156,34 @@ class PrestoClient:
         else:
             return None
 
+    def iter_sql(self, sql, schema="default", catalog="hive", max_rows=None):
+        """
+        Execute a query like run_sql, but return the rows one page at a time
+        instead of collecting them all in memory.
+
+        The query is submitted before iter_sql returns. Each page of results
+        is fetched from the server when the rows before it have been
+        consumed. If the consumer stops early, by closing the iterator or
+        dropping it, or once max_rows rows have been returned, the query is
+        cancelled on the server.
+
+        Args:
+            sql: SQL query to be executed
+            schema: Presto schema to be used while executing query
+                (default=default)
+            catalog: Catalog to be used by the server
+            max_rows: maximum number of rows to return (default=no limit)
+
+        Returns:
+            iterator over the rows or None if client was unable to connect to
+            Presto
+        """
+        status = self._execute_query(sql, schema, catalog)
+        if status:
+            return self._iter_rows(max_rows)
+        else:
+            return None
+
     def _execute_query(self, sql, schema, catalog):
         if not sql:
             raise InvalidArgumentError("SQL query missing")
@@ -123,19 +204,17 @@ class PrestoClient:
             _LOGGER.info("Connecting to server at: " + self.server +
                          ":" + str(self.port) + " as user " + self.user +
                          " to execute query " + sql)
-            conn = self._get_connection()
             self._add_auth_headers(headers)
-            conn.request("POST", "/v1/statement", sql, headers)
-            response = conn.getresponse()
+            response = self._request("POST", "/v1/statement", sql, headers)
 
             if response.status != 200:
-                conn.close()
+                self._close_connection()
                 _LOGGER.error("Connection error: " +
                               str(response.status) + " " + response.reason)
                 return False
 
             answer = response.read()
-            conn.close()
+            self.poll_stats.add_response(answer)
 
             self.response_from_server = json.loads(answer)
             _LOGGER.info("Query executed successfully: %s" % (sql))
@@ -157,81 +236,190 @@ class PrestoClient:
         Remove the scheme and host/port from the uri; the connection itself
         has that information.
         """
-        parts = list(urlparse.urlsplit(uri))
-        parts[0] = None
-        parts[1] = None
-        location = urlparse.urlunsplit(parts)
-        conn = self._get_connection()
-        headers = {"X-Presto-User": self.user}
-        self._add_auth_headers(headers)
-        conn.request("GET", location, headers=headers)
-        response = conn.getresponse()
+        response = self._request("GET", self._location(uri),
+                                 headers=self._get_headers())
 
         if response.status != 200:
-            conn.close()
+            self._close_connection()
             _LOGGER.error("Error making GET request to %s: %s %s" %
                           (uri, response.status, response.reason))
             return False
 
         answer = response.read()
-        conn.close()
+        self.poll_stats.add_response(answer)
 
         self.response_from_server = json.loads(answer)
         _LOGGER.info("GET request successful for uri: " + uri)
         return True
 
-    def _build_results_from_response(self):
+    @staticmethod
+    def _location(uri):
+        parts = list(urlparse.urlsplit(uri))
+        parts[0] = None
+        parts[1] = None
+        return urlparse.urlunsplit(parts)
+
+    def _get_headers(self):
+        headers = {"X-Presto-User": self.user}
+        self._add_auth_headers(headers)
+        return headers
+
+    def _iter_rows(self, max_rows=None):
         """
-        Build result from the response
+        Yields the rows of the query, following 'nextUri' from the previous
+        response to get the next page until there is no more 'nextUri', which
+        means the query is finished.
 
-        The reponse_from_server may contain up to 3 uri's.
-        1. link to fetch the next packet of data ('nextUri')
-        2. TODO: information about the query execution ('infoUri')
-        3. TODO: cancel the query ('partialCancelUri').
+        While the server has no new rows for the query, the client backs off
+        exponentially between requests instead of polling in a tight loop.
+
+        If a page can't be fetched, or the query takes longer than max_wait,
+        iteration stops and query_failed is set. If iteration stops before
+        the query is finished for any reason other than a failed request, the
+        query is cancelled.
         """
-        if NEXT_URI_RESP in self.response_from_server:
-            self.next_uri = self.response_from_server[NEXT_URI_RESP]
-        else:
-            self.next_uri = ""
+        num_rows = 0
+        finished = False
+        empty_responses = 0
+        try:
+            while True:
+                rows = self.response_from_server.get(DATA_RESP, [])
+                for row in rows:
+                    if max_rows is not None and num_rows >= max_rows:
+                        return
+                    num_rows += 1
+                    yield row
+
+                self.next_uri = self.response_from_server.get(NEXT_URI_RESP,
+                                                              '')
+                if not self.next_uri:
+                    finished = True
+                    return
+                if max_rows is not None and num_rows >= max_rows:
+                    return
+
+                empty_responses = 0 if rows else empty_responses + 1
+                delay = self._poll_delay(empty_responses)
+                if self.max_wait is not None and \
+                        self.poll_stats.elapsed() + delay > self.max_wait:
+                    _LOGGER.error('Query did not finish within %ss' %
+                                  self.max_wait)
+                    self.query_failed = True
+                    return
+                if delay:
+                    time.sleep(delay)
+                    self.poll_stats.waited += delay
+
+                if not self._get_response_from(self.next_uri):
+                    self.query_failed = True
+                    finished = True
+                    return
+        finally:
+            if not finished:
+                self._cancel_query()
+            _LOGGER.info('Query stats: %s' % self.poll_stats)
 
-        if DATA_RESP in self.response_from_server:
-            if self.rows:
-                self.rows.extend(self.response_from_server[DATA_RESP])
-            else:
-                self.rows = self.response_from_server[DATA_RESP]
+    @staticmethod
+    def _poll_delay(empty_responses):
+        if empty_responses <= 1:
+            return 0
+        return min(POLL_INITIAL_INTERVAL * 2 ** (empty_responses - 2),
+                   POLL_MAX_INTERVAL)
+
+    def _cancel_query(self):
+        """
+        Cancels the query by sending a DELETE to the 'nextUri' of the last
+        response, so the coordinator can release the query's resources
+        without waiting for the client to abandon it.
+        """
+        self.next_uri = ''
+        uri = self.response_from_server.get(NEXT_URI_RESP)
+        if not uri:
+            return
+        try:
+            response = self._request("DELETE", self._location(uri),
+                                     headers=self._get_headers())
+            response.read()
+            _LOGGER.info("Cancelled query at uri %s: %s %s" %
+                         (uri, response.status, response.reason))
+        except (HTTPException, socket.error) as e:
+            self._close_connection()
+            _LOGGER.warn("Error cancelling query at uri %s: %s" % (uri, e))
 
     def _get_rows(self, num_of_rows=NUM_ROWS):
         """
         Get the rows returned from the query.
 
-        The client sends GET requests to the server using the 'nextUri'
-        from the previous response until the servers response does not
-        contain anymore 'nextUri's.  When there is no 'nextUri' the query is
-        finished
-
         Note that this can only be called once and does not page through
         the results.
 
         Parameters:
             num_of_rows: to be retrieved. 1000 by default
-        """
-        if num_of_rows == 0:
-            return []
 
-        self._build_results_from_response()
-
-        if not self._get_next_uri():
-            return []
-
-        while self._get_next_uri():
-            if not self._get_response_from(self._get_next_uri()):
-                return []
-            if (len(self.rows) <= num_of_rows):
-                self._build_results_from_response()
+        Returns:
+            list of at most num_of_rows rows, or [] if the query failed
+        """
+        self.rows = list(self._iter_rows(num_of_rows))
+        if self.query_failed:
+            self.rows = []
         return self.rows
 
-    def _get_next_uri(self):
-        return self.next_uri
+    def _request(self, method, location, body=None, headers={}):
+        """
+        Sends a request over the client's keep-alive connection to the
+        server, opening a new connection if there isn't one.
+
+        The server may have closed a connection that sat idle between
+        requests, so a GET or DELETE that fails on a connection that has been
+        used before is retried once on a new connection. Other requests, such
+        as the POST that starts a query, would run twice if the server got
+        the first one, so they are not retried, and are only sent on an idle
+        connection that the server hasn't closed.
+        """
+        if method not in IDEMPOTENT_METHODS and self._connection is not None \
+                and not self._connection_is_open():
+            self._close_connection()
+        reused = self._connection is not None
+        try:
+            return self._send(method, location, body, headers)
+        except (HTTPException, socket.error) as e:
+            self._close_connection()
+            if not reused or method not in IDEMPOTENT_METHODS:
+                raise
+            _LOGGER.info('Reconnecting to %s:%s after error on idle '
+                         'connection: %s' % (self.server, self.port, e))
+            return self._send(method, location, body, headers)
+
+    def _send(self, method, location, body, headers):
+        if self._connection is None:
+            self._connection = self._get_connection()
+        self._connection.request(method, location, body, headers)
+        response = self._connection.getresponse()
+        self._last_used = time.time()
+        return response
+
+    def _connection_is_open(self):
+        """
+        Returns whether the idle connection looks open: it hasn't been idle
+        for long, and the server hasn't closed it, which would make its
+        socket readable.
+        """
+        if time.time() - self._last_used > MAX_IDLE_FOR_UNSAFE_REQUESTS:
+            return False
+        sock = self._connection.sock
+        if sock is None:
+            # httplib connects again for the next request.
+            return True
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return False
+        return not readable
+
+    def _close_connection(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
 
     def _get_connection(self):
         if self.coordinator_config.use_https():
@@ -17,9 +17,14 @@ Module for installing, monitoring, and controlling presto server
 using presto-admin
 """
 import cgi
+import fcntl
+import json
 import logging
 import re
+import shutil
 import sys
+import threading
+import time
 import urllib2
 import urlparse
 from contextlib import closing
@@ -42,18 +47,33 @@ from prestoadmin.util import constants
 from prestoadmin.util.base_config import requires_config
 from prestoadmin.util.exception import ConfigFileNotFoundError, ConfigurationError
 from prestoadmin.util.fabricapi import get_host_list, get_coordinator_role
-from prestoadmin.util.local_config_util import get_catalog_directory
+from prestoadmin.util.filesystem import ensure_directory_exists, move_with_sidecar, \
+    remove_with_sidecar
+from prestoadmin.util.local_config_util import get_catalog_directory, get_status_cache_path
+from prestoadmin.util.package_facts import get_presto_package, clear_package_facts, \
+    ALL_PRESTO_PACKAGE_NAMES
 from prestoadmin.util.remote_config_util import lookup_port, \
-    lookup_server_log_file, lookup_launcher_log_file, lookup_string_config
+    lookup_server_log_file, lookup_launcher_log_file, lookup_string_config, \
+    clear_config_snapshot
+from prestoadmin.util.rpm_cache import RpmCache
 from prestoadmin.util.version_util import VersionRange, VersionRangeList, \
     split_version, strip_tag
 
 __all__ = ['install', 'uninstall', 'upgrade', 'start', 'stop', 'restart',
-           'status']
+           'rolling_restart', 'status']
 
 INIT_SCRIPTS = '/etc/init.d/presto'
 RETRY_TIMEOUT = 120
+# How often a rolling restart checks whether a batch has rejoined the cluster,
+# and how many of the slowest nodes it reports at the end.
+ROLLING_RESTART_POLL_INTERVAL = 5
+SLOWEST_NODES_REPORTED = 3
+# How often server status --watch queries the coordinator, and how old the
+# result of probing a host over SSH can get before the host is probed again.
+WATCH_INTERVAL = 5
+WATCH_STALE_AFTER = 60
 SYSTEM_RUNTIME_NODES = 'select * from system.runtime.nodes'
+NODE_STATES = 'select node_id, state from system.runtime.nodes'
 
 
 def old_sysnode_processor(node_info_rows):
@@ -67,25 +87,25 @@ def new_sysnode_processor(node_info_rows):
     return get_sysnode_info_from(node_info_rows, lambda x: x)
 
 
-NODE_INFO_PER_URI_SQL = VersionRangeList(
+NODE_INFO_SQL = VersionRangeList(
     VersionRange((0, 0), (0, 128),
-                 ('select http_uri, node_version, active from '
-                  'system.runtime.nodes where '
-                  'url_extract_host(http_uri) = \'%s\'',
+                 ('select node_id, http_uri, node_version, active from '
+                  'system.runtime.nodes',
                   old_sysnode_processor)),
     VersionRange((0, 128), (sys.maxsize,),
-                 ('select http_uri, node_version, state from '
-                  'system.runtime.nodes where '
-                  'url_extract_host(http_uri) = \'%s\'',
+                 ('select node_id, http_uri, node_version, state from '
+                  'system.runtime.nodes',
                   new_sysnode_processor))
 )
 
-EXTERNAL_IP_SQL = 'select url_extract_host(http_uri) from ' \
-                  'system.runtime.nodes WHERE node_id = \'%s\''
 CATALOG_INFO_SQL = 'select catalog_name from system.metadata.catalogs'
 _LOGGER = logging.getLogger(__name__)
 
 DOWNLOAD_DIRECTORY = '/tmp'
+DOWNLOAD_BLOCK_SIZE = 16 * 1024 * 1024
+DOWNLOAD_CONNECTIONS = 4
+# Smaller rpms aren't worth opening more connections for.
+MIN_PARALLEL_DOWNLOAD_SIZE = 64 * 1024 * 1024
 DEFAULT_RPM_NAME = 'presto-server-rpm.rpm'
 LATEST_RPM_URL = 'https://repository.sonatype.org/service/local/artifact/maven' \
                  '/content?r=central-proxy&g=io.prestosql' \
@@ -108,7 +128,7 @@ class LocalPrestoRpmFinder:
             package.check_if_valid_rpm(rpm_path)
         except SystemExit:
             try:
-                os.remove(rpm_path)
+                remove_with_sidecar(rpm_path)
                 warn('Removed corrupted rpm at: %s' % rpm_path)
             except OSError:
                 pass
@@ -187,6 +207,23 @@ class UrlHandler:
             else:
                 return 'presto-server-rpm-' + version + '.rpm'
 
+    def accepts_ranges(self):
+        return self.url_response.info().get('Accept-Ranges', '').strip().lower() == 'bytes'
+
+    def open_range(self, start, end=None):
+        """
+        Returns a response for bytes start to end, inclusive, of the url, or
+        from start to the end of the file if end is None.
+        """
+        request = urllib2.Request(self.get_url())
+        request.add_header('Range', 'bytes=%d-%s' % (start, '' if end is None else end))
+        response = urllib2.urlopen(request)
+        content_range = response.info().get('Content-Range', '')
+        if response.getcode() != 206 or not content_range.startswith('bytes %d-' % start):
+            response.close()
+            raise IOError('Url %s did not return bytes %d-%s' % (self.url, start, '' if end is None else end))
+        return response
+
     def read_block(self, block_size):
         return self.url_response.read(block_size)
 
@@ -196,28 +233,125 @@ class UrlHandler:
 
 
 class PrestoRpmDownloader:
-    def __init__(self, url_handler):
+    def __init__(self, url_handler, connections=DOWNLOAD_CONNECTIONS):
         self.url_handler = url_handler
+        self.connections = connections
+        self._bytes_read = 0
+        self._lock = threading.Lock()
 
     def download_rpm(self, version=None):
+        """
+        Downloads the rpm into a .part file next to its download path, and
+        renames it once the whole rpm is there and its digests check out, so
+        that an interrupted download never leaves a partial rpm behind.
+
+        If the server accepts range requests, a download picks up the .part
+        file left by an interrupted one, and a large rpm is downloaded in
+        self.connections segments at once, each into its own .part.<n> file.
+        """
         content_length = self.url_handler.get_content_length()
         download_file_path = self.get_download_file_path(version)
+        part_path = download_file_path + '.part'
 
-        with open(download_file_path, 'wb') as local_file:
-            bytes_read = 0
-            block_size = 16 * 1024 * 1024
-            while True:
-                download_buffer = self.url_handler.read_block(block_size)
-                if not download_buffer:
-                    break
-                bytes_read += len(download_buffer)
-                local_file.write(download_buffer)
-                self.print_download_status(bytes_read, content_length)
-            print("Downloaded %d bytes" % bytes_read)
+        segments = self._plan_segments(content_length)
+        if len(segments) == 1:
+            self._fetch_segment(part_path, 0, content_length)
+        else:
+            segment_paths = ['%s.%d' % (part_path, i) for i in range(len(segments))]
+            self._fetch_segments(segment_paths, segments)
+            with open(part_path, 'wb') as part_file:
+                for segment_path in segment_paths:
+                    with open(segment_path, 'rb') as segment_file:
+                        shutil.copyfileobj(segment_file, part_file)
+            for segment_path in segment_paths:
+                os.remove(segment_path)
+        print("Downloaded %d bytes" % self._bytes_read)
+
+        if content_length is not None and os.path.getsize(part_path) != content_length:
+            abort('Downloaded %d of %d bytes of %s. Run the command again to resume the download.'
+                  % (os.path.getsize(part_path), content_length, self.url_handler.get_url()))
+        if not LocalPrestoRpmFinder._check_rpm_uncorrupted(part_path):
+            abort('The rpm downloaded from %s is corrupted.' % self.url_handler.get_url())
+        move_with_sidecar(part_path, download_file_path)
 
         print('Rpm downloaded to: %s' % download_file_path)
         return download_file_path
 
+    def _plan_segments(self, content_length):
+        if self.connections < 2 or content_length is None or \
+                content_length < MIN_PARALLEL_DOWNLOAD_SIZE or \
+                not self.url_handler.accepts_ranges():
+            return [(0, content_length)]
+        segment_size = -(-content_length // self.connections)
+        return [(start, min(segment_size, content_length - start))
+                for start in range(0, content_length, segment_size)]
+
+    def _fetch_segments(self, segment_paths, segments):
+        errors = []
+
+        def fetch(path, start, length):
+            try:
+                self._fetch_segment(path, start, length)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=fetch, args=(path, start, length))
+                   for path, (start, length) in zip(segment_paths, segments)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def _fetch_segment(self, path, start, length):
+        """
+        Downloads length bytes of the url, or the rest of it if length is
+        None, starting at start, and appends them to what is already in
+        path.
+        """
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        if offset and (not self.url_handler.accepts_ranges() or
+                       length is None or offset > length):
+            offset = 0
+        self._add_progress(offset)
+        if length is not None and offset == length:
+            return
+
+        response = None
+        if start + offset == 0:
+            # Nothing to skip, so use the response that is already open.
+            read_block = self.url_handler.read_block
+        else:
+            _LOGGER.info('Resuming download of %s at byte %d' % (path, start + offset))
+            response = self.url_handler.open_range(
+                start + offset, None if length is None else start + length - 1)
+            read_block = response.read
+
+        remaining = None if length is None else length - offset
+        try:
+            with open(path, 'ab' if offset else 'wb') as local_file:
+                while remaining is None or remaining > 0:
+                    block_size = DOWNLOAD_BLOCK_SIZE if remaining is None \
+                        else min(DOWNLOAD_BLOCK_SIZE, remaining)
+                    download_buffer = read_block(block_size)
+                    if not download_buffer:
+                        break
+                    local_file.write(download_buffer)
+                    if remaining is not None:
+                        remaining -= len(download_buffer)
+                    self._add_progress(len(download_buffer))
+        finally:
+            if response:
+                response.close()
+
+    def _add_progress(self, bytes_read):
+        if not bytes_read:
+            return
+        with self._lock:
+            self._bytes_read += bytes_read
+            self.print_download_status(self._bytes_read, self.url_handler.get_content_length())
+
     def get_download_file_path(self, version=None):
         return os.path.join(DOWNLOAD_DIRECTORY, self.url_handler.get_download_file_name(version))
 
@@ -247,6 +381,10 @@ class PrestoRpmFetcher:
         return self._find_or_download_latest_presto_rpm()
 
     def _find_or_download_rpm_by_version(self, rpm_version):
+        cached_rpm_path = RpmCache().find_version(rpm_version)
+        if cached_rpm_path:
+            print('Found presto rpm version %s in the rpm cache at: %s' % (rpm_version, cached_rpm_path))
+            return cached_rpm_path
         # See here for more information: http://search.maven.org/#api
         download_url = 'http://search.maven.org/remotecontent?filepath=io/prestosql/' \
                        'presto-server-rpm/' + rpm_version + '/presto-server-rpm-' + \
@@ -280,17 +418,37 @@ class PrestoRpmFetcher:
                       version attached to its name (presto-server-rpm-'version'.rpm)
                       rather than the default name
 
+        An rpm that was downloaded from the same url before is taken from the rpm
+        cache without contacting the server. The latest rpm url always points at
+        the newest rpm, so it is only looked up after the server has redirected it
+        to the url of a specific rpm.
+
         If downloading the presto rpm at the given url would overwrite an existing rpm,
         this function returns the path to the existing rpm. However, if the rpm that
         would be downloaded takes the default rpm name, it will overwrite the existing
         rpm because there is no way to know if the default rpm name is of the same version
         as the requested rpm. If the rpm is corrupted, this function will remove the corrupted
-        rpm and attempt to download it.
+        rpm and attempt to download it. Downloaded rpms are moved into the rpm cache.
 
         Returns:
             The path to the downloaded or found presto rpm
         """
+        rpm_cache = RpmCache()
+        if url != LATEST_RPM_URL:
+            cached_rpm_path = rpm_cache.find_url(url)
+            if cached_rpm_path:
+                print('Found presto rpm from %s in the rpm cache at: %s' % (url, cached_rpm_path))
+                return cached_rpm_path
+
         with UrlHandler(url) as url_handler:
+            urls = set([url, url_handler.get_url()]) - set([LATEST_RPM_URL])
+            if url_handler.get_url() not in (url, LATEST_RPM_URL):
+                cached_rpm_path = rpm_cache.find_url(url_handler.get_url())
+                if cached_rpm_path:
+                    print('Found presto rpm from %s in the rpm cache at: %s'
+                          % (url_handler.get_url(), cached_rpm_path))
+                    return cached_rpm_path
+
             downloader = PrestoRpmDownloader(url_handler)
             download_file_path = downloader.get_download_file_path(version)
             local_finder = LocalPrestoRpmFinder(download_file_path)
@@ -305,7 +463,10 @@ class PrestoRpmFetcher:
             print('Downloading rpm from %s\n'
                   'to %s\n'
                   'This can take a few minutes' % (url_handler.get_url(), download_file_path))
-            return downloader.download_rpm(version)
+            downloaded_rpm_path = downloader.download_rpm(version)
+        cached_rpm_path = rpm_cache.add(downloaded_rpm_path, urls)
+        print('Rpm added to the rpm cache at: %s' % cached_rpm_path)
+        return cached_rpm_path
 
     def get_path_to_presto_rpm(self):
         """
@@ -377,10 +538,20 @@ def install(rpm_specifier):
                         flag to rpm -i.
 
         --no-config-update - pass this in order to avoid server update after installation
+
+        --rpm-relay=N - (optional) Copy the rpm to N nodes, which relay it
+                        to the other nodes over ssh instead of all of them
+                        getting it from this host. The nodes log in to each
+                        other with the keys in your ssh agent, which is
+                        forwarded to them, so root on any node can use your
+                        agent while the rpm is relayed.
     """
     rpm_fetcher = PrestoRpmFetcher(rpm_specifier)
     path_to_rpm = rpm_fetcher.get_path_to_presto_rpm()
     package.check_if_valid_rpm(path_to_rpm)
+    package.local_checksum(path_to_rpm)
+    if env.get('rpm_relay_seeds'):
+        package.relay(path_to_rpm, get_host_list(), env.rpm_relay_seeds)
     return execute(deploy_install_configure, path_to_rpm, hosts=get_host_list())
 
 
@@ -432,19 +603,14 @@ def uninstall():
     """
     stop()
 
-    if package.is_rpm_installed('presto'):
-        package.rpm_uninstall('presto')
-    elif package.is_rpm_installed('presto-server'):
-        package.rpm_uninstall('presto-server')
-    elif package.is_rpm_installed('presto-server-rpm'):
-        package.rpm_uninstall('presto-server-rpm')
-    elif package.is_rpm_installed('starburst-presto-server-rpm'):
-        package.rpm_uninstall('starburst-presto-server-rpm')
-    else:
+    installed = get_presto_package(ALL_PRESTO_PACKAGE_NAMES)
+    if installed is None:
         abort('Unable to uninstall package on: ' + env.host)
+    package.rpm_uninstall(installed[0])
 
 
 @task
+@runs_once
 @requires_config(StandaloneConfig)
 def upgrade(new_rpm_path, local_config_dir=None, overwrite=False):
     """
@@ -476,6 +642,13 @@ def upgrade(new_rpm_path, local_config_dir=None, overwrite=False):
                                 dependencies. Equivalent to adding --nodeps
                                 flag to rpm -U.
     """
+    if not os.path.isfile(new_rpm_path):
+        abort('RPM file not found at %s.' % new_rpm_path)
+    package.local_checksum(new_rpm_path)
+    return execute(stop_upgrade_configure, new_rpm_path, hosts=get_host_list())
+
+
+def stop_upgrade_configure(new_rpm_path):
     stop()
 
     temp_config_tar = configure_cmds.gather_config_directory()
@@ -573,6 +746,104 @@ def restart():
         check_status_for_control_commands()
 
 
+@task
+@runs_once
+@requires_config(StandaloneConfig)
+def rolling_restart(batch_size=1, timeout=RETRY_TIMEOUT):
+    """
+    Restart the Presto server on the workers a batch at a time, and then on
+    the coordinator, so that the cluster keeps running.
+
+    Each batch of workers is restarted in parallel, and the next batch is
+    only restarted once the coordinator has dropped every worker of the batch
+    and then lists it as active again in system.runtime.nodes. The rolling
+    restart stops if a batch fails to restart or to rejoin the cluster. The
+    coordinator is only restarted if it is one of the selected hosts.
+
+    Parameters:
+        batch_size - number of workers to restart at a time.  default 1
+        timeout - seconds to wait for a batch to rejoin the cluster.
+                  default 120
+    """
+    batch_size = _positive_int(batch_size, 'batch_size')
+    timeout = _positive_int(timeout, 'timeout')
+    hosts = get_host_list()
+    coordinator_role = get_coordinator_role()
+    workers = [host for host in hosts if host not in coordinator_role]
+    batches = [workers[i:i + batch_size] for i in range(0, len(workers), batch_size)]
+    coordinators = [host for host in coordinator_role if host in hosts]
+    if coordinators:
+        batches.append(coordinators)
+
+    rejoin_times = {}
+    with closing(PrestoClient(coordinator_role[0], env.user)) as client:
+        for number, batch in enumerate(batches, 1):
+            print('Restarting batch %d of %d: %s' % (number, len(batches), ', '.join(batch)))
+            start = time.time()
+            with settings(hide('running')):
+                restarted = execute(stop_and_start, hosts=batch)
+            failed = [host for host in batch if restarted.get(host) is not True]
+            if failed:
+                abort('Could not restart the Presto server on %s. Stopping the rolling '
+                      'restart.' % ', '.join(failed))
+
+            node_ids = dict((host, get_node_id(host)) for host in batch)
+            rejoin_times.update(wait_for_nodes(client, node_ids, start, timeout))
+            print('Batch %d of %d rejoined the cluster in %.1fs'
+                  % (number, len(batches), time.time() - start))
+
+    slowest = sorted(rejoin_times.items(), key=lambda item: -item[1])
+    print('Rolling restart complete. Slowest nodes to rejoin: ' +
+          ', '.join('%s (%.1fs)' % item for item in slowest[:SLOWEST_NODES_REPORTED]))
+
+
+def _positive_int(value, name):
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        abort('%s must be a positive integer, not %s' % (name, value))
+    return number
+
+
+def wait_for_nodes(client, node_ids, start, timeout):
+    """
+    Waits until every host in node_ids has rejoined the cluster, and returns
+    the seconds from start until each host rejoined. Aborts if that takes
+    more than timeout seconds.
+
+    A restarted node keeps its node id, and the coordinator goes on listing
+    it as active until it notices that the node went away. So a host only
+    counts as rejoined once system.runtime.nodes has shown its node id as
+    missing or not active, and then shows it as active again.
+    """
+    left = set()
+    rejoin_times = {}
+    while True:
+        try:
+            rows = client.run_sql(NODE_STATES) or []
+        except ConfigurationError as e:
+            _LOGGER.warn(e)
+            rows = []
+        states = dict((row[0], row[1]) for row in rows if len(row) >= 2)
+        now = time.time()
+        for host, node_id in node_ids.items():
+            if host in rejoin_times:
+                continue
+            if states.get(node_id) != 'active':
+                left.add(host)
+            elif host in left:
+                rejoin_times[host] = now - start
+        waiting = sorted(set(node_ids) - set(rejoin_times))
+        if not waiting:
+            return rejoin_times
+        if now - start > timeout:
+            abort('%s did not rejoin the cluster within %d seconds. Stopping the rolling '
+                  'restart.' % (', '.join(waiting), timeout))
+        time.sleep(ROLLING_RESTART_POLL_INTERVAL)
+
+
 def check_presto_version():
     """
     Checks that the Presto version is suitable.
@@ -589,26 +860,14 @@ def check_presto_version():
 
 
 def presto_installed():
-    with settings(hide('warnings', 'stdout'), warn_only=True):
-        package_search = run('rpm -q presto')
-        if not package_search.succeeded:
-            package_search = run('rpm -q presto-server-rpm')
-        if not package_search.succeeded:
-            package_search = run('rpm -q starburst-presto-server-rpm')
-        return package_search.succeeded
+    return get_presto_package() is not None
 
 
 def get_presto_version():
-    with settings(hide('warnings', 'stdout'), warn_only=True):
-        version = run('rpm -q --qf \"%{VERSION}\\n\" presto')
-        # currently we have two rpm names out so we need this retry
-        if not version.succeeded:
-            version = run('rpm -q --qf \"%{VERSION}\\n\" presto-server-rpm')
-        if not version.succeeded:
-            version = run('rpm -q --qf \"%{VERSION}\\n\" starburst-presto-server-rpm')
-        version = version.strip()
-        _LOGGER.debug('Presto rpm version: ' + version)
-        return version
+    package = get_presto_package()
+    version = package[1] if package else ''
+    _LOGGER.debug('Presto rpm version: ' + version)
+    return version
 
 
 def check_server_status():
@@ -625,7 +884,7 @@ def check_server_status():
     if len(get_coordinator_role()) < 1:
         warn('No coordinator defined.  Cannot verify server status.')
     with closing(PrestoClient(get_coordinator_role()[0], env.user)) as client:
-        node_id = lookup_string_config('node.id', os.path.join(constants.REMOTE_CONF_DIR, 'node.properties'), env.host)
+        node_id = get_node_id()
 
         try:
             return query_server_for_status(client, node_id)
@@ -636,9 +895,11 @@ def check_server_status():
 @retry(stop_max_delay=RETRY_TIMEOUT * 1000, wait_fixed=5000, retry_on_result=lambda result: result is False)
 def query_server_for_status(client, node_id):
     try:
-        rows = client.run_sql(SYSTEM_RUNTIME_NODES)
+        rows = client.iter_sql(SYSTEM_RUNTIME_NODES)
         if rows is not None:
-            return _is_in_rows(node_id, rows)
+            # Stop reading, and cancel the query, once the node is found.
+            with closing(rows):
+                return _is_in_rows(node_id, rows)
     except ConfigurationError as e:
         _LOGGER.warn(e)
     return False
@@ -661,33 +922,24 @@ def execute_catalog_info_sql(client):
     return client.run_sql(CATALOG_INFO_SQL)
 
 
-def execute_external_ip_sql(client, uuid):
-    """
-    Returns external ip of the host with uuid after parsing the http_uri column
-    from nodes system table
-
-    Parameters:
-        client - client that executes the query
-        uuid - node_id of the node
-    """
-    return client.run_sql(EXTERNAL_IP_SQL % uuid)
-
-
-def get_sysnode_info_from(node_info_row, state_transform):
+def get_sysnode_info_from(node_info_rows, state_transform):
     """
-    Returns system node info dict from node info row for a node
+    Returns system node info from the rows of the nodes system table, grouped
+    by node id
 
     Parameters:
-        node_info_row -
+        node_info_rows - [node_id, http_uri, node_version, state] rows
 
     Returns:
         Node info dict in format:
-        {'http://node1/statement': [presto-main:0.97-SNAPSHOT, True]}
+        {'node-id': {'http://node1/statement': [presto-main:0.97-SNAPSHOT,
+                                                'active']}}
     """
     output = {}
-    for row in node_info_row:
+    for row in node_info_rows:
         if row:
-            output[row[0]] = [row[1], state_transform(row[2])]
+            output.setdefault(row[0], {})[row[1]] = [row[2],
+                                                     state_transform(row[3])]
 
     _LOGGER.info('Node info: %s ', output)
     return output
@@ -726,109 +978,247 @@ def get_roles_for(host):
     return roles
 
 
-def print_node_info(node_status, catalog_status):
+def format_node_info(node_status, catalog_status):
+    lines = []
     for k in node_status:
-        print('\tNode URI(http): ' + str(k) +
-              '\n\tPresto Version: ' + str(node_status[k][0]) +
-              '\n\tNode status:    ' + str(node_status[k][1]))
+        lines.extend(['\tNode URI(http): ' + str(k),
+                      '\tPresto Version: ' + str(node_status[k][0]),
+                      '\tNode status:    ' + str(node_status[k][1])])
         if catalog_status:
-            print('\tCatalogs:     ' + catalog_status)
+            lines.append('\tCatalogs:     ' + catalog_status)
+    return lines
 
 
-def get_ext_ip_of_node(client):
-    node_properties_file = os.path.join(constants.REMOTE_CONF_DIR,
-                                        'node.properties')
-    with settings(hide('stdout')):
-        node_uuid = sudo('sed -n s/^node.id=//p ' + node_properties_file)
-    external_ip_row = execute_external_ip_sql(client, node_uuid)
+def get_ext_ip_from(node_status, host):
+    """
+    Returns the external ip of host, as seen by the coordinator, given the
+    node info of the node id configured on host.
+    """
     external_ip = ''
-    if len(external_ip_row) > 1:
-        warn_more_than_one_ip = 'More than one external ip found for ' + env.host + \
+    if len(node_status) > 1:
+        warn_more_than_one_ip = 'More than one external ip found for ' + host + \
                                 '. There could be multiple nodes associated with the same node.id'
         _LOGGER.debug(warn_more_than_one_ip)
         warn(warn_more_than_one_ip)
         return external_ip
-    for row in external_ip_row:
-        if row:
-            external_ip = row[0]
+    for uri in node_status:
+        external_ip = urlparse.urlparse(uri).hostname
     if not external_ip:
-        _LOGGER.debug('Cannot get external IP for ' + env.host)
+        _LOGGER.debug('Cannot get external IP for ' + host)
         external_ip = 'Unknown'
     return external_ip
 
 
-def print_status_header(external_ip, server_status, host):
-    print('Server Status:')
-    print('\t%s(IP: %s, Roles: %s): %s' % (host, external_ip,
-                                           ', '.join(get_roles_for(host)),
-                                           is_server_up(server_status)))
+def get_node_id(host=None):
+    return lookup_string_config('node.id', os.path.join(constants.REMOTE_CONF_DIR, 'node.properties'),
+                                host or env.host)
+
+
+def format_status_header(external_ip, server_status, host):
+    return ['Server Status:',
+            '\t%s(IP: %s, Roles: %s): %s' % (host, external_ip,
+                                             ', '.join(get_roles_for(host)),
+                                             is_server_up(server_status))]
 
 
 @parallel
 def collect_node_information():
-    with closing(PrestoClient(get_coordinator_role()[0], env.user)) as client:
-        with settings(hide('warnings')):
-            error_message = check_presto_version()
-        if error_message:
-            external_ip = 'Unknown'
+    """
+    Returns (node_id, is_running, error_message, version) for env.host. The
+    coordinator is queried once for every node afterwards, so nothing here
+    talks to it.
+    """
+    with settings(hide('warnings')):
+        error_message = check_presto_version()
+    if error_message:
+        return None, False, error_message, ''
+
+    with settings(hide('warnings', 'aborts', 'stdout')):
+        try:
+            node_id = get_node_id()
+        except:
+            node_id = None
+        try:
+            is_running = service('status')
+        except:
             is_running = False
-        else:
-            with settings(hide('warnings', 'aborts', 'stdout')):
-                try:
-                    external_ip = get_ext_ip_of_node(client)
-                except:
-                    external_ip = 'Unknown'
-                try:
-                    is_running = service('status')
-                except:
-                    is_running = False
-        return external_ip, is_running, error_message
+        version = get_presto_version()
+    return node_id, is_running, error_message, version
+
+
+@parallel
+def reprobe_node_information():
+    """
+    Like collect_node_information, but forgets what is cached about the
+    packages and configuration of env.host first, so that changes made since
+    the last probe are seen.
+    """
+    clear_package_facts(env.host)
+    clear_config_snapshot(env.host)
+    return collect_node_information()
+
+
+def get_query_version(node_information):
+    """
+    Returns the version to pick the nodes query by: the coordinator's if it is
+    known, else that of any other node, else the latest.
+    """
+    hosts = get_coordinator_role() + get_host_list()
+    for host in hosts:
+        info = node_information.get(host)
+        if info and not isinstance(info, Exception) and info[3]:
+            version = strip_tag(split_version(info[3]))
+            if version:
+                return version
+    return (sys.maxsize,)
 
 
 def get_status_from_coordinator():
+    with settings(hide('running')):
+        node_information = execute(collect_node_information,
+                                   hosts=get_host_list())
+
+    with closing(PrestoClient(get_coordinator_role()[0], env.user)) as client:
+        coordinator_status, catalog_status = query_coordinator_status(
+            client, node_information)
+
+    for host in get_host_list():
+        print('\n'.join(format_host_status(host, node_information[host],
+                                           coordinator_status, catalog_status)))
+
+
+def query_coordinator_status(client, node_information, with_catalogs=True):
+    """
+    Returns the node info of the nodes the coordinator knows about, grouped by
+    node id, and its catalogs, or an empty dict and list if the coordinator
+    can't be queried. The catalogs are only queried if with_catalogs is set.
+    """
+    try:
+        query, processor = NODE_INFO_SQL.for_version(
+            get_query_version(node_information))
+        coordinator_status = processor(client.run_sql(query))
+        catalog_status = get_catalog_info_from(client) if with_catalogs else []
+    except BaseException as e:
+        # Just log errors that come from a missing port or anything else; if
+        # we can't connect to the coordinator, we just want to print out a
+        # minimal status anyway.
+        _LOGGER.warn(e.message)
+        coordinator_status = {}
+        catalog_status = []
+    return coordinator_status, catalog_status
+
+
+def format_host_status(host, host_information, coordinator_status,
+                       catalog_status):
+    """
+    Returns the lines of the status of host, given what
+    collect_node_information returned for it and what the coordinator
+    reported.
+    """
+    if isinstance(host_information, Exception):
+        node_id = None
+        is_running = False
+        error_message = host_information.message
+    else:
+        (node_id, is_running, error_message, _) = host_information
+
+    node_status = coordinator_status.get(node_id, {})
+    if error_message or not coordinator_status:
+        external_ip = 'Unknown'
+    else:
+        external_ip = get_ext_ip_from(node_status, host)
+
+    lines = format_status_header(external_ip, is_running, host)
+    if error_message:
+        lines.append('\t' + error_message)
+    elif not coordinator_status:
+        lines.append('\tNo information available: unable to query coordinator')
+    elif not is_running:
+        lines.append('\tNo information available')
+    elif node_status:
+        lines.extend(format_node_info(node_status, catalog_status))
+    else:
+        lines.append('\tNo information available: the coordinator has not yet'
+                     ' discovered this node')
+    return lines
+
+
+def watch_status():
+    """
+    Prints the status of the cluster, and then keeps printing the status of
+    the hosts whose status changes, until interrupted.
+
+    Only system.runtime.nodes is queried on every poll, over one connection
+    to the coordinator. A host is only probed over SSH again when its entry
+    in system.runtime.nodes changes, or when its last probe is more than
+    WATCH_STALE_AFTER seconds old.
+    """
+    hosts = get_host_list()
+    with settings(hide('running')):
+        node_information = execute(collect_node_information, hosts=hosts)
+    # Spread the probes of stale hosts evenly, instead of probing every host
+    # again at the same time.
+    start = time.time()
+    probe_times = dict((host, start - i * WATCH_STALE_AFTER / len(hosts))
+                       for i, host in enumerate(hosts))
+    shown = {}
+
     with closing(PrestoClient(get_coordinator_role()[0], env.user)) as client:
+        coordinator_status, catalog_status = query_coordinator_status(
+            client, node_information)
         try:
-            coordinator_status = client.run_sql(SYSTEM_RUNTIME_NODES)
-            catalog_status = get_catalog_info_from(client)
-        except BaseException as e:
-            # Just log errors that come from a missing port or anything else; if
-            # we can't connect to the coordinator, we just want to print out a
-            # minimal status anyway.
-            _LOGGER.warn(e.message)
-            coordinator_status = []
-            catalog_status = []
-
-        with settings(hide('running')):
-            node_information = execute(collect_node_information,
-                                       hosts=get_host_list())
-
-        for host in get_host_list():
-            if isinstance(node_information[host], Exception):
-                external_ip = 'Unknown'
-                is_running = False
-                error_message = node_information[host].message
-            else:
-                (external_ip, is_running, error_message) = node_information[host]
-
-            print_status_header(external_ip, is_running, host)
-            if error_message:
-                print('\t' + error_message)
-            elif not coordinator_status:
-                print('\tNo information available: unable to query coordinator')
-            elif not is_running:
-                print('\tNo information available')
-            else:
-                version_string = get_presto_version()
-                version = strip_tag(split_version(version_string))
-                query, processor = NODE_INFO_PER_URI_SQL.for_version(version)
-                # just get the node_info row for the host if server is up
-                node_info_row = client.run_sql(query % external_ip)
-                node_status = processor(node_info_row)
-                if node_status:
-                    print_node_info(node_status, catalog_status)
-                else:
-                    print('\tNo information available: the coordinator has not yet'
-                          ' discovered this node')
+            while True:
+                _print_status_changes(hosts, node_information, coordinator_status,
+                                      catalog_status, shown)
+                time.sleep(WATCH_INTERVAL)
+
+                new_status, _ = query_coordinator_status(
+                    client, node_information, with_catalogs=False)
+                now = time.time()
+                to_probe = [host for host in hosts
+                            if now - probe_times[host] > WATCH_STALE_AFTER or
+                            _node_status_changed(node_information[host],
+                                                 coordinator_status, new_status)]
+                if to_probe:
+                    with settings(hide('running')):
+                        node_information.update(
+                            execute(reprobe_node_information, hosts=to_probe))
+                    probe_times.update(dict.fromkeys(to_probe, now))
+                if new_status and not coordinator_status:
+                    _, catalog_status = query_coordinator_status(
+                        client, node_information)
+                coordinator_status = new_status
+        except KeyboardInterrupt:
+            pass
+
+
+def _node_status_changed(host_information, old_status, new_status):
+    if isinstance(host_information, Exception) or host_information[0] is None:
+        return False
+    node_id = host_information[0]
+    return old_status.get(node_id) != new_status.get(node_id)
+
+
+def _print_status_changes(hosts, node_information, coordinator_status,
+                          catalog_status, shown):
+    """
+    Prints the status of the hosts whose status differs from the one in
+    shown, which is updated. Nothing is printed if none has changed.
+    """
+    changed = []
+    with settings(hide('warnings')):
+        for host in hosts:
+            lines = format_host_status(host, node_information[host],
+                                       coordinator_status, catalog_status)
+            if shown.get(host) != lines:
+                shown[host] = lines
+                changed.append(lines)
+    if changed:
+        print('%s: %d of %d nodes changed' % (time.strftime('%H:%M:%S'),
+                                              len(changed), len(hosts)))
+        for lines in changed:
+            print('\n'.join(lines))
+        sys.stdout.flush()
 
 
 @task
@@ -838,5 +1228,108 @@ def get_status_from_coordinator():
 def status():
     """
     Print the status of presto in the cluster
+
+    Parameters:
+        --watch (optional) - keep printing the status of the nodes whose
+            status changes, until interrupted
+        --json (optional) - print the status as JSON
+        --status-ttl=SECONDS (optional) - with --json, print the status
+            collected by another presto-admin run if it is at most SECONDS
+            old.  default 0
+    """
+    if env.get('watch_status') and env.get('status_json'):
+        abort('--watch can not be used with --json')
+    if env.get('watch_status'):
+        watch_status()
+    elif env.get('status_json'):
+        snapshot = get_status_snapshot(env.get('status_ttl') or 0)
+        print(json.dumps(snapshot, indent=4, sort_keys=True))
+    else:
+        get_status_from_coordinator()
+
+
+def get_status_snapshot(ttl):
+    """
+    Returns the status of the cluster as a dict, collected by this run or,
+    if it is at most ttl seconds old, by an earlier one. With a ttl, the
+    snapshot is cached locally, under a lock, so that concurrent runs wait for
+    a single collection and share it. Without one, runs don't wait for each
+    other.
+    """
+    if not ttl:
+        return collect_status_snapshot()
+
+    cache_path = get_status_cache_path()
+    ensure_directory_exists(os.path.dirname(cache_path))
+    with open(cache_path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            try:
+                with open(cache_path) as f:
+                    snapshot = json.load(f)
+            except (IOError, ValueError):
+                snapshot = None
+            if snapshot and sorted(snapshot['hosts']) == sorted(get_host_list()) and \
+                    time.time() - snapshot['collected_at'] <= ttl:
+                return snapshot
+
+            snapshot = collect_status_snapshot()
+            temp_path = cache_path + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.rename(temp_path, cache_path)
+            return snapshot
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def collect_status_snapshot():
+    """
+    Returns the status of every host, as reported by the host and by the
+    coordinator, along with how long it took to collect.
+    """
+    start = time.time()
+    with settings(hide('running')):
+        node_information = execute(collect_timed_node_information,
+                                   hosts=get_host_list())
+    with closing(PrestoClient(get_coordinator_role()[0], env.user)) as client:
+        coordinator_status, catalog_status = query_coordinator_status(
+            client, node_information)
+    catalogs = [catalog for catalog in catalog_status.split(', ') if catalog] \
+        if catalog_status else []
+
+    hosts = {}
+    for host in get_host_list():
+        host_information = node_information[host]
+        if isinstance(host_information, Exception):
+            node_id, is_running, error_message, version, latency = \
+                None, False, host_information.message, '', None
+        else:
+            node_id, is_running, error_message, version, latency = host_information
+        node_status = coordinator_status.get(node_id, {})
+        with settings(hide('warnings')):
+            external_ip = get_ext_ip_from(node_status, host) if node_status else None
+        hosts[host] = {
+            'ip': external_ip if external_ip not in ('', 'Unknown') else None,
+            'roles': get_roles_for(host),
+            'running': bool(is_running),
+            'node_id': node_id,
+            'version': version or None,
+            'state': node_status.values()[0][1] if len(node_status) == 1 else None,
+            'catalogs': catalogs if node_status else [],
+            'error': error_message or None,
+            'latency': round(latency, 3) if latency is not None else None
+        }
+    return {'collected_at': start,
+            'collection_seconds': round(time.time() - start, 3),
+            'hosts': hosts}
+
+
+@parallel
+def collect_timed_node_information():
+    """
+    Returns what collect_node_information does, followed by the seconds it
+    took.
     """
-    get_status_from_coordinator()
+    start = time.time()
+    return collect_node_information() + (time.time() - start,)
@@ -36,6 +36,9 @@ TOPOLOGY_CONFIG_FILE = 'config.json'
 COORDINATOR_DIR_NAME = 'coordinator'
 WORKERS_DIR_NAME = 'workers'
 CATALOG_DIR_NAME = 'catalog'
+RPM_CACHE_DIR_NAME = 'rpms'
+LOG_OFFSETS_FILE = 'log_offsets.json'
+STATUS_CACHE_FILE = 'status_cache.json'
 
 # remote configuration
 REMOTE_CONF_DIR = '/etc/presto'
@@ -17,6 +17,7 @@ Logic for starting and stopping Fabric applications.
 """
 
 from fabric.network import disconnect_all
+from prestoadmin.util import presto_config, worker_pool
 from prestoadmin.util.application import Application
 
 import logging
@@ -35,14 +36,17 @@ class FabricApplication(Application):
     """
     A Presto Fabric application entry point.  Provides logging and exception
     handling features.  Additionally cleans up Fabric network connections
-    before exiting.
+    and worker processes before exiting.
     """
 
     def _exit_cleanup_hook(self):
         """
-        Disconnect all Fabric connections in addition to shutting down the
+        Stop the worker session, drop the cached coordinator config and
+        disconnect all Fabric connections in addition to shutting down the
         logging.
         """
+        worker_pool.end_session()
+        presto_config.end_config_cache()
         disconnect_all()
         Application._exit_cleanup_hook(self)
 
@@ -15,12 +15,17 @@
 """ Filesystem tools."""
 
 import errno
+import hashlib
+import json
 import logging
 import os
+import shutil
 
 
 logger = logging.getLogger(__name__)
 
+SIDECAR_SUFFIX = '.verified'
+
 
 def ensure_parent_directories_exist(path):
     try:
@@ -59,3 +64,67 @@ def write_to_file_if_not_exists(content, path):
     else:
         with os.fdopen(file_handle, 'w') as f:
             f.write(content)
+
+
+def sha256_of_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), ''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sidecar_path(path):
+    return path + SIDECAR_SUFFIX
+
+
+def read_sidecar(path):
+    """
+    Returns the facts recorded by write_sidecar() for the file at path, or
+    None if there are none, or if the size or modification time of the file
+    has changed since they were recorded.
+    """
+    try:
+        with open(sidecar_path(path)) as f:
+            record = json.load(f)
+        stat = os.stat(path)
+    except (IOError, OSError, ValueError):
+        return None
+    if record.get('size') != stat.st_size or \
+            record.get('mtime') != stat.st_mtime:
+        return None
+    return record.get('facts')
+
+
+def write_sidecar(path, facts):
+    """
+    Records facts about the file at path in a sidecar file next to it, so
+    that they don't have to be worked out again until the file changes. The
+    facts are a dict that can be serialized as JSON. A sidecar that can't be
+    written is only logged.
+    """
+    temp_path = sidecar_path(path) + '.tmp'
+    try:
+        stat = os.stat(path)
+        with open(temp_path, 'w') as f:
+            json.dump({'size': stat.st_size, 'mtime': stat.st_mtime,
+                       'facts': facts}, f)
+        os.rename(temp_path, sidecar_path(path))
+    except (IOError, OSError) as e:
+        logger.debug('Could not record facts about %s: %s' % (path, e))
+
+
+def remove_with_sidecar(path):
+    os.remove(path)
+    if os.path.exists(sidecar_path(path)):
+        os.remove(sidecar_path(path))
+
+
+def move_with_sidecar(source, destination):
+    """
+    Moves the file at source to destination, along with its sidecar if it
+    has one.
+    """
+    shutil.move(source, destination)
+    if os.path.exists(sidecar_path(source)):
+        shutil.move(sidecar_path(source), sidecar_path(destination))
@@ -14,7 +14,8 @@
 import os
 
 from prestoadmin.util.constants import LOG_DIR_ENV_VARIABLE, CONFIG_DIR_ENV_VARIABLE, DEFAULT_LOCAL_CONF_DIR, \
-    TOPOLOGY_CONFIG_FILE, COORDINATOR_DIR_NAME, WORKERS_DIR_NAME, CATALOG_DIR_NAME
+    TOPOLOGY_CONFIG_FILE, COORDINATOR_DIR_NAME, WORKERS_DIR_NAME, CATALOG_DIR_NAME, RPM_CACHE_DIR_NAME, \
+    LOG_OFFSETS_FILE, STATUS_CACHE_FILE
 
 
 def get_config_directory():
@@ -45,3 +46,15 @@ def get_workers_directory():
 
 def get_catalog_directory():
     return os.path.join(get_config_directory(), CATALOG_DIR_NAME)
+
+
+def get_rpm_cache_directory():
+    return os.path.join(get_config_directory(), RPM_CACHE_DIR_NAME)
+
+
+def get_log_offsets_path():
+    return os.path.join(get_config_directory(), LOG_OFFSETS_FILE)
+
+
+def get_status_cache_path():
+    return os.path.join(get_config_directory(), STATUS_CACHE_FILE)
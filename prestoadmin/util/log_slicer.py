@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cuts the entries that fall in a time window out of Presto's log files and
+writes them to a gzipped tar file, keeping at most a given number of bytes.
+
+collect logs copies this file to the nodes and runs it there, so it only uses
+the standard library, and runs under Python 2.6 and later as well as Python 3.
+
+Presto starts every log entry with a timestamp, such as
+2019-10-01T12:34:56.789-0700, and appends to its logs in time order, so the
+window is found with a binary search over the byte offsets of a log file,
+rather than by reading all of it. Lines without a timestamp, such as stack
+traces, belong to the entry before them. Gzipped logs can't be searched, so
+they are read through. The times in the window are compared with the
+timestamps as they are written in the logs.
+
+With --offsets, only the bytes added to a log since the offsets in that file
+were written are sliced, and the file is updated for the next run. Offsets
+are kept by inode, so a log that is rotated by renaming it keeps its offset,
+and the new log that replaces it is read from the start. The first bytes of
+each log are kept with its offset, so that a truncated log, or a new log that
+reuses an inode, is read from the start as well.
+"""
+import datetime
+import glob
+import gzip
+import hashlib
+import json
+import optparse
+import os
+import re
+import sys
+import tarfile
+import tempfile
+
+TIMESTAMP = re.compile(br'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.\d+)?(Z|[+-]\d{4})?')
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+HEAD_SIZE = 1024
+# Starts the lines that name the patterns that match no logs, so that collect
+# logs can tell them apart from anything else printed on the node.
+MISSING_PATTERN_PREFIX = 'prestoadmin: no logs match '
+
+
+def line_timestamp(line):
+    """
+    Returns the timestamp at the start of line, without its fraction of a
+    second and its zone, or None if the line doesn't start with one.
+    """
+    match = TIMESTAMP.match(line)
+    if match:
+        return match.group(1)
+    return None
+
+
+def _timestamp_after(log_file, offset):
+    """
+    Returns the timestamp of the first line with one that starts after
+    offset, or at offset if it is 0, along with the offset of that line. The
+    timestamp is None if there is no such line.
+    """
+    log_file.seek(offset)
+    if offset:
+        log_file.readline()
+    while True:
+        position = log_file.tell()
+        line = log_file.readline()
+        if not line:
+            return None, position
+        timestamp = line_timestamp(line)
+        if timestamp is not None:
+            return timestamp, position
+
+
+def find_offset(log_file, size, is_past):
+    """
+    Returns the offset of the first entry in log_file whose timestamp
+    is_past() returns True for, or size if there is none. is_past must be
+    False for the entries at the start of the file and True from some entry
+    on.
+    """
+    low, high = 0, size
+    while low < high:
+        middle = (low + high) // 2
+        timestamp, _ = _timestamp_after(log_file, middle)
+        if timestamp is None or is_past(timestamp):
+            high = middle
+        else:
+            low = middle + 1
+    timestamp, position = _timestamp_after(log_file, low)
+    return position if timestamp is not None else size
+
+
+def resolve_time(value, log_file):
+    """
+    Returns value as a timestamp to compare with those in log_file. Values
+    starting with - are a number of seconds before now, in the zone of the
+    timestamps in the log.
+    """
+    if value is None or not value.startswith('-'):
+        return value and value.encode('ascii')
+    log_file.seek(0)
+    zone = None
+    line = log_file.readline()
+    while line:
+        match = TIMESTAMP.match(line)
+        if match:
+            zone = match.group(2)
+            break
+        line = log_file.readline()
+    if zone is None:
+        now = datetime.datetime.now()
+    else:
+        now = datetime.datetime.utcnow()
+        if zone != b'Z':
+            minutes = int(zone[1:3]) * 60 + int(zone[3:5])
+            now += datetime.timedelta(minutes=minutes if zone[:1] == b'+' else -minutes)
+    then = now - datetime.timedelta(seconds=int(value[1:]))
+    return then.strftime(TIMESTAMP_FORMAT).encode('ascii')
+
+
+def _open_log(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def slice_log(path, since, until, offset=0):
+    """
+    Returns (file, start, end, size) for the part of the log at path in the
+    window, leaving out its first offset bytes. size is the length of the
+    log. Gzipped logs are decompressed into a temporary file first, and
+    their offset and size count the decompressed bytes.
+    """
+    if path.endswith('.gz'):
+        return _slice_gzipped_log(path, since, until, offset)
+    log_file = open(path, 'rb')
+    size = os.fstat(log_file.fileno()).st_size
+    since = resolve_time(since, log_file)
+    until = resolve_time(until, log_file)
+    start = find_offset(log_file, size, lambda t: t >= since) if since else 0
+    end = find_offset(log_file, size, lambda t: t > until) if until else size
+    start = min(max(start, offset), size)
+    return log_file, start, max(start, end), size
+
+
+def _slice_gzipped_log(path, since, until, offset):
+    sliced = tempfile.TemporaryFile()
+    log_file = _open_log(path)
+    size = 0
+    try:
+        since = resolve_time(since, log_file)
+        until = resolve_time(until, log_file)
+        log_file.seek(0)
+        in_window = False
+        for line in log_file:
+            timestamp = line_timestamp(line)
+            if timestamp is not None:
+                in_window = (not since or timestamp >= since) and \
+                    (not until or timestamp <= until)
+            if in_window and size >= offset:
+                sliced.write(line)
+            size += len(line)
+    finally:
+        log_file.close()
+    return sliced, 0, sliced.tell(), size
+
+
+def head_digest(path, length):
+    """
+    Returns a digest of the first length bytes of the log at path.
+    """
+    log_file = _open_log(path)
+    try:
+        return hashlib.md5(log_file.read(length)).hexdigest()
+    finally:
+        log_file.close()
+
+
+def resume_offset(path, saved):
+    """
+    Returns the offset to read the log at path from, given the offset saved
+    for its inode by an earlier run, or 0 if the log has been truncated or
+    replaced since.
+    """
+    if not saved:
+        return 0
+    offset = saved['offset']
+    if not path.endswith('.gz') and os.path.getsize(path) < offset:
+        return 0
+    if head_digest(path, min(offset, HEAD_SIZE)) != saved['head']:
+        return 0
+    return offset
+
+
+def cap_slices(slices, max_bytes):
+    """
+    Trims slices, a list of (name, file, start, end, mtime), to max_bytes in
+    total, keeping the newest entries. A trimmed slice starts at an entry, so
+    it can end up shorter than the bytes left for it. Returns the trimmed
+    list.
+    """
+    remaining = max_bytes
+    capped = []
+    for name, log_file, start, end, mtime in sorted(slices, key=lambda s: -s[4]):
+        if remaining <= 0:
+            break
+        if end - start > remaining:
+            timestamp, position = _timestamp_after(log_file, end - remaining)
+            start = position if timestamp is not None and position < end else end
+        remaining -= end - start
+        capped.append((name, log_file, start, end, mtime))
+    return capped
+
+
+def write_archive(archive, host, slices):
+    tar = tarfile.open(archive, 'w:gz')
+    try:
+        for name, log_file, start, end, mtime in slices:
+            info = tarfile.TarInfo('%s/%s' % (host, name))
+            info.size = end - start
+            info.mtime = mtime
+            info.mode = 0o644
+            log_file.seek(start)
+            tar.addfile(info, log_file)
+    finally:
+        tar.close()
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options] archive host pattern...')
+    parser.add_option('--since', help='start of the window, or -N for N seconds ago')
+    parser.add_option('--until', help='end of the window, or -N for N seconds ago')
+    parser.add_option('--max-bytes', type='int', help='most bytes of logs to keep')
+    parser.add_option('--offsets', help='file of the offsets to slice the logs from, '
+                                        'which is updated with their new sizes')
+    options, args = parser.parse_args(argv)
+    if len(args) < 3:
+        parser.error('need an archive, a host and at least one pattern')
+    archive, host, patterns = args[0], args[1], args[2:]
+
+    saved_offsets = {}
+    if options.offsets:
+        with open(options.offsets) as f:
+            saved_offsets = json.load(f)
+    offsets = {}
+    slices = []
+    for pattern in patterns:
+        paths = sorted(glob.glob(pattern))
+        if not paths:
+            # collect logs warns about patterns that match nothing.
+            print(MISSING_PATTERN_PREFIX + pattern)
+        for path in paths:
+            inode = str(os.stat(path).st_ino)
+            offset = resume_offset(path, saved_offsets.get(inode))
+            log_file, start, end, size = slice_log(path, options.since, options.until, offset)
+            offsets[inode] = {'path': path, 'offset': size,
+                              'head': head_digest(path, min(size, HEAD_SIZE))}
+            name = os.path.basename(path)
+            if name.endswith('.gz'):
+                name = name[:-len('.gz')]
+            slices.append((name, log_file, start, end, int(os.path.getmtime(path))))
+    if options.max_bytes is not None:
+        slices = cap_slices(slices, options.max_bytes)
+    write_archive(archive, host, [s for s in slices if s[3] > s[2]])
+    os.chmod(archive, 0o644)
+    if options.offsets:
+        with open(options.offsets, 'w') as f:
+            json.dump(offsets, f)
+        os.chmod(options.offsets, 0o644)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
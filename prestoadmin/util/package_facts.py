@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Facts about the presto package installed on each host.
+
+The presto rpm has been released under several names, so they are all
+queried with a single rpm command the first time the package of a host is
+looked up, and the answer is kept for the rest of the run. Call
+clear_package_facts after installing, upgrading or uninstalling an rpm on a
+host.
+"""
+import logging
+
+from fabric.api import env
+from fabric.context_managers import settings, hide
+from fabric.operations import run
+
+_LOGGER = logging.getLogger(__name__)
+
+# In order of preference, if a host has more than one of them installed.
+PRESTO_PACKAGE_NAMES = ['presto', 'presto-server-rpm', 'starburst-presto-server-rpm']
+# Every name the presto rpm has been released under. presto-server, the name of
+# old releases, is only looked for by server uninstall and the rpm cache.
+ALL_PRESTO_PACKAGE_NAMES = ['presto', 'presto-server', 'presto-server-rpm',
+                            'starburst-presto-server-rpm']
+
+# host -> {package name -> version}
+_package_facts = {}
+
+
+def get_presto_package(package_names=PRESTO_PACKAGE_NAMES):
+    """
+    Returns the name and version of the first of package_names installed on
+    the current host, or None if none of them is installed.
+    """
+    installed = _get_package_facts(env.host)
+    for name in package_names:
+        if name in installed:
+            return name, installed[name]
+    return None
+
+
+def clear_package_facts(host=None):
+    """
+    Forget the packages installed on host, or on every host if none is
+    given.
+    """
+    if host is None:
+        _package_facts.clear()
+    else:
+        _package_facts.pop(host, None)
+
+
+def _get_package_facts(host):
+    try:
+        return _package_facts[host]
+    except KeyError:
+        pass
+
+    # rpm prints why a package is not installed to stdout, so only the lines
+    # in the query format are read.
+    with settings(hide('warnings', 'stdout'), warn_only=True):
+        output = run("rpm -q --qf '%%{NAME} %%{VERSION}\\n' %s"
+                     % ' '.join(ALL_PRESTO_PACKAGE_NAMES))
+    installed = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 2 and fields[0] in ALL_PRESTO_PACKAGE_NAMES:
+            installed[fields[0]] = fields[1]
+    _LOGGER.debug('Presto packages on %s: %s' % (host, installed))
+    _package_facts[host] = installed
+    return installed
@@ -11,8 +11,13 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import fcntl
+import json
 import logging
 import os
+import shutil
+import tempfile
+from contextlib import contextmanager
 from StringIO import StringIO
 
 from fabric.context_managers import settings, hide
@@ -32,6 +37,11 @@ CLIENT_KEYSTORE_PASSWORD_KEY = 'internal-communication.https.keystore.key'
 INTERNAL_COMMUNICATION_SECRET = 'internal-communication.shared-secret'
 NODE_ENVIRONMENT = 'node.environment'
 
+# env key holding the directory where the coordinator config is cached for the
+# rest of a run. It's set in the main process, so that every worker process
+# shares the cache.
+CACHE_DIR_ENV_KEY = 'coordinator_config_cache_dir'
+
 _LOGGER = logging.getLogger(__name__)
 # properties file literals
 PROPERTIES_TRUE = 'true'
@@ -77,15 +87,29 @@ class PrestoConfig:
         config_path = os.path.join(REMOTE_CONF_DIR, CONFIG_PROPERTIES)
         config_host = env.roledefs['coordinator'][0]
         try:
-            return PrestoConfig.from_file(
-                PrestoConfig.read_file(config_host, config_path),
-                PrestoConfig.read_file(config_host, os.path.join(REMOTE_CONF_DIR, NODE_PROPERTIES)),
-                config_path,
-                config_host)
+            with _cache_lock(config_host) as cache_file:
+                config, node_config = _read_cache(cache_file)
+                if config is None:
+                    config = get_conf_from_properties_data(
+                        PrestoConfig.read_file(config_host, config_path))
+                    node_config = get_conf_from_properties_data(
+                        PrestoConfig.read_file(config_host, os.path.join(REMOTE_CONF_DIR, NODE_PROPERTIES)))
+                    _write_cache(cache_file, config, node_config)
+            return PrestoConfig(config, node_config, config_path, config_host)
         except:
             _LOGGER.info('Could not find Presto config.')
             return PrestoConfig(None, None, config_path, config_host)
 
+    @staticmethod
+    def clear_coordinator_config_cache(host):
+        """
+        Forget the cached config of host, if it is the coordinator. Call after
+        changing configuration files on a node.
+        """
+        with _cache_lock(host) as cache_file:
+            if cache_file and os.path.exists(cache_file):
+                os.remove(cache_file)
+
     @staticmethod
     def read_file(config_host, config_path):
         data = StringIO()
@@ -142,3 +166,56 @@ class PrestoConfig:
 
     def get_node_environment(self):
         return self._lookup_node_config(NODE_ENVIRONMENT)
+
+
+def start_config_cache():
+    """
+    Cache the coordinator config read by PrestoConfig.coordinator_config() in
+    this process and in every worker process it starts, until
+    end_config_cache() is called.
+    """
+    end_config_cache()
+    env[CACHE_DIR_ENV_KEY] = tempfile.mkdtemp(prefix='prestoadmin-config-')
+
+
+def end_config_cache():
+    cache_dir = env.get(CACHE_DIR_ENV_KEY)
+    if cache_dir:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    env[CACHE_DIR_ENV_KEY] = None
+
+
+@contextmanager
+def _cache_lock(config_host):
+    """
+    Yields the path of the cache file for config_host while holding a lock on
+    it, or None if there is no cache. When several processes need the config
+    at once, the first one reads it from the coordinator, and the others wait
+    for it and read it from the cache.
+    """
+    cache_dir = env.get(CACHE_DIR_ENV_KEY)
+    if not cache_dir or not os.path.isdir(cache_dir):
+        yield None
+        return
+
+    cache_file = os.path.join(cache_dir, config_host + '.json')
+    with open(cache_file + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield cache_file
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read_cache(cache_file):
+    if not cache_file or not os.path.exists(cache_file):
+        return None, None
+    with open(cache_file) as f:
+        cached = json.load(f)
+    return cached['config'], cached['node_config']
+
+
+def _write_cache(cache_file, config, node_config):
+    if cache_file:
+        with open(cache_file, 'w') as f:
+            json.dump({'config': config, 'node_config': node_config}, f)
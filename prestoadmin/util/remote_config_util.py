@@ -13,9 +13,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import logging
+
 from fabric.context_managers import settings, hide
 from fabric.operations import sudo
 from fabric.tasks import execute
+from prestoadmin.config import split_to_pair, COMMENT_CHARS
 from prestoadmin.util.exception import ConfigurationError
 from prestoadmin.util.constants import DEFAULT_PRESTO_LAUNCHER_LOG_FILE,\
     DEFAULT_PRESTO_SERVER_LOG_FILE, REMOTE_CONF_DIR, REMOTE_CATALOG_DIR
@@ -26,6 +28,15 @@ _LOGGER = logging.getLogger(__name__)
 NODE_CONFIG_FILE = REMOTE_CONF_DIR + '/node.properties'
 GENERAL_CONFIG_FILE = REMOTE_CONF_DIR + '/config.properties'
 
+# Files fetched together, in one command, the first time any of them is
+# looked up on a host.
+SNAPSHOT_FILES = [NODE_CONFIG_FILE, GENERAL_CONFIG_FILE]
+FILE_HEADER = '==> prestoadmin config file: '
+MISSING_FILE = '<== prestoadmin config file missing'
+
+# host -> {config file -> properties dict}
+_snapshots = {}
+
 
 def lookup_port(host):
     """
@@ -43,7 +54,6 @@ def lookup_port(host):
                      'Defaulting to 8080.')
         return 8080
     try:
-        port = port.split('=', 1)[1]
         port = prestoadmin.util.validators.validate_port(port)
         _LOGGER.info('Looked up port ' + str(port) + ' on host ' +
                      host)
@@ -82,19 +92,110 @@ def lookup_catalog_directory(host):
 def lookup_string_config(config_value, config_file, host, default=''):
     value = lookup_in_config(config_value, config_file, host)
     if value:
-        return value.split('=', 1)[1]
+        return value
     else:
         return default
 
 
 def lookup_in_config(config_key, config_file, host):
-    with settings(hide('stdout', 'warnings', 'aborts')):
-        config_value = execute(sudo, 'grep %s= %s' % (config_key, config_file),
-                               user='presto',
-                               warn_only=True, host=host)[host]
+    """
+    Returns the value of config_key in config_file on host, or None if the
+    key isn't set. Raises ConfigurationError if the file can't be read.
+    """
+    if config_file in SNAPSHOT_FILES:
+        config = _get_snapshot(host)[config_file]
+    else:
+        config = _fetch_config_files([config_file], host)[config_file]
 
-    if isinstance(config_value, Exception) or config_value.return_code == 2:
+    if config is None:
         raise ConfigurationError('Could not access config file %s on '
                                  'host %s' % (config_file, host))
 
-    return config_value
+    return config.get(config_key)
+
+
+def clear_config_snapshot(host=None):
+    """
+    Forget the remote configuration read from host, or from every host if
+    none is given. Call after changing configuration files on a node.
+    """
+    if host is None:
+        _snapshots.clear()
+    else:
+        _snapshots.pop(host, None)
+
+
+def _get_snapshot(host):
+    try:
+        return _snapshots[host]
+    except KeyError:
+        pass
+
+    snapshot = _fetch_config_files(SNAPSHOT_FILES, host)
+    # A missing file may be deployed later in the run, so only keep complete
+    # snapshots.
+    if None not in snapshot.values():
+        _snapshots[host] = snapshot
+    return snapshot
+
+
+def _fetch_config_files(config_files, host):
+    """
+    Reads config_files from host in a single command, and returns a dict of
+    file name to properties dict, or to None if the file couldn't be read.
+    """
+    # A newline is printed after each file, so that the next header starts a
+    # line of its own even if the file doesn't end with one.
+    command = '; '.join(
+        'echo "%(header)s%(path)s"; cat "%(path)s" 2>/dev/null && echo || '
+        '{ echo; echo "%(missing)s"; }' % {'header': FILE_HEADER, 'path': path,
+                                           'missing': MISSING_FILE}
+        for path in config_files)
+    with settings(hide('stdout', 'warnings', 'aborts')):
+        output = execute(sudo, command, user='presto', warn_only=True,
+                         host=host)[host]
+
+    config = dict.fromkeys(config_files)
+    if isinstance(output, Exception):
+        return config
+
+    contents = {}
+    current_file = None
+    for line in output.splitlines():
+        if line.startswith(FILE_HEADER):
+            current_file = line[len(FILE_HEADER):].strip()
+            contents[current_file] = []
+        elif line == MISSING_FILE:
+            contents.pop(current_file, None)
+            current_file = None
+        elif current_file is not None:
+            contents[current_file].append(line)
+
+    for config_file, lines in contents.items():
+        if config_file in config:
+            # Drop the newline printed after the file.
+            if lines and not lines[-1]:
+                lines.pop()
+            config[config_file] = _parse_properties(lines, config_file, host)
+    return config
+
+
+def _parse_properties(lines, config_file, host):
+    """
+    Returns the properties in lines. Lines that aren't properties are
+    skipped, as presto-admin has always looked up single properties in the
+    remote files without minding the rest of them.
+    """
+    props = {}
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] in COMMENT_CHARS:
+            continue
+        try:
+            key, value = split_to_pair(line)
+        except ConfigurationError:
+            _LOGGER.debug('Skipping malformed line in %s on %s: %s'
+                          % (config_file, host, line))
+            continue
+        props[key] = value
+    return props
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Local cache of the presto rpms downloaded by presto-admin.
+
+Every rpm is stored under its sha256 checksum, and an index records the
+name and version that rpm reports for it and the urls it was downloaded
+from, so that an rpm that was downloaded before is found without contacting
+the server. The least recently used rpms are removed once the cache grows
+beyond its maximum size.
+"""
+import fcntl
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+from fabric.context_managers import settings, hide
+from fabric.operations import local
+
+from prestoadmin.util.filesystem import ensure_directory_exists, move_with_sidecar, \
+    read_sidecar, remove_with_sidecar, sha256_of_file
+from prestoadmin.util.local_config_util import get_rpm_cache_directory
+from prestoadmin.util.package_facts import ALL_PRESTO_PACKAGE_NAMES
+
+_LOGGER = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+LOCK_FILE = 'index.lock'
+MAX_CACHE_SIZE = 5 * 1024 * 1024 * 1024
+
+
+class RpmCache(object):
+    def __init__(self, directory=None, max_size=MAX_CACHE_SIZE):
+        self.directory = directory or get_rpm_cache_directory()
+        self.max_size = max_size
+
+    def find_version(self, version):
+        """
+        Returns the path of a cached presto rpm with the given version, or
+        None if there isn't one.
+        """
+        return self._find(lambda entry: entry['version'] == version and
+                          entry['name'] in ALL_PRESTO_PACKAGE_NAMES)
+
+    def find_url(self, url):
+        """
+        Returns the path of the cached rpm that was downloaded from url, or
+        None if there isn't one.
+        """
+        return self._find(lambda entry: url in entry['urls'])
+
+    def add(self, rpm_path, urls=()):
+        """
+        Moves the rpm at rpm_path into the cache and returns its new path. If
+        the cache already holds an identical rpm, rpm_path is removed and the
+        path of the cached copy is returned.
+        """
+        facts = read_sidecar(rpm_path) or {}
+        checksum = facts.get('sha256') or sha256_of_file(rpm_path)
+        with self._index() as index:
+            entry = index.get(checksum)
+            if entry and os.path.isfile(self._path(entry)):
+                remove_with_sidecar(rpm_path)
+            else:
+                name, version, release = _query_rpm(rpm_path)
+                entry = {'file': os.path.join(checksum, os.path.basename(rpm_path)),
+                         'name': name,
+                         'version': version,
+                         'release': release,
+                         'size': os.path.getsize(rpm_path),
+                         'urls': []}
+                ensure_directory_exists(os.path.join(self.directory, checksum))
+                move_with_sidecar(rpm_path, self._path(entry))
+                index[checksum] = entry
+            entry['urls'] = sorted(set(entry['urls']) | set(urls))
+            entry['last_used'] = time.time()
+            self._evict(index, checksum)
+            return self._path(entry)
+
+    def _find(self, matches):
+        with self._index() as index:
+            found = None
+            for checksum, entry in index.items():
+                if not matches(entry):
+                    continue
+                path = self._path(entry)
+                if not os.path.isfile(path) or os.path.getsize(path) != entry['size']:
+                    _LOGGER.warn('Removing missing or changed rpm %s from the rpm cache' % path)
+                    self._remove(index, checksum)
+                elif found is None or entry['last_used'] > found['last_used']:
+                    found = entry
+            if found is None:
+                return None
+            found['last_used'] = time.time()
+            return self._path(found)
+
+    def _evict(self, index, keep):
+        total_size = sum(entry['size'] for entry in index.values())
+        by_last_use = sorted(index.items(), key=lambda item: item[1]['last_used'])
+        for checksum, entry in by_last_use:
+            if total_size <= self.max_size:
+                break
+            if checksum != keep:
+                _LOGGER.info('Evicting %s from the rpm cache' % self._path(entry))
+                self._remove(index, checksum)
+                total_size -= entry['size']
+
+    def _remove(self, index, checksum):
+        shutil.rmtree(os.path.join(self.directory, checksum), ignore_errors=True)
+        del index[checksum]
+
+    def _path(self, entry):
+        return os.path.join(self.directory, entry['file'])
+
+    @contextmanager
+    def _index(self):
+        """
+        Yields the index, locked against other presto-admin processes, and
+        saves it afterwards.
+        """
+        ensure_directory_exists(self.directory)
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        with open(os.path.join(self.directory, LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(index_path) as f:
+                        index = json.load(f)
+                except (IOError, ValueError):
+                    index = {}
+                yield index
+                temp_path = index_path + '.tmp'
+                with open(temp_path, 'w') as f:
+                    json.dump(index, f)
+                os.rename(temp_path, index_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _query_rpm(rpm_path):
+    """
+    Returns the name, version and release of the rpm at rpm_path, or Nones
+    if rpm can't read them.
+    """
+    with settings(hide('warnings', 'stdout', 'running'), warn_only=True):
+        result = local("rpm -qp --queryformat '%%{NAME} %%{VERSION} %%{RELEASE}' %s" % rpm_path,
+                       capture=True)
+    fields = result.split()
+    if not result.succeeded or len(fields) != 3:
+        _LOGGER.warn('Could not read the name and version of %s' % rpm_path)
+        return None, None, None
+    return tuple(fields)
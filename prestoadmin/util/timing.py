@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Timings of the tasks and remote operations run by presto-admin.
+
+With --timing-report or --trace-file, the patched execute, run, sudo, put and
+get in fabric_patches record the wall time, exit code and bytes sent and
+received of every task they run on a host and every operation they run on a
+node. Whatever a parallel job records is recorded in the worker process that
+runs the job, and the worker pool sends it back to the parent with the job's
+result.
+
+When presto-admin exits, the report summarizes the operations, and the trace
+file lays out the tasks and operations on a timeline with a track per host,
+in the Chrome trace event format, which chrome://tracing, Perfetto and
+speedscope can open.
+"""
+import json
+import math
+import time
+from collections import namedtuple
+
+from fabric.api import env
+
+SLOWEST_HOSTS_REPORTED = 5
+COMMAND_WIDTH = 60
+
+TASK = 'task'
+
+# operation is run, sudo, put or get, or TASK for a task run on a host, whose
+# command is the name of the task.
+CommandTiming = namedtuple('CommandTiming', ['host', 'task', 'operation', 'command', 'start',
+                                             'seconds', 'exit_code', 'bytes_out', 'bytes_in'])
+
+_records = []
+
+
+def timing_enabled():
+    return bool(env.get('timing_report') or env.get('trace_file'))
+
+
+def record_command(operation, command, start, out):
+    """
+    Records command, started at start, as run on the current host by
+    operation, run or sudo. out is what the operation returned, or None if it
+    raised.
+    """
+    if not timing_enabled():
+        return
+    if out is None:
+        exit_code, bytes_out, bytes_in = None, len(command), 0
+    else:
+        exit_code = out.return_code
+        bytes_out = len(out.real_command)
+        bytes_in = len(out) + len(out.stderr)
+    _record(operation, command, start, exit_code, bytes_out, bytes_in)
+
+
+def record_transfer(operation, path, start, paths, bytes_out=0, bytes_in=0):
+    """
+    Records a put or get of path, started at start. paths is what the
+    operation returned, or None if it raised.
+    """
+    if not timing_enabled():
+        return
+    if paths is None:
+        exit_code = None
+    else:
+        exit_code = 1 if paths.failed else 0
+    _record(operation, path, start, exit_code, bytes_out, bytes_in)
+
+
+def record_task(start, succeeded):
+    """
+    Records the run of the current task on the current host, started at
+    start.
+    """
+    if not timing_enabled():
+        return
+    _record(TASK, env.get('command') or '', start, 0 if succeeded else 1, 0, 0)
+
+
+def _record(operation, command, start, exit_code, bytes_out, bytes_in):
+    _records.append(CommandTiming(env.host, env.get('command'), operation, command, start,
+                                  time.time() - start, exit_code, bytes_out, bytes_in))
+
+
+def take_records():
+    """
+    Returns what has been recorded so far and forgets it.
+    """
+    records = list(_records)
+    del _records[:]
+    return records
+
+
+def add_records(records):
+    _records.extend(records or [])
+
+
+def percentile(values, fraction):
+    """
+    Returns the nearest-rank percentile of values, which must be sorted.
+    """
+    rank = int(math.ceil(fraction * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def _shorten(command):
+    command = ' '.join(command.split())
+    if len(command) > COMMAND_WIDTH:
+        return command[:COMMAND_WIDTH - 3] + '...'
+    return command
+
+
+def format_timing_report(records):
+    """
+    Returns the lines of a report of the p50, p95 and max time of each
+    command in records, with the commands that took the longest in total
+    first, followed by the hosts that spent the longest running commands.
+    Tasks are left out.
+    """
+    records = [record for record in records if record.operation != TASK]
+    if not records:
+        return ['No remote commands were run.']
+
+    by_command = {}
+    by_host = {}
+    for record in records:
+        by_command.setdefault(record.command, []).append(record)
+        by_host.setdefault(record.host, []).append(record)
+
+    lines = ['Remote command timings: %d commands on %d hosts'
+             % (len(records), len(by_host)),
+             '%6s %6s %8s %8s %8s %10s  %s'
+             % ('count', 'failed', 'p50', 'p95', 'max', 'bytes in', 'command')]
+    for command, timings in sorted(by_command.items(),
+                                   key=lambda item: -sum(t.seconds for t in item[1])):
+        seconds = sorted(t.seconds for t in timings)
+        failed = len([t for t in timings if t.exit_code != 0])
+        lines.append('%6d %6d %7.2fs %7.2fs %7.2fs %10d  %s'
+                     % (len(timings), failed, percentile(seconds, 0.5),
+                        percentile(seconds, 0.95), seconds[-1],
+                        sum(t.bytes_in for t in timings), _shorten(command)))
+
+    lines.extend(['', 'Slowest hosts:',
+                  '%6s %8s %8s  %s' % ('count', 'total', 'max', 'host')])
+    slowest = sorted(by_host.items(), key=lambda item: -sum(t.seconds for t in item[1]))
+    for host, timings in slowest[:SLOWEST_HOSTS_REPORTED]:
+        seconds = [t.seconds for t in timings]
+        lines.append('%6d %7.2fs %7.2fs  %s' % (len(timings), sum(seconds), max(seconds), host))
+    return lines
+
+
+def print_timing_report(records):
+    print('\n'.join(format_timing_report(records)))
+
+
+def trace_events(records):
+    """
+    Returns records as a list of Chrome trace events: a complete event for
+    each record, in microseconds since the first of them started, on a
+    thread named after its host.
+    """
+    if not records:
+        return []
+    first_start = min(record.start for record in records)
+    hosts = sorted(set(record.host for record in records))
+    events = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'tid': 0,
+               'args': {'name': 'presto-admin'}}]
+    for tid, host in enumerate(hosts, 1):
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid,
+                       'args': {'name': host}})
+    tids = dict((host, tid) for tid, host in enumerate(hosts, 1))
+    for record in records:
+        events.append({'name': _shorten(record.command),
+                       'cat': record.operation,
+                       'ph': 'X',
+                       'ts': int((record.start - first_start) * 1000000),
+                       'dur': int(record.seconds * 1000000),
+                       'pid': 1,
+                       'tid': tids[record.host],
+                       'args': {'task': record.task,
+                                'command': record.command,
+                                'exit_code': record.exit_code,
+                                'bytes_out': record.bytes_out,
+                                'bytes_in': record.bytes_in}})
+    return events
+
+
+def write_trace_file(path, records):
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': trace_events(records), 'displayTimeUnit': 'ms'}, f)
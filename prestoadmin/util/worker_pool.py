@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Bounded pool of forked worker processes used by the patched execute() in
+place of fabric's JobQueue, which forks a new process for every host.
+
+Within a presto-admin run the pool hands its jobs to a WorkerSession when one
+is active, so that the same worker process, and therefore the same SSH
+connection, serves a host across every task of the run.
+"""
+import atexit
+import cPickle
+import logging
+import multiprocessing
+import os
+import Queue
+import signal
+from collections import deque
+
+from fabric import state
+from fabric.network import disconnect_all
+
+from prestoadmin.util import timing
+
+_LOGGER = logging.getLogger(__name__)
+
+# How long the parent blocks on the results queue before checking that its
+# workers are still alive.
+POLL_INTERVAL = 0.1
+
+
+class WorkerPool(object):
+    """
+    Runs appended jobs on at most max_workers forked processes.
+
+    Each worker pulls jobs off a shared queue until there are none left, so a
+    run over N hosts costs max_workers forks instead of N. The jobs are
+    appended before the workers are forked, which means only the index of a
+    job has to cross the process boundary; the callable, its arguments and
+    the fabric env are inherited. A worker keeps the SSH connections it opens
+    until it exits.
+
+    The interface mirrors fabric.job_queue.JobQueue, and run() returns the
+    same {name: {'exit_code': ..., 'results': ...}} dict.
+    """
+
+    def __init__(self, max_workers, comms_queue):
+        self._max = max_workers
+        self._comms_queue = comms_queue
+        self._jobs = []
+        self._closed = False
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def append(self, name, target, kwargs):
+        """
+        Queue target(**kwargs) to be run under the given name. Appending to a
+        closed pool silently does nothing, as with JobQueue.
+        """
+        if not self._closed:
+            self._jobs.append((name, target, kwargs))
+
+    def close(self):
+        self._closed = True
+
+    def run(self):
+        if not self._closed:
+            raise Exception('Need to close() before starting.')
+
+        session = current_session()
+        if session is not None:
+            payloads = session.serialize(self._jobs)
+            if payloads is not None:
+                return session.run(payloads, self._max)
+
+        results = {}
+        for name, _, _ in self._jobs:
+            results[name] = dict.fromkeys(('exit_code', 'results'))
+
+        work_queue = multiprocessing.Queue()
+        for index in range(len(self._jobs)):
+            work_queue.put(index)
+
+        workers = []
+        for _ in range(min(self._max, len(self._jobs))):
+            work_queue.put(None)
+            workers.append(multiprocessing.Process(target=self._work,
+                                                   args=(work_queue,)))
+
+        try:
+            for worker in workers:
+                worker.start()
+            self._fill_results(results, workers)
+        except BaseException:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+            raise
+        finally:
+            for worker in workers:
+                worker.join()
+
+        return results
+
+    def _fill_results(self, results, workers):
+        pending = len(self._jobs)
+        while pending:
+            try:
+                datum = self._comms_queue.get(timeout=POLL_INTERVAL)
+            except Queue.Empty:
+                if any(worker.is_alive() for worker in workers):
+                    continue
+                # A worker may have put its last result just before it
+                # exited, so look at the queue once more.
+                try:
+                    datum = self._comms_queue.get_nowait()
+                except Queue.Empty:
+                    # Every worker is gone, so whatever is still pending was
+                    # lost with a worker that died in the middle of a job.
+                    _LOGGER.error('Worker processes exited with %d jobs '
+                                  'unfinished' % pending)
+                    for result in results.values():
+                        if result['exit_code'] is None:
+                            result['exit_code'] = 1
+                    break
+            results[datum['name']]['results'] = datum['result']
+            results[datum['name']]['exit_code'] = datum['exit_code']
+            timing.add_records(datum['timings'])
+            pending -= 1
+
+    def _work(self, work_queue):
+        # Connections inherited from the parent are still in use there.
+        state.connections.clear()
+        base_env = dict(state.env)
+        try:
+            while True:
+                index = work_queue.get()
+                if index is None:
+                    break
+                name, target, kwargs = self._jobs[index]
+                # Don't let env changes made by one job leak into the next.
+                state.env.clear()
+                state.env.update(base_env)
+                self._comms_queue.put(self._run_job(name, target, kwargs))
+        finally:
+            disconnect_all()
+
+    @staticmethod
+    def _run_job(name, target, kwargs):
+        # Only the commands of this job go back with its result, not those
+        # inherited from the parent or left over from an earlier job.
+        timing.take_records()
+        try:
+            result = target(**kwargs)
+            exit_code = 0
+        except BaseException as e:
+            result = e
+            exit_code = 1
+
+        # multiprocessing pickles in a background thread and drops anything
+        # it can't pickle, which would leave the parent waiting forever.
+        try:
+            cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            _LOGGER.error('Unable to send result of %s back from the worker: '
+                          '%s' % (name, e))
+            result = None
+            exit_code = 1
+
+        return {'name': name, 'result': result, 'exit_code': exit_code,
+                'timings': timing.take_records()}
+
+
+class _SessionWorker(object):
+    def __init__(self, results_queue):
+        self.jobs = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=_session_work, args=(self.jobs, results_queue))
+        self.process.start()
+
+
+def _session_work(jobs_queue, results_queue):
+    # The workers share the terminal's process group, so Ctrl-C reaches each
+    # of them. Leave it to the parent, which ends the session.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Connections inherited from the parent are still in use there.
+    state.connections.clear()
+    try:
+        while True:
+            payload = jobs_queue.get()
+            if payload is None:
+                break
+            name, target, kwargs, env, output = cPickle.loads(payload)
+            state.env.clear()
+            state.env.update(env)
+            state.output.update(output)
+            results_queue.put(WorkerPool._run_job(name, target, kwargs))
+    finally:
+        disconnect_all()
+
+
+class WorkerSession(object):
+    """
+    Long-lived worker processes, each pinned to the hosts it has served.
+
+    A host's jobs always go to the same worker, so the SSH connection the
+    worker opened for the first task of a run is reused by every later task
+    and by any serial execute() calls those tasks make. Workers are forked
+    lazily, one per host, or shared round-robin once max_workers (when
+    non-zero) is reached.
+
+    Unlike WorkerPool, the workers outlive the jobs, so jobs are pickled
+    together with a snapshot of the parent's env and output settings. Jobs
+    that can't be pickled are left to a regular WorkerPool.
+    """
+
+    def __init__(self, max_workers=0):
+        self.owner = os.getpid()
+        self._max = max_workers
+        self._results = multiprocessing.Queue()
+        self._workers = []
+        self._host_workers = {}
+
+    def serialize(self, jobs):
+        """
+        Returns [(name, payload)] for jobs, or None if any of them can't be
+        sent to a worker.
+        """
+        env = dict(state.env)
+        output = dict(state.output)
+        try:
+            return [(name, cPickle.dumps((name, target, kwargs, env, output),
+                                         cPickle.HIGHEST_PROTOCOL))
+                    for name, target, kwargs in jobs]
+        except Exception as e:
+            _LOGGER.debug('Not running jobs on the worker session: %s' % e)
+            return None
+
+    def run(self, payloads, max_running):
+        results = {}
+        for name, _ in payloads:
+            results[name] = dict.fromkeys(('exit_code', 'results'))
+
+        queued = deque(payloads)
+        in_flight = {}
+        try:
+            while queued or in_flight:
+                while queued and len(in_flight) < max_running:
+                    name, payload = queued.popleft()
+                    worker = self._worker_for(name)
+                    worker.jobs.put(payload)
+                    in_flight[name] = worker
+                try:
+                    datum = self._results.get(timeout=POLL_INTERVAL)
+                except Queue.Empty:
+                    self._reap_dead_workers(in_flight, results)
+                    continue
+                results[datum['name']]['results'] = datum['result']
+                results[datum['name']]['exit_code'] = datum['exit_code']
+                timing.add_records(datum['timings'])
+                in_flight.pop(datum['name'], None)
+        except BaseException:
+            # Workers may be in the middle of a job; don't reuse them.
+            self.close(terminate=True)
+            raise
+        return results
+
+    def _reap_dead_workers(self, in_flight, results):
+        for name, worker in in_flight.items():
+            if not worker.process.is_alive():
+                _LOGGER.error('Worker process for %s exited before '
+                              'finishing its job' % name)
+                results[name]['exit_code'] = 1
+                del in_flight[name]
+
+    def _worker_for(self, host):
+        worker = self._host_workers.get(host)
+        if worker is None or not worker.process.is_alive():
+            if worker in self._workers:
+                self._workers.remove(worker)
+            if not self._max or len(self._workers) < self._max:
+                worker = _SessionWorker(self._results)
+                self._workers.append(worker)
+            else:
+                worker = self._workers[len(self._host_workers) % self._max]
+            self._host_workers[host] = worker
+        return worker
+
+    def close(self, terminate=False):
+        for worker in self._workers:
+            if terminate:
+                worker.process.terminate()
+            else:
+                worker.jobs.put(None)
+        for worker in self._workers:
+            worker.process.join()
+        self._workers = []
+        self._host_workers = {}
+
+
+_session = None
+
+
+def start_session(max_workers=0):
+    """
+    Route parallel jobs through a WorkerSession until end_session() is
+    called.
+    """
+    global _session
+    end_session()
+    _session = WorkerSession(max_workers)
+    atexit.register(end_session)
+
+
+def end_session():
+    global _session
+    if _session is not None and _session.owner == os.getpid():
+        _session.close()
+    _session = None
+
+
+def current_session():
+    # A forked worker inherits the session object of the process that
+    # forked it, but only that process can talk to the session's workers.
+    if _session is not None and _session.owner == os.getpid():
+        return _session
+    return None
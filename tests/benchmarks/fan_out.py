@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the wall time of fanning a task out to many hosts with fabric's
+JobQueue, which forks one process per host, against the WorkerPool used by
+prestoadmin.fabric_patches.execute, with and without a worker session.
+
+No SSH is involved. Each job sleeps for --handshake-ms the first time a
+process sees a host, to stand in for the SSH handshake, and for --work-ms to
+stand in for the remote command.
+
+Run from the top of the repository:
+    python -m tests.benchmarks.fan_out --hosts 400 --pool-size 50
+"""
+import argparse
+import multiprocessing
+import time
+
+from fabric.job_queue import JobQueue
+
+from prestoadmin.util import worker_pool
+from prestoadmin.util.worker_pool import WorkerPool
+
+_connected_hosts = set()
+
+
+def _simulated_task(host, handshake, work):
+    if host not in _connected_hosts:
+        time.sleep(handshake)
+        _connected_hosts.add(host)
+    time.sleep(work)
+    return host
+
+
+def run_job_queue(hosts, pool_size, handshake, work):
+    queue = multiprocessing.Queue()
+    jobs = JobQueue(pool_size, queue)
+
+    def inner(host):
+        queue.put({'name': host,
+                   'result': _simulated_task(host, handshake, work)})
+
+    for host in hosts:
+        process = multiprocessing.Process(target=inner, args=(host,))
+        process.name = host
+        jobs.append(process)
+    jobs.close()
+    return jobs.run()
+
+
+def run_worker_pool(hosts, pool_size, handshake, work):
+    jobs = WorkerPool(pool_size, multiprocessing.Queue())
+    for host in hosts:
+        jobs.append(host, _simulated_task,
+                    {'host': host, 'handshake': handshake, 'work': work})
+    jobs.close()
+    return jobs.run()
+
+
+def time_fan_out(runner, hosts, pool_size, handshake, work, tasks,
+                 session=False):
+    start = time.time()
+    if session:
+        worker_pool.start_session(pool_size)
+    try:
+        for _ in range(tasks):
+            results = runner(hosts, pool_size, handshake, work)
+            assert len(results) == len(hosts)
+    finally:
+        worker_pool.end_session()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--hosts', type=int, default=200)
+    parser.add_argument('--pool-size', type=int, default=50)
+    parser.add_argument('--tasks', type=int, default=3,
+                        help='number of chained fan-outs over the hosts')
+    parser.add_argument('--handshake-ms', type=float, default=50)
+    parser.add_argument('--work-ms', type=float, default=10)
+    args = parser.parse_args()
+
+    hosts = ['host%d' % i for i in range(args.hosts)]
+    handshake = args.handshake_ms / 1000.0
+    work = args.work_ms / 1000.0
+
+    print('%d hosts, pool size %d, %d chained tasks' %
+          (args.hosts, args.pool_size, args.tasks))
+    for label, runner, session in [
+            ('process per host (JobQueue)', run_job_queue, False),
+            ('worker pool', run_worker_pool, False),
+            ('worker pool with session', run_worker_pool, True)]:
+        elapsed = time_fan_out(runner, hosts, args.pool_size, handshake,
+                               work, args.tasks, session)
+        print('%-30s %8.2fs' % (label, elapsed))
+
+
+if __name__ == '__main__':
+    main()
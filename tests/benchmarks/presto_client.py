@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares PrestoClient reusing one keep-alive connection against opening a new
+connection for every request, as the client used to.
+
+The queries run against a fake statement server on localhost that returns
+--pages pages of results per query. The server sleeps for --handshake-ms on
+every new connection, to stand in for the TCP and TLS handshakes with a
+remote coordinator.
+
+Run from the top of the repository:
+    python -m tests.benchmarks.presto_client --queries 20 --pages 10
+"""
+import argparse
+import json
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from prestoadmin.prestoclient import PrestoClient
+from prestoadmin.util.presto_config import PrestoConfig
+
+
+class _StatementHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write, as a real server would, so that Nagle's
+    # algorithm doesn't hold back the end of a response on a reused socket.
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+        time.sleep(self.server.handshake)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.getheader('content-length', 0)))
+        self._send_page(0)
+
+    def do_GET(self):
+        self._send_page(int(self.path.rsplit('/', 1)[1]))
+
+    def _send_page(self, page):
+        answer = {'data': [[page]]}
+        if page < self.server.pages:
+            answer['nextUri'] = 'http://localhost:%d/v1/statement/query/%d' \
+                                % (self.server.server_port, page + 1)
+        body = json.dumps(answer)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ConnectionPerRequestClient(PrestoClient):
+    def _send(self, method, location, body, headers):
+        self._close_connection()
+        return PrestoClient._send(self, method, location, body, headers)
+
+
+def _start_server(pages, handshake):
+    server = HTTPServer(('localhost', 0), _StatementHandler)
+    server.pages = pages
+    server.handshake = handshake
+    server.connections = 0
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def time_queries(client_class, queries, pages, handshake):
+    server = _start_server(pages, handshake)
+    config = PrestoConfig({'http-server.http.port': str(server.server_port),
+                           'internal-communication.shared-secret': 'secret'},
+                          {}, None, None)
+    client = client_class('localhost', 'benchmark', config)
+    start = time.time()
+    try:
+        for _ in range(queries):
+            rows = client.run_sql('select 1')
+            assert len(rows) == pages + 1
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+    return time.time() - start, server.connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--pages', type=int, default=10,
+                        help='number of nextUri polls per query')
+    parser.add_argument('--handshake-ms', type=float, default=20)
+    args = parser.parse_args()
+
+    handshake = args.handshake_ms / 1000.0
+    print('%d queries, %d pages per query' % (args.queries, args.pages))
+    for label, client_class in [
+            ('connection per request', _ConnectionPerRequestClient),
+            ('keep-alive connection', PrestoClient)]:
+        elapsed, connections = time_queries(client_class, args.queries,
+                                            args.pages, handshake)
+        print('%-25s %8.2fs %6d connections' % (label, elapsed, connections))
+
+
+if __name__ == '__main__':
+    main()
@@ -23,7 +23,7 @@ from nose.plugins.attrib import attr
 from nose.tools import nottest
 
 from prestoadmin.collect import OUTPUT_FILENAME_FOR_LOGS, TMP_PRESTO_DEBUG, \
-    PRESTOADMIN_LOG_NAME, OUTPUT_FILENAME_FOR_SYS_INFO, TMP_PRESTO_DEBUG_REMOTE, \
+    PRESTOADMIN_LOG_NAME, OUTPUT_FILENAME_FOR_SYS_INFO, \
     DEFAULT_PATH_FOR_LOGS
 from tests.no_hadoop_bare_image_provider import NoHadoopBareImageProvider
 from tests.product.base_product_case import BaseProductTestCase, PrestoError
@@ -54,8 +54,8 @@ class TestCollect(BaseProductTestCase):
         self.assert_path_exists(self.cluster.master, downloaded_logs_location)
 
         for host in self.cluster.all_internal_hosts():
-            host_log_location = path.join(downloaded_logs_location, host)
-            self.assert_path_exists(self.cluster.master, host_log_location)
+            host_log_archive = path.join(downloaded_logs_location, host + '.tar.gz')
+            self.assert_path_exists(self.cluster.master, host_log_archive)
 
         admin_log = path.join(downloaded_logs_location, PRESTOADMIN_LOG_NAME)
         self.assert_path_exists(self.cluster.master, admin_log)
@@ -69,7 +69,7 @@ class TestCollect(BaseProductTestCase):
         if not coordinator:
             coordinator = self.cluster.internal_master
         if not hosts:
-            hosts = self.cluster.all_hosts()
+            hosts = self.cluster.all_internal_hosts()
 
         expected = 'System info archive created: ' + OUTPUT_FILENAME_FOR_SYS_INFO + '\n'
         self.assertEqual(expected, actual)
@@ -82,9 +82,10 @@ class TestCollect(BaseProductTestCase):
         catalog_file_name = path.join(downloaded_sys_info_loc, 'catalog_info.txt')
         self.assert_path_exists(self.cluster.master, catalog_file_name)
 
-        version_file_name = path.join(TMP_PRESTO_DEBUG_REMOTE, 'version_info.txt')
         for host in hosts:
-            self.assert_path_exists(host, version_file_name)
+            host_info_location = path.join(downloaded_sys_info_loc, host)
+            self.assert_path_exists(self.cluster.master, path.join(host_info_location, 'version_info.txt'))
+            self.assert_path_exists(self.cluster.master, path.join(host_info_location, 'system_info.json'))
 
         # collected coordinator info
         coord_system_info_location = path.join(downloaded_sys_info_loc, coordinator)
@@ -110,7 +111,7 @@ class TestCollect(BaseProductTestCase):
         actual = self.run_prestoadmin('collect system_info -H %(master)s,%(slave1)s')
         self._test_basic_system_info(actual,
                                      self.cluster.internal_master,
-                                     [self.cluster.master, self.cluster.slaves[0]])
+                                     [self.cluster.internal_master, self.cluster.internal_slaves[0]])
 
     def test_collect_system_info_dash_x_two_workers(self):
         self.setup_cluster(NoHadoopBareImageProvider(), STANDALONE_PRESTO_CLUSTER)
@@ -118,7 +119,7 @@ class TestCollect(BaseProductTestCase):
         actual = self.run_prestoadmin('collect system_info -x %(slave2)s,%(slave3)s')
         self._test_basic_system_info(actual,
                                      self.cluster.internal_master,
-                                     [self.cluster.master, self.cluster.slaves[0]])
+                                     [self.cluster.internal_master, self.cluster.internal_slaves[0]])
 
     @attr('smoketest')
     def test_system_info_pa_separate_node(self):
@@ -133,7 +134,7 @@ class TestCollect(BaseProductTestCase):
         self._test_basic_system_info(
             actual,
             coordinator=self.cluster.internal_slaves[0],
-            hosts=self.cluster.slaves)
+            hosts=self.cluster.internal_slaves)
 
     @attr('smoketest')
     def test_query_info_pa_separate_node(self):
@@ -206,7 +207,8 @@ class TestCollect(BaseProductTestCase):
         self.run_prestoadmin('collect logs')
         self.assert_path_exists(self.cluster.master, DEFAULT_PATH_FOR_LOGS)
         log_filename = path.basename(OUTPUT_FILENAME_FOR_LOGS)
-        self.run_script_from_prestoadmin_dir('cp %s .; tar xvf %s' % (DEFAULT_PATH_FOR_LOGS, log_filename))
+        self.run_script_from_prestoadmin_dir('cp %s .; tar xvf %s; cd logs; for f in *.tar.gz; do tar xzf $f; done'
+                                             % (DEFAULT_PATH_FOR_LOGS, log_filename))
 
     def test_collect_logs_nonstandard_location(self):
         self.setup_cluster(NoHadoopBareImageProvider(), STANDALONE_PRESTO_CLUSTER)
@@ -235,9 +237,8 @@ class TestCollect(BaseProductTestCase):
         collected_logs_dir = os.path.join(get_install_directory(), 'logs')
         self.assert_path_exists(self.cluster.master, os.path.join(collected_logs_dir, 'presto-admin.log'))
         for host in self.cluster.all_internal_hosts():
-            host_directory = os.path.join(collected_logs_dir, host)
-            self.assert_path_exists(self.cluster.master, host_directory)
-            self.assert_path_removed(self.cluster.master, os.path.join(host_directory, '*'))
+            self.assert_path_exists(self.cluster.master, os.path.join(collected_logs_dir, host + '.tar.gz'))
+            self.assert_path_removed(self.cluster.master, os.path.join(collected_logs_dir, host))
 
     def test_collect_logs_server_not_installed(self):
         self.setup_cluster(NoHadoopBareImageProvider(), STANDALONE_PA_CLUSTER)
@@ -254,14 +255,14 @@ class TestCollect(BaseProductTestCase):
         self.assertLazyMessage(lambda: self.log_msg(actual, expected),
                                self.assertEqual, actual, expected)
 
-        downloaded_logs_location = path.join(TMP_PRESTO_DEBUG, 'logs')
-        self.assert_path_exists(self.cluster.master, downloaded_logs_location)
+        self._collect_logs_and_unzip()
+        collected_logs_dir = os.path.join(get_install_directory(), 'logs')
 
         for host in self.cluster.all_internal_hosts():
-            host_log_location = path.join(downloaded_logs_location, host)
-            self.assert_path_exists(self.cluster.master, os.path.join(host_log_location, 'server.log'))
+            host_directory = os.path.join(collected_logs_dir, host)
+            self.assert_path_exists(self.cluster.master, os.path.join(host_directory, 'server.log'))
 
-        master_path = os.path.join(downloaded_logs_location, self.cluster.internal_master, )
+        master_path = os.path.join(collected_logs_dir, self.cluster.internal_master)
         self.assert_path_exists(self.cluster.master, os.path.join(master_path, 'server.log-2'))
 
     def test_collect_non_root_user(self):
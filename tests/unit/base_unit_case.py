@@ -15,6 +15,7 @@
 from mock import patch
 
 from prestoadmin.standalone.config import StandaloneConfig
+from prestoadmin.util.package_facts import clear_package_facts
 from prestoadmin.util.presto_config import PrestoConfig
 
 from tests.base_test_case import BaseTestCase
@@ -42,6 +43,7 @@ class BaseUnitCase(BaseTestCase):
     '''
     def setUp(self, capture_output=False, load_config=True):
         super(BaseUnitCase, self).setUp(capture_output=capture_output)
+        clear_package_facts()
         if load_config:
             @patch('tests.unit.base_unit_case.StandaloneConfig.'
                    '_get_conf_from_file')
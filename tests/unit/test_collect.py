@@ -15,11 +15,17 @@
 """
 Tests the presto diagnostic information using presto-admin collect
 """
+import json
 import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
 from os import path
 
 import requests
 from fabric.api import env
+from fabric.operations import _AttributeString
 from mock import patch
 
 import prestoadmin
@@ -28,35 +34,227 @@ from prestoadmin.collect import \
     TMP_PRESTO_DEBUG, \
     PRESTOADMIN_LOG_NAME, \
     OUTPUT_FILENAME_FOR_SYS_INFO, \
-    TMP_PRESTO_DEBUG_REMOTE, DEFAULT_PATH_FOR_LOGS
+    DEFAULT_PATH_FOR_LOGS
 from prestoadmin.util.local_config_util import get_log_directory
 from tests.unit.base_unit_case import BaseUnitCase, PRESTO_CONFIG
 
 
 class TestCollect(BaseUnitCase):
-    @patch('prestoadmin.collect.lookup_launcher_log_file')
-    @patch('prestoadmin.collect.lookup_server_log_file')
-    @patch('prestoadmin.collect.get_files')
+    def setUp(self):
+        super(TestCollect, self).setUp()
+        self.remove_runs_once_flag(collect.logs)
+
+    @patch('prestoadmin.collect.execute')
     @patch("prestoadmin.collect.tarfile.open")
     @patch("prestoadmin.collect.shutil.copy")
     @patch("prestoadmin.collect.ensure_directory_exists")
     def test_collect_logs(self, mkdirs_mock, copy_mock,
-                          tarfile_open_mock, get_files_mock, server_log_mock,
-                          launcher_log_mock):
+                          tarfile_open_mock, execute_mock):
         downloaded_logs_loc = path.join(TMP_PRESTO_DEBUG, "logs")
 
         collect.logs()
 
         mkdirs_mock.assert_called_with(downloaded_logs_loc)
+        execute_mock.assert_called_with(collect.get_remote_log_files,
+                                        downloaded_logs_loc, [], None, roles=env.roles)
         copy_mock.assert_called_with(path.join(get_log_directory(),
                                                PRESTOADMIN_LOG_NAME),
                                      downloaded_logs_loc)
 
-        tarfile_open_mock.assert_called_with(DEFAULT_PATH_FOR_LOGS, 'w:gz')
+        tarfile_open_mock.assert_called_with(DEFAULT_PATH_FOR_LOGS, 'w:gz',
+                                             compresslevel=1)
         tar = tarfile_open_mock.return_value
         tar.add.assert_called_with(downloaded_logs_loc,
                                    arcname=path.basename(downloaded_logs_loc))
 
+    @patch('prestoadmin.collect.execute')
+    @patch('prestoadmin.collect.make_tarfile')
+    @patch('prestoadmin.collect.shutil.copy')
+    @patch('prestoadmin.collect.ensure_directory_exists')
+    def test_collect_logs_incremental(self, mkdirs_mock, copy_mock, make_tarfile_mock,
+                                      execute_mock):
+        temp_dir = tempfile.mkdtemp()
+        offsets_path = path.join(temp_dir, 'log_offsets.json')
+        with open(offsets_path, 'w') as f:
+            json.dump({'node1': {'12': {'offset': 10}}, 'node2': {'34': {'offset': 20}},
+                       'node3': {'56': {'offset': 40}}}, f)
+        env.incremental_logs = True
+        passed_offsets = []
+
+        def execute(task, dest, slicer_options, log_offsets, roles):
+            passed_offsets.append(json.dumps(log_offsets, sort_keys=True))
+            return {'node1': {'12': {'offset': 30}}, 'node2': None, 'node3': SystemExit(1)}
+        execute_mock.side_effect = execute
+
+        try:
+            with patch('prestoadmin.collect.get_log_offsets_path', return_value=offsets_path):
+                collect.logs()
+            with open(offsets_path) as f:
+                saved = json.load(f)
+        finally:
+            shutil.rmtree(temp_dir)
+
+        self.assertEqual([json.loads(offsets) for offsets in passed_offsets],
+                         [{'node1': {'12': {'offset': 10}}, 'node2': {'34': {'offset': 20}},
+                           'node3': {'56': {'offset': 40}}}])
+        self.assertEqual(saved, {'node1': {'12': {'offset': 30}}, 'node2': {'34': {'offset': 20}},
+                                 'node3': {'56': {'offset': 40}}})
+        self.assertTrue(make_tarfile_mock.called)
+
+    def test_collect_logs_incremental_until(self):
+        env.incremental_logs = True
+        env.log_until = '2019-10-01'
+        self.assertRaisesRegexp(SystemExit, '--until can not be used with --incremental',
+                                collect.logs)
+
+    @patch('prestoadmin.collect.get')
+    @patch('prestoadmin.collect.sudo')
+    @patch('prestoadmin.collect.run')
+    @patch('prestoadmin.collect.warn')
+    @patch('prestoadmin.collect.lookup_launcher_log_file',
+           return_value='/var/log/presto/launcher.log')
+    @patch('prestoadmin.collect.lookup_server_log_file',
+           return_value='/var/log/presto/server.log')
+    def test_get_remote_log_files(self, server_log_mock, launcher_log_mock,
+                                  warn_mock, run_mock, sudo_mock, get_mock):
+        env.host = 'node1'
+        run_mock.return_value = '/tmp/presto-debug-remote.abc'
+        # The pty sudo runs in mixes in what tar prints to stderr.
+        sudo_mock.return_value = _AttributeString(
+            'prestoadmin: no logs match /var/log/presto/launcher.log*\n'
+            'tar: /var/log/presto/server.log: file changed as we read it')
+        sudo_mock.return_value.succeeded = True
+
+        collect.get_remote_log_files('/local/logs')
+
+        sudo_mock.assert_called_with(collect.archive_logs_command(
+            ['/var/log/presto/server.log*', '/var/log/presto/launcher.log*'],
+            '/tmp/presto-debug-remote.abc/node1.tar.gz', 'node1'))
+        warn_mock.assert_called_once_with('remote path /var/log/presto/launcher.log*'
+                                          ' not found on node1')
+        get_mock.assert_called_with('/tmp/presto-debug-remote.abc/node1.tar.gz',
+                                    '/local/logs/node1.tar.gz')
+        run_mock.assert_called_with('rm -rf /tmp/presto-debug-remote.abc')
+
+    @patch('prestoadmin.collect.get')
+    @patch('prestoadmin.collect.put')
+    @patch('prestoadmin.collect.sudo')
+    @patch('prestoadmin.collect.run')
+    @patch('prestoadmin.collect.lookup_launcher_log_file',
+           return_value='/var/log/presto/launcher.log')
+    @patch('prestoadmin.collect.lookup_server_log_file',
+           return_value='/var/log/presto/server.log')
+    def test_get_remote_log_files_sliced(self, server_log_mock, launcher_log_mock,
+                                         run_mock, sudo_mock, put_mock, get_mock):
+        env.host = 'node1'
+        run_mock.return_value = '/tmp/presto-debug-remote.abc'
+        sudo_mock.return_value = _AttributeString('')
+        sudo_mock.return_value.succeeded = True
+
+        collect.get_remote_log_files('/local/logs', ['--since=-3600'])
+
+        self.assertEqual(put_mock.call_args[0][1], '/tmp/presto-debug-remote.abc/log_slicer.py')
+        sudo_mock.assert_called_with(
+            '"$(command -v python || command -v python3)" /tmp/presto-debug-remote.abc/log_slicer.py '
+            "'--since=-3600' '/tmp/presto-debug-remote.abc/node1.tar.gz' 'node1' "
+            "'/var/log/presto/server.log*' '/var/log/presto/launcher.log*'")
+        get_mock.assert_called_with('/tmp/presto-debug-remote.abc/node1.tar.gz',
+                                    '/local/logs/node1.tar.gz')
+
+    @patch('prestoadmin.collect.get')
+    @patch('prestoadmin.collect.put')
+    @patch('prestoadmin.collect.sudo')
+    @patch('prestoadmin.collect.run')
+    @patch('prestoadmin.collect.lookup_launcher_log_file',
+           return_value='/var/log/presto/launcher.log')
+    @patch('prestoadmin.collect.lookup_server_log_file',
+           return_value='/var/log/presto/server.log')
+    def test_get_remote_log_files_incremental(self, server_log_mock, launcher_log_mock,
+                                              run_mock, sudo_mock, put_mock, get_mock):
+        env.host = 'node1'
+        run_mock.return_value = '/tmp/presto-debug-remote.abc'
+        sudo_mock.return_value = _AttributeString('')
+        sudo_mock.return_value.succeeded = True
+        get_mock.side_effect = lambda remote, local: \
+            local.write('{"12": {"offset": 30}}') if remote.endswith('.json') else None
+
+        offsets = collect.get_remote_log_files('/local/logs', [],
+                                               {'node1': {'12': {'offset': 10}}})
+
+        self.assertEqual(offsets, {'12': {'offset': 30}})
+        offsets_file, remote_offsets = put_mock.call_args_list[0][0]
+        self.assertEqual(remote_offsets, '/tmp/presto-debug-remote.abc/offsets.json')
+        self.assertEqual(json.loads(offsets_file.getvalue()), {'12': {'offset': 10}})
+        self.assertTrue("'--offsets=/tmp/presto-debug-remote.abc/offsets.json'"
+                        in sudo_mock.call_args[0][0])
+
+    def test_log_slicer_options(self):
+        self.assertEqual(collect.log_slicer_options(), [])
+        env.log_since = '2h'
+        env.log_until = '2019-10-01'
+        env.max_log_size = '10M'
+        self.assertEqual(collect.log_slicer_options(),
+                         ['--since=-7200', '--until=2019-10-01T23:59:59',
+                          '--max-bytes=%d' % (10 * 1024 * 1024)])
+
+    def test_parse_log_time(self):
+        self.assertEqual(collect.parse_log_time('30m'), '-1800')
+        self.assertEqual(collect.parse_log_time('2019-10-01'), '2019-10-01T00:00:00')
+        self.assertEqual(collect.parse_log_time('2019-10-01 12:30'), '2019-10-01T12:30:00')
+        self.assertEqual(collect.parse_log_time('2019-10-01T12:30:15'), '2019-10-01T12:30:15')
+        self.assertRaisesRegexp(SystemExit, 'Invalid log time yesterday',
+                                collect.parse_log_time, 'yesterday')
+
+    def test_parse_log_size(self):
+        self.assertEqual(collect.parse_log_size('100'), 100)
+        self.assertEqual(collect.parse_log_size('2k'), 2048)
+        self.assertEqual(collect.parse_log_size('1G'), 1024 ** 3)
+        self.assertRaisesRegexp(SystemExit, 'Invalid log size 1.5G',
+                                collect.parse_log_size, '1.5G')
+
+    def test_archive_logs_command(self):
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir)
+        for name in ['server.log', 'server.log-2', 'other.log']:
+            with open(path.join(log_dir, name), 'w') as f:
+                f.write(name)
+        archive = path.join(log_dir, 'node1.tar.gz')
+
+        command = collect.archive_logs_command(
+            [path.join(log_dir, 'server.log*'), path.join(log_dir, 'launcher.log*')],
+            archive, 'node1')
+        missing = subprocess.check_output(['bash', '-c', command])
+
+        self.assertEqual(missing, 'prestoadmin: no logs match ' +
+                         path.join(log_dir, 'launcher.log*') + '\n')
+        tar = tarfile.open(archive)
+        try:
+            self.assertEqual(sorted(tar.getnames()),
+                             ['node1/server.log', 'node1/server.log-2'])
+            self.assertEqual(tar.extractfile('node1/server.log-2').read(),
+                             'server.log-2')
+        finally:
+            tar.close()
+
+    def test_archive_logs_command_allows_logs_that_grow(self):
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir)
+        with open(path.join(log_dir, 'server.log'), 'w') as f:
+            f.write('server.log')
+        archive = path.join(log_dir, 'node1.tar.gz')
+
+        command = collect.archive_logs_command([path.join(log_dir, 'server.log*')],
+                                               archive, 'node1')
+        self.assertTrue('tar --warning=no-file-changed ' in command)
+        # Exit like GNU tar does when a file grows while it is archived.
+        grown_tar = 'tar() { command tar "$@"; return 1; }; '
+        subprocess.check_call(['bash', '-c', grown_tar + command])
+        self.assertEqual(os.stat(archive).st_mode & 0777, 0644)
+
+        failed_tar = 'tar() { return 2; }; '
+        self.assertRaises(subprocess.CalledProcessError, subprocess.check_call,
+                          ['bash', '-c', failed_tar + command])
+
     @patch("prestoadmin.collect.os.makedirs")
     @patch("prestoadmin.collect.get")
     def test_get_files(self, get_mock, makedirs_mock):
@@ -185,46 +383,43 @@ class TestCollect(BaseUnitCase):
         make_tarfile_mock.assert_called_with(OUTPUT_FILENAME_FOR_SYS_INFO,
                                              downloaded_sys_info_loc)
 
-    @patch("prestoadmin.collect.get_files")
-    @patch("prestoadmin.collect.append")
-    @patch("prestoadmin.collect.get_presto_version")
-    @patch("prestoadmin.collect.get_java_version")
-    @patch("prestoadmin.collect.get_platform_information")
+    @patch('prestoadmin.collect.get_catalog_configs')
     @patch('prestoadmin.collect.run')
-    def test_get_system_info(self, run_collect_mock,
-                             plat_info_mock, java_version_mock,
-                             server_version_mock,
-                             append_mock, get_files_mock):
-        downloaded_sys_info_loc = path.join(TMP_PRESTO_DEBUG, "sysinfo")
-        version_info_file_name = path.join(TMP_PRESTO_DEBUG_REMOTE,
-                                           "version_info.txt")
-
-        platform_info = "platform abcd"
-        server_version = "dummy_verion"
-        java_version = "java dummy version"
-        plat_info_mock.return_value = platform_info
-        java_version_mock.return_value = java_version
-        server_version_mock.return_value = server_version
-
-        collect.get_system_info(downloaded_sys_info_loc)
-
-        run_collect_mock.assert_any_call('mkdir -p ' + TMP_PRESTO_DEBUG_REMOTE)
-
-        append_mock.assert_any_call(version_info_file_name,
-                                    'platform information : ' +
-                                    platform_info + '\n')
-
-        append_mock.assert_any_call(version_info_file_name,
-                                    'Java version: ' +
-                                    java_version + '\n')
-
-        append_mock.assert_any_call(version_info_file_name,
-                                    'Presto-admin version: ' +
-                                    prestoadmin.__version__ + '\n')
-
-        append_mock.assert_any_call(version_info_file_name,
-                                    'Presto server version: ' +
-                                    server_version + '\n')
-
-        get_files_mock.assert_called_with(version_info_file_name,
-                                          downloaded_sys_info_loc)
+    def test_get_system_info(self, run_mock, catalog_configs_mock):
+        env.host = 'node1'
+        run_mock.return_value = _AttributeString(
+            '==> platform <==\nLinux node1 x86_64\n'
+            '==> java_version <==\njava version "1.8.0_40"\nJava(TM) SE Runtime\n'
+            '==> presto_version <==\n0.213\n')
+        download_location = tempfile.mkdtemp()
+
+        try:
+            collect.get_system_info(download_location)
+            with open(path.join(download_location, 'node1', 'system_info.json')) as f:
+                system_info = json.load(f)
+            with open(path.join(download_location, 'node1', 'version_info.txt')) as f:
+                version_info = f.read()
+        finally:
+            shutil.rmtree(download_location)
+
+        self.assertEqual(run_mock.call_count, 1)
+        self.assertEqual(system_info,
+                         {'platform': 'Linux node1 x86_64',
+                          'java_version': 'java version "1.8.0_40"\nJava(TM) SE Runtime',
+                          'presto_version': '0.213',
+                          'presto_admin_version': prestoadmin.__version__})
+        self.assertEqual(version_info,
+                         'platform information : Linux node1 x86_64\n'
+                         'Java version: java version "1.8.0_40"\nJava(TM) SE Runtime\n'
+                         'Presto-admin version: ' + prestoadmin.__version__ + '\n'
+                         'Presto server version: 0.213\n')
+        catalog_configs_mock.assert_called_with(download_location)
+
+    def test_parse_system_info_without_presto(self):
+        self.assertEqual(collect.parse_system_info('==> platform <==\nLinux\n'
+                                                   '==> java_version <==\n'
+                                                   '==> presto_version <==\n'),
+                         {'platform': 'Linux', 'java_version': '', 'presto_version': ''})
+
+    def test_get_system_info_is_parallel(self):
+        self.assertTrue(collect.get_system_info.parallel)
@@ -15,6 +15,15 @@
 """
 Tests deploying the presto configuration
 """
+import base64
+import os
+import re
+import shutil
+import subprocess
+import tarfile
+import tempfile
+from StringIO import StringIO
+
 from mock import patch
 
 from fabric.api import env
@@ -103,14 +112,104 @@ class TestDeploy(BaseTestCase):
         secure_create_file_mock.assert_called_with('/remote/path/my_file', 'presto:presto', 600)
         sudo_mock.assert_called_with("echo 'hello!' > /remote/path/my_file")
 
+    @patch('prestoadmin.deploy.deploy_archive')
+    @patch('prestoadmin.deploy.deploy')
+    @patch('prestoadmin.deploy.deploy_node_properties')
+    def test_configure_presto(self, deploy_node_mock, deploy_mock,
+                              deploy_archive_mock):
+        env.host = 'localhost'
+        conf = {"node.properties": {"key": "value"}, "jvm.config": ["list"]}
+        remote_dir = "/my/remote/dir"
+        deploy.configure_presto(conf, remote_dir)
+        deploy_archive_mock.assert_called_with({"jvm.config": "list"},
+                                               "key=value", remote_dir)
+        self.assertFalse(deploy_mock.called)
+        self.assertFalse(deploy_node_mock.called)
+
+    @patch('prestoadmin.deploy.deploy_archive', return_value=False)
     @patch('prestoadmin.deploy.deploy')
     @patch('prestoadmin.deploy.deploy_node_properties')
-    def test_configure_presto(self, deploy_node_mock, deploy_mock):
+    def test_configure_presto_large_files(self, deploy_node_mock, deploy_mock,
+                                          deploy_archive_mock):
         env.host = 'localhost'
         conf = {"node.properties": {"key": "value"}, "jvm.config": ["list"]}
         remote_dir = "/my/remote/dir"
         deploy.configure_presto(conf, remote_dir)
         deploy_mock.assert_called_with({"jvm.config": "list"}, remote_dir)
+        deploy_node_mock.assert_called_with("key=value", remote_dir)
+
+    def test_build_config_archive(self):
+        archive = deploy.build_config_archive(
+            {'jvm.config': '-server', 'config.properties': 'a=b'},
+            'presto:presto')
+        tar = tarfile.open(fileobj=StringIO(archive), mode='r:gz')
+        self.assertEqual(sorted(tar.getnames()),
+                         ['config.properties', 'jvm.config'])
+        for member in tar.getmembers():
+            self.assertEqual((member.uname, member.gname, member.mode),
+                             ('presto', 'presto', 0600))
+        self.assertEqual(tar.extractfile('jvm.config').read(), '-server\n')
+
+    @patch('prestoadmin.deploy.sudo')
+    def test_deploy_archive_keeps_node_id(self, sudo_mock):
+        remote_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, remote_dir)
+        node_file = os.path.join(remote_dir, 'node.properties')
+
+        def run_locally(command, **kwargs):
+            # Stand in for the commands that need the presto user.
+            subprocess.check_call(['bash', '-c', 'getent() { true; }; chown() { true; }; '
+                                                 'uuidgen() { echo new-id; }; ' + command])
+            return SudoResult()
+        sudo_mock.side_effect = run_locally
+
+        deploy.deploy_archive({}, 'key=value', remote_dir)
+        with open(node_file) as f:
+            self.assertEqual(f.read(), 'node.id=new-id\nkey=value\n')
+
+        with open(node_file, 'w') as f:
+            f.write('node.id = abc\nkey=value\n')
+        deploy.deploy_archive({}, 'key=other', remote_dir)
+        with open(node_file) as f:
+            self.assertEqual(f.read(), 'node.id = abc\nkey=other\n')
+
+    @patch('prestoadmin.deploy.sudo')
+    def test_deploy_archive_is_one_command(self, sudo_mock):
+        sudo_mock.return_value = SudoResult()
+        self.assertTrue(deploy.deploy_archive({'jvm.config': '-server'},
+                                              'key=value', '/my/remote/dir'))
+        self.assertEqual(sudo_mock.call_count, 1)
+        command = sudo_mock.call_args[0][0]
+        self.assertTrue("grep -s 'node.id' /my/remote/dir/node.properties"
+                        in command)
+        self.assertTrue('mv -f "$staging"/* /my/remote/dir/' in command)
+
+        payload = re.search(r"echo '([^']*)' \| base64 -d", command).group(1)
+        tar = tarfile.open(fileobj=StringIO(base64.b64decode(payload)),
+                           mode='r:gz')
+        self.assertEqual(tar.extractfile('node.properties').read(),
+                         'key=value\n')
+        self.assertEqual(tar.extractfile('jvm.config').read(), '-server\n')
+
+    @patch('prestoadmin.deploy.sudo')
+    def test_deploy_archive_too_large(self, sudo_mock):
+        confs = {'jvm.config': base64.b64encode(
+            os.urandom(deploy.MAX_INLINE_ARCHIVE_SIZE))}
+        self.assertFalse(deploy.deploy_archive(confs, 'key=value',
+                                               '/my/remote/dir'))
+        self.assertFalse(sudo_mock.called)
+
+    @patch('prestoadmin.deploy.abort')
+    @patch('prestoadmin.deploy.sudo')
+    def test_deploy_archive_missing_presto_user(self, sudo_mock, abort_mock):
+        result = SudoResult()
+        result.return_code = deploy.MISSING_OWNER_CODE
+        result.failed = True
+        sudo_mock.return_value = result
+        deploy.deploy_archive({}, 'key=value', '/my/remote/dir')
+        abort_mock.assert_called_with(
+            'User presto does not exist. Make sure the Presto server RPM is '
+            'installed and try again')
 
     def test_escape_quotes_do_nothing(self):
         text = 'basic_text'
@@ -11,6 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import os
 import sys
 import logging
 
@@ -28,6 +29,7 @@ from mock import call
 from mock import patch
 from tests.base_test_case import BaseTestCase
 
+from prestoadmin.util import timing, worker_pool
 from prestoadmin.util.application import Application
 from prestoadmin.fabric_patches import execute
 
@@ -35,6 +37,11 @@ from prestoadmin.fabric_patches import execute
 APPLICATION_NAME = 'foo'
 
 
+@parallel
+def _parallel_pid_task():
+    return os.getpid()
+
+
 @patch('prestoadmin.util.application.filesystem')
 @patch('prestoadmin.util.application.logging.config')
 class FabricPatchesTest(BaseTestCase):
@@ -153,6 +160,61 @@ class FabricPatchesTest(BaseTestCase):
                 ]
         )
 
+    @patch('fabric.operations._run_command')
+    def test_run_is_timed(self, run_command_mock, logging_config_mock,
+                          filesystem_mock):
+        out = fabric.operations._AttributeString('Test warning')
+        out.command = 'echo "Test warning"'
+        out.real_command = '/bin/bash echo "Test warning"'
+        out.stderr = ''
+        out.return_code = 0
+        run_command_mock.return_value = out
+        fabric.api.env.timing_report = True
+        fabric.api.env.host_string = 'localhost'
+        fabric.api.env.host = 'localhost'
+        fabric.api.run('echo "Test warning"')
+        records = timing.take_records()
+        self.assertEqual([(r.host, r.command, r.bytes_in) for r in records],
+                         [('localhost', 'echo "Test warning"', 12)])
+
+    @patch('fabric.operations._run_command')
+    def test_failed_sudo_is_timed(self, run_command_mock, logging_config_mock,
+                                  filesystem_mock):
+        fabric.api.env.timing_report = True
+        fabric.api.env.host_string = 'localhost'
+        run_command_mock.side_effect = NetworkError('Timed out')
+        self.assertRaises(NetworkError, fabric.api.sudo, 'true')
+        records = timing.take_records()
+        self.assertEqual([(r.command, r.exit_code) for r in records],
+                         [('true', None)])
+
+    @patch('prestoadmin.fabric_patches.old_put')
+    def test_put_is_timed(self, put_mock, logging_config_mock,
+                          filesystem_mock):
+        paths = fabric.operations._AttributeList(['/tmp/presto.rpm'])
+        paths.failed = []
+        put_mock.return_value = paths
+        fabric.api.env.trace_file = 'trace.json'
+        fabric.api.env.host = 'localhost'
+        self.assertEqual(fabric.api.put(__file__, '/tmp'), paths)
+        records = timing.take_records()
+        self.assertEqual([(r.operation, r.command, r.exit_code, r.bytes_out)
+                          for r in records],
+                         [('put', __file__, 0, os.path.getsize(__file__))])
+
+    def test_tasks_are_timed_on_each_host(self, logging_config_mock,
+                                          filesystem_mock):
+        @serial
+        def task():
+            pass
+
+        fabric.api.env.trace_file = 'trace.json'
+        execute(task, hosts=['a', 'b'])
+        records = timing.take_records()
+        self.assertEqual([(r.host, r.operation, r.command, r.exit_code)
+                          for r in records],
+                         [('a', 'task', 'task', 0), ('b', 'task', 'task', 0)])
+
 
 # Most of these tests were taken or modified from fabric's test_tasks.py
 # Below is the license for the fabric code:
@@ -518,3 +580,15 @@ class TestExecute(BaseTestCase):
             self.assertRaisesRegexp(TypeError,
                                     'task\(\) takes exactly 1 argument'
                                     ' \(0 given\)', execute, task)
+
+    def test_parallel_tasks_reuse_session_workers(self):
+        hosts = ['127.0.0.1:2200', '127.0.0.1:2201']
+        worker_pool.start_session()
+        try:
+            with hide('everything'):
+                first = execute(_parallel_pid_task, hosts=hosts)
+                second = execute(_parallel_pid_task, hosts=hosts)
+        finally:
+            worker_pool.end_session()
+        self.assertEqual(first, second)
+        self.assertNotIn(os.getpid(), first.values())
@@ -21,7 +21,10 @@ test_prestoadmin
 Tests for `prestoadmin` module.
 """
 from optparse import Values
+import json
 import os
+import shutil
+import tempfile
 import unittest
 from fabric import state
 
@@ -36,6 +39,7 @@ from prestoadmin import topology
 # LINTED: the @patch decorators in mock_load_topology and mock_empty_topology
 # require that this import be here in order to work properly.
 from prestoadmin.standalone.config import StandaloneConfig  # noqa
+from prestoadmin.util import timing
 from prestoadmin.util.exception import ConfigurationError
 from tests.unit.base_unit_case import BaseUnitCase
 
@@ -396,6 +400,103 @@ class TestMain(BaseMainCase):
                         'coordinators, workers, SSH port, and SSH username)'
                         '\n\n' in self.test_stdout.getvalue())
 
+    @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
+    def test_rpm_relay_check(self, unused_mock_load):
+        try:
+            main.main(['topology', 'show', '--rpm-relay=2'])
+        except SystemExit as e:
+            self.assertEqual(e.code, 2)
+        self.assertTrue('Invalid argument --rpm-relay to task: topology.show\n'
+                        in self.test_stderr.getvalue())
+
+    @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
+    def test_rpm_relay_must_be_positive(self, unused_mock_load):
+        try:
+            main.main(['package', 'install', '/any/path/rpm', '--rpm-relay=0'])
+        except SystemExit as e:
+            self.assertEqual(e.code, 2)
+        self.assertTrue('--rpm-relay must be at least 1\n'
+                        in self.test_stderr.getvalue())
+
+    @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
+    def test_query_max_wait_must_be_positive(self, unused_mock_load):
+        try:
+            main.main(['server', 'status', '--query-max-wait=0'])
+        except SystemExit as e:
+            self.assertEqual(e.code, 2)
+        self.assertTrue('--query-max-wait must be greater than 0\n'
+                        in self.test_stderr.getvalue())
+
+    @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
+    def test_log_filter_check(self, unused_mock_load):
+        try:
+            main.main(['server', 'status', '--since=1h'])
+        except SystemExit as e:
+            self.assertEqual(e.code, 2)
+        self.assertTrue('Invalid argument --since to task: server.status\n'
+                        in self.test_stderr.getvalue())
+
+    @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
+    def test_watch_check(self, unused_mock_load):
+        try:
+            main.main(['server', 'start', '--watch'])
+        except SystemExit as e:
+            self.assertEqual(e.code, 2)
+        self.assertTrue('Invalid argument --watch to task: server.start\n'
+                        in self.test_stderr.getvalue())
+
+    @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
+    def test_json_check(self, unused_mock_load):
+        try:
+            main.main(['server', 'start', '--json'])
+        except SystemExit as e:
+            self.assertEqual(e.code, 2)
+        self.assertTrue('Invalid argument --json to task: server.start\n'
+                        in self.test_stderr.getvalue())
+
+    @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
+    def test_incremental_check(self, unused_mock_load):
+        try:
+            main.main(['server', 'status', '--incremental'])
+        except SystemExit as e:
+            self.assertEqual(e.code, 2)
+        self.assertTrue('Invalid argument --incremental to task: server.status\n'
+                        in self.test_stderr.getvalue())
+
+    @patch('prestoadmin.main.timing.print_timing_report')
+    @patch('prestoadmin.main.run_tasks', side_effect=SystemExit(1))
+    @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
+    def test_timing_report_is_printed_when_a_task_fails(self, unused_mock_load,
+                                                        unused_run_tasks, print_mock):
+        self.assertRaises(SystemExit, main.main, ['server', 'start', '--timing-report'])
+        print_mock.assert_called_once_with([])
+
+    @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
+    def test_trace_file_is_written(self, unused_mock_load):
+        trace_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, trace_dir)
+        trace_path = os.path.join(trace_dir, 'trace.json')
+
+        def run_tasks(task_list):
+            timing.add_records([timing.CommandTiming('master', 'server.start', 'run', 'true',
+                                                     0, 1.0, 0, 4, 0)])
+            return {'master': None}
+
+        with patch('prestoadmin.main.run_tasks', side_effect=run_tasks):
+            main.main(['server', 'start', '--trace-file', trace_path])
+        with open(trace_path) as f:
+            events = json.load(f)['traceEvents']
+        self.assertEqual([event['ph'] for event in events], ['M', 'M', 'X'])
+        self.assertEqual(events[1]['args'], {'name': 'master'})
+
+    @patch('prestoadmin.main.run_tasks', return_value={'master': None})
+    @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
+    def test_unwritable_trace_file_warns(self, unused_mock_load, unused_run_tasks):
+        trace_path = os.path.join(tempfile.gettempdir(), 'missing', 'trace.json')
+        self.assertEqual(main.main(['server', 'start', '--trace-file', trace_path]), 0)
+        self.assertTrue('Could not write the trace file %s' % trace_path
+                        in self.test_stderr.getvalue())
+
     @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
     def test_skip_bad_hosts(self, unused_mock_load):
         main.parse_and_validate_commands(['server', 'install',
@@ -12,6 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import os
+import shutil
+import tempfile
+
 from fabric.state import env
 from fabric.operations import _AttributeString
 from mock import patch
@@ -22,10 +27,13 @@ from tests.unit.base_unit_case import BaseUnitCase
 
 class TestPackage(BaseUnitCase):
 
+    @patch('prestoadmin.package._has_checksum', side_effect=[False, True])
+    @patch('prestoadmin.package.sha256_of_file', return_value='abc')
     @patch('prestoadmin.package.os.path.isfile')
     @patch('prestoadmin.package.sudo')
     @patch('prestoadmin.package.put')
-    def test_deploy_is_called(self, mock_put, mock_sudo, mock_isfile):
+    def test_deploy_is_called(self, mock_put, mock_sudo, mock_isfile,
+                              mock_sha256, mock_checksum):
         env.host = 'any_host'
         mock_isfile.return_value = True
         package.deploy('/any/path/rpm')
@@ -34,6 +42,45 @@ class TestPackage(BaseUnitCase):
         mock_put.assert_called_with('/any/path/rpm',
                                     constants.REMOTE_PACKAGES_PATH,
                                     use_sudo=True)
+        mock_checksum.assert_called_with('/opt/prestoadmin/packages/rpm',
+                                         'abc')
+
+    @patch('prestoadmin.package._has_checksum', return_value=True)
+    @patch('prestoadmin.package.sha256_of_file', return_value='abc')
+    @patch('prestoadmin.package.os.path.isfile')
+    @patch('prestoadmin.package.sudo')
+    @patch('prestoadmin.package.put')
+    def test_deploy_skips_identical_rpm(self, mock_put, mock_sudo,
+                                        mock_isfile, mock_sha256,
+                                        mock_checksum):
+        env.host = 'any_host'
+        mock_isfile.return_value = True
+        package.deploy('/any/path/rpm')
+        mock_checksum.assert_called_with('/opt/prestoadmin/packages/rpm',
+                                         'abc')
+        self.assertFalse(mock_put.called)
+        self.assertFalse(mock_sudo.called)
+
+    @patch('prestoadmin.package._has_checksum', return_value=False)
+    @patch('prestoadmin.package.sha256_of_file', return_value='abc')
+    @patch('prestoadmin.package.os.path.isfile')
+    @patch('prestoadmin.package.sudo')
+    @patch('prestoadmin.package.put')
+    def test_deploy_checksum_mismatch(self, mock_put, mock_sudo, mock_isfile,
+                                      mock_sha256, mock_checksum):
+        env.host = 'any_host'
+        mock_isfile.return_value = True
+        self.assertRaisesRegexp(
+            SystemExit, 'Checksum mismatch for /opt/prestoadmin/packages/rpm '
+                        'on any_host',
+            package.deploy, '/any/path/rpm')
+
+    @patch('prestoadmin.package.sha256_of_file', return_value='abc')
+    def test_local_checksum_is_computed_once(self, mock_sha256):
+        self.assertEqual(package.local_checksum('/any/path/rpm'), 'abc')
+        self.assertEqual(package.local_checksum('/any/path/rpm'), 'abc')
+        self.assertEqual(env.rpm_checksums, {'/any/path/rpm': 'abc'})
+        self.assertEqual(mock_sha256.call_count, 1)
 
     @patch('prestoadmin.package.sudo')
     def test_rpm_install(self, mock_sudo):
@@ -66,10 +113,11 @@ class TestPackage(BaseUnitCase):
 
         mock_rpm_upgrade.assert_any_call('/opt/prestoadmin/packages/test.rpm')
 
+    @patch('prestoadmin.package.sha256_of_file')
     @patch('prestoadmin.package.rpm_install')
     @patch('prestoadmin.package.deploy')
     @patch('prestoadmin.package.check_if_valid_rpm')
-    def test_install(self, mock_chksum, mock_deploy, mock_install):
+    def test_install(self, mock_chksum, mock_deploy, mock_install, mock_sha256):
         env.host = 'any_host'
         self.remove_runs_once_flag(package.install)
         package.install('/any/path/rpm')
@@ -102,10 +150,32 @@ class TestPackage(BaseUnitCase):
                                       capture=True)
         mock_abort.assert_called_with('Not an rpm package')
 
+    @patch('prestoadmin.package.local')
+    def test_check_rpm_checksum_once(self, mock_local):
+        mock_local.return_value = _AttributeString('rpm: sha1 md5 OK')
+        mock_local.return_value.stderr = ''
+        rpm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, rpm_dir)
+        rpm_path = os.path.join(rpm_dir, 'test.rpm')
+        with open(rpm_path, 'w') as f:
+            f.write('rpm')
+
+        package.check_if_valid_rpm(rpm_path)
+        package.check_if_valid_rpm(rpm_path)
+        self.assertEqual(mock_local.call_count, 1)
+        self.assertEqual(package.local_checksum(rpm_path),
+                         hashlib.sha256('rpm').hexdigest())
+
+        os.utime(rpm_path, (0, 0))
+        package.check_if_valid_rpm(rpm_path)
+        self.assertEqual(mock_local.call_count, 2)
+
+    @patch('prestoadmin.package._has_checksum', side_effect=[False, True, False])
+    @patch('prestoadmin.package.sha256_of_file', return_value='abc')
     @patch('prestoadmin.package.os.path.isfile')
     @patch('prestoadmin.package.sudo')
     @patch('prestoadmin.package.put')
-    def test_deploy_with_fallback_location(self, mock_put, mock_sudo, mock_isfile):
+    def test_deploy_with_fallback_location(self, mock_put, mock_sudo, mock_isfile, mock_sha256, mock_checksum):
         env.host = 'any_host'
         mock_isfile.return_value = True
         package.deploy('/any/path/rpm')
@@ -117,6 +187,123 @@ class TestPackage(BaseUnitCase):
                                     use_sudo=True,
                                     temp_dir='/tmp')
 
+    def test_plan_relay_rounds(self):
+        hosts = ['host%d' % i for i in range(10)]
+        rounds = package.plan_relay_rounds(hosts, 2)
+        self.assertEqual(rounds[0], [(None, 'host0'), (None, 'host1')])
+        self.assertEqual(rounds[1], [(None, 'host2'), (None, 'host3'),
+                                     ('host0', 'host4'), ('host1', 'host5')])
+        self.assertEqual(len(rounds), 3)
+
+        targets = [target for transfers in rounds
+                   for _, target in transfers]
+        self.assertEqual(sorted(targets), sorted(hosts))
+        holders = set()
+        for transfers in rounds:
+            sources = [source for source, _ in transfers if source]
+            # Every source got the file in an earlier round, and only sends
+            # it to one host per round.
+            self.assertTrue(holders.issuperset(sources))
+            self.assertEqual(len(sources), len(set(sources)))
+            holders.update(target for _, target in transfers)
+
+    def test_plan_relay_rounds_is_logarithmic(self):
+        hosts = ['host%d' % i for i in range(1000)]
+        self.assertEqual(len(package.plan_relay_rounds(hosts, 1)), 10)
+        self.assertEqual(package.plan_relay_rounds([], 1), [])
+        self.assertRaises(ValueError, package.plan_relay_rounds, hosts, 0)
+
+    @patch('prestoadmin.package.execute')
+    @patch('prestoadmin.package.sha256_of_file', return_value='abc')
+    def test_relay_runs_one_execute_per_round(self, mock_sha256,
+                                              mock_execute):
+        package.relay('/any/path/rpm', ['host1', 'host2', 'host3'], 1)
+        self.assertEqual(mock_execute.call_args_list[0][0][1:],
+                         ('/any/path/rpm', 'abc', {'host1': None}))
+        self.assertEqual(mock_execute.call_args_list[1][0][1:],
+                         ('/any/path/rpm', 'abc',
+                          {'host2': None, 'host3': 'host1'}))
+        self.assertEqual(mock_execute.call_args_list[1][1],
+                         {'hosts': ['host2', 'host3']})
+
+    @patch('prestoadmin.package._upload')
+    @patch('prestoadmin.package._has_checksum', side_effect=[False, True])
+    @patch('prestoadmin.package._copy_from_host', return_value=True)
+    def test_relay_hop_from_host(self, mock_copy, mock_checksum, mock_upload):
+        env.host = 'host2'
+        package._relay_hop('/any/path/rpm', 'abc', {'host2': 'host1'})
+        mock_copy.assert_called_with('host1', '/opt/prestoadmin/packages/rpm')
+        mock_checksum.assert_called_with('/opt/prestoadmin/packages/rpm',
+                                         'abc')
+        self.assertFalse(mock_upload.called)
+
+    @patch('prestoadmin.package._upload')
+    @patch('prestoadmin.package._has_checksum', return_value=True)
+    @patch('prestoadmin.package._copy_from_host')
+    def test_relay_hop_skips_identical_rpm(self, mock_copy, mock_checksum,
+                                           mock_upload):
+        env.host = 'host2'
+        package._relay_hop('/any/path/rpm', 'abc', {'host2': 'host1'})
+        self.assertFalse(mock_copy.called)
+        self.assertFalse(mock_upload.called)
+
+    @patch('prestoadmin.package.warn')
+    @patch('prestoadmin.package._upload')
+    @patch('prestoadmin.package._has_checksum', return_value=False)
+    @patch('prestoadmin.package._copy_from_host', return_value=True)
+    def test_relay_hop_falls_back_to_admin_host(self, mock_copy,
+                                                mock_checksum, mock_upload,
+                                                mock_warn):
+        env.host = 'host2'
+        package._relay_hop('/any/path/rpm', 'abc', {'host2': 'host1'})
+        mock_upload.assert_called_with('/any/path/rpm',
+                                       '/opt/prestoadmin/packages/rpm', 'abc')
+        mock_warn.assert_called_with('Could not relay /opt/prestoadmin/packages/rpm from '
+                                     'host1 to host2; copying it from this host')
+
+    @patch('prestoadmin.package.sudo')
+    @patch('prestoadmin.package.run')
+    def test_copy_from_host(self, mock_run, mock_sudo):
+        env.host = 'host2'
+        env.user = 'user'
+        env.port = '22'
+        temp_dir = _AttributeString('/tmp/prestoadmin-relay.abc')
+        temp_dir.succeeded = True
+        mock_run.return_value = temp_dir
+        mock_sudo.return_value.succeeded = True
+
+        self.assertTrue(package._copy_from_host('host1', '/opt/prestoadmin/packages/rpm'))
+        self.assertEqual([args[0][0] for args in mock_run.call_args_list], [
+            'mktemp -d /tmp/prestoadmin-relay.XXXXXXXXXXXXXX',
+            'scp -q -o BatchMode=yes -P 22 /opt/prestoadmin/packages/rpm '
+            'user@host2:/tmp/prestoadmin-relay.abc/rpm',
+            'rm -rf /tmp/prestoadmin-relay.abc'])
+        mock_sudo.assert_called_with(
+            'mkdir -p /opt/prestoadmin/packages && '
+            'mv -f /tmp/prestoadmin-relay.abc/rpm /opt/prestoadmin/packages/rpm')
+
+    @patch('prestoadmin.package.sudo')
+    @patch('prestoadmin.package.run')
+    def test_copy_from_host_failure(self, mock_run, mock_sudo):
+        env.host = 'host2'
+        temp_dir = _AttributeString('/tmp/prestoadmin-relay.abc')
+        temp_dir.succeeded = True
+        failed = _AttributeString('Host key verification failed.')
+        failed.succeeded = False
+        mock_run.side_effect = [temp_dir, failed, temp_dir]
+
+        self.assertFalse(package._copy_from_host('host1', '/opt/prestoadmin/packages/rpm'))
+        self.assertFalse(mock_sudo.called)
+        mock_run.assert_called_with('rm -rf /tmp/prestoadmin-relay.abc')
+
+    @patch('prestoadmin.package.sudo')
+    def test_has_checksum(self, mock_sudo):
+        mock_sudo.return_value = _AttributeString('abc  /path/rpm')
+        mock_sudo.return_value.succeeded = True
+        self.assertTrue(package._has_checksum('/path/rpm', 'abc'))
+        self.assertFalse(package._has_checksum('/path/rpm', 'def'))
+        mock_sudo.assert_called_with('sha256sum /path/rpm')
+
     @patch('prestoadmin.package.os.path.isfile')
     def test_deploy_invalid_local_path(self, mock_isfile):
         mock_isfile.return_value = False
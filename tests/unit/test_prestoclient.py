@@ -12,18 +12,64 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import socket
-from httplib import HTTPException, HTTPConnection
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from httplib import BadStatusLine, HTTPException, HTTPConnection
 
+from fabric.api import env
 from fabric.operations import _AttributeString
-from mock import patch, PropertyMock
+from mock import patch, MagicMock, PropertyMock
 
-from prestoadmin.prestoclient import URL_TIMEOUT_MS, PrestoClient
+from prestoadmin.prestoclient import NUM_ROWS, URL_TIMEOUT_MS, \
+    POLL_INITIAL_INTERVAL, POLL_MAX_INTERVAL, MAX_IDLE_FOR_UNSAFE_REQUESTS, \
+    PrestoClient
+from prestoadmin.util.presto_config import PrestoConfig
 from prestoadmin.util.exception import InvalidArgumentError
 from tests.base_test_case import BaseTestCase
 from tests.unit.base_unit_case import PRESTO_CONFIG
 
 
+class _StubStatementHandler(BaseHTTPRequestHandler):
+    """
+    Answers a query with server.pages, one per request, then the rows.
+    """
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.getheader('content-length', 0)))
+        self._send_page(0)
+
+    def do_GET(self):
+        self._send_page(int(self.path.rsplit('/', 1)[1]))
+
+    def do_DELETE(self):
+        self.server.requests.append(('DELETE', self.path))
+        self._send_body('')
+
+    def _send_page(self, page):
+        self.server.requests.append((self.command, self.path))
+        answer = {}
+        if page < len(self.server.pages):
+            answer['nextUri'] = 'http://localhost:%d/v1/statement/q/%d' % (
+                self.server.server_port, page + 1)
+            if self.server.pages[page]:
+                answer['data'] = self.server.pages[page]
+        self._send_body(json.dumps(answer))
+
+    def _send_body(self, body):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
 @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
        return_value=PRESTO_CONFIG)
 class TestPrestoClient(BaseTestCase):
@@ -111,3 +157,255 @@ class TestPrestoClient(BaseTestCase):
         self.assertEqual(client.rows, [])
         self.assertEqual(client.next_uri, '')
         self.assertEqual(client.response_from_server, {})
+
+    @patch.object(PrestoClient, '_create_auth_headers', return_value={})
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_connection_is_reused(self, mock_conn, mock_auth_header,
+                                  mock_presto_config):
+        server_end = self._open_socket(mock_conn)
+        response = mock_conn.return_value.getresponse.return_value
+        response.status = 200
+        response.read.side_effect = [
+            '{"nextUri": "http://any_host:8080/v1/statement/1/1"}',
+            '{"nextUri": "http://any_host:8080/v1/statement/1/2"}',
+            '{"data": [[1]]}',
+            '{"nextUri": "http://any_host:8080/v1/statement/2/1"}',
+            '{"data": [[2]]}',
+            '{}',
+            '{}']
+        client = PrestoClient('any_host', 'any_user')
+
+        self.assertEqual(client.run_sql('select 1'), [[1]])
+        self.assertEqual(client.run_sql('select 2'), [[2]])
+        self.assertEqual(mock_conn.call_count, 1)
+        self.assertEqual(mock_conn.return_value.request.call_count, 5)
+        self.assertFalse(mock_conn.return_value.close.called)
+
+        # A query isn't started on a connection that has been idle for long,
+        # or that the server closed.
+        client._last_used -= MAX_IDLE_FOR_UNSAFE_REQUESTS + 1
+        self.assertEqual(client.run_sql('select 3'), [])
+        self.assertEqual(mock_conn.call_count, 2)
+        server_end.close()
+        self.assertEqual(client.run_sql('select 4'), [])
+        self.assertEqual(mock_conn.call_count, 3)
+
+        client.close()
+        self.assertEqual(mock_conn.return_value.close.call_count, 3)
+
+    def _open_socket(self, mock_conn):
+        """
+        Gives the mock connection a real socket, and returns the server's end
+        of it.
+        """
+        client_end, server_end = socket.socketpair()
+        self.addCleanup(client_end.close)
+        self.addCleanup(server_end.close)
+        mock_conn.return_value.sock = client_end
+        return server_end
+
+    @patch.object(PrestoClient, '_create_auth_headers', return_value={})
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_reconnect_after_idle_connection_closed(self, mock_conn,
+                                                    mock_auth_header,
+                                                    mock_presto_config):
+        stale_conn = mock_conn.return_value
+        response = MagicMock(status=200)
+        response.read.return_value = \
+            '{"nextUri": "http://any_host:8080/v1/statement/1/1"}'
+        stale_conn.getresponse.side_effect = [response, BadStatusLine('')]
+        new_conn = MagicMock()
+        new_conn.getresponse.return_value.status = 200
+        new_conn.getresponse.return_value.read.return_value = '{"data": [[1]]}'
+        mock_conn.side_effect = [stale_conn, new_conn]
+
+        client = PrestoClient('any_host', 'any_user')
+        self.assertEqual(client.run_sql('select 1'), [[1]])
+        self.assertTrue(stale_conn.close.called)
+        self.assertEqual(new_conn.request.call_args[0][:2],
+                         ('GET', '/v1/statement/1/1'))
+
+    @patch.object(PrestoClient, '_create_auth_headers', return_value={})
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_query_is_not_sent_twice(self, mock_conn, mock_auth_header,
+                                     mock_presto_config):
+        self._open_socket(mock_conn)
+        response = mock_conn.return_value.getresponse.return_value
+        response.status = 200
+        response.read.return_value = '{}'
+        client = PrestoClient('any_host', 'any_user')
+        self.assertEqual(client.run_sql('select 1'), [])
+
+        mock_conn.return_value.getresponse.side_effect = BadStatusLine('')
+        self.assertFalse(client.run_sql('select 1'))
+        self.assertEqual(mock_conn.return_value.request.call_count, 2)
+        self.assertEqual(mock_conn.call_count, 1)
+
+    @patch.object(PrestoClient, '_create_auth_headers', return_value={})
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_new_connection_failure_is_not_retried(self, mock_conn,
+                                                   mock_auth_header,
+                                                   mock_presto_config):
+        mock_conn.return_value.request.side_effect = socket.error('refused')
+        client = PrestoClient('any_host', 'any_user')
+        self.assertFalse(client.run_sql('select 1'))
+        self.assertEqual(mock_conn.return_value.request.call_count, 1)
+
+    def _serve_pages(self, mock_conn, pages):
+        response = mock_conn.return_value.getresponse.return_value
+        response.status = 200
+        answers = []
+        for i, page in enumerate(pages):
+            answer = {'data': page}
+            if i < len(pages) - 1:
+                answer['nextUri'] = 'http://any_host:8080/v1/statement/q/%d' \
+                                    % (i + 1)
+            answers.append(json.dumps(answer))
+        # The response to a DELETE isn't looked at.
+        response.read.side_effect = answers + ['']
+        return mock_conn.return_value.request
+
+    @patch.object(PrestoClient, '_create_auth_headers', return_value={})
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_iter_sql_fetches_pages_lazily(self, mock_conn, mock_auth_header,
+                                           mock_presto_config):
+        mock_request = self._serve_pages(mock_conn, [[[1], [2]], [[3]], []])
+        client = PrestoClient('any_host', 'any_user')
+
+        rows = client.iter_sql('select 1')
+        self.assertEqual(mock_request.call_count, 1)
+        self.assertEqual(next(rows), [1])
+        self.assertEqual(next(rows), [2])
+        self.assertEqual(mock_request.call_count, 1)
+        self.assertEqual(list(rows), [[3]])
+        self.assertEqual(
+            [c[0][:2] for c in mock_request.call_args_list],
+            [('POST', '/v1/statement'), ('GET', '/v1/statement/q/1'),
+             ('GET', '/v1/statement/q/2')])
+
+    @patch.object(PrestoClient, '_create_auth_headers', return_value={})
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_iter_sql_max_rows_cancels_query(self, mock_conn, mock_auth_header,
+                                             mock_presto_config):
+        mock_request = self._serve_pages(mock_conn, [[[1], [2]], [[3]], []])
+        client = PrestoClient('any_host', 'any_user')
+
+        self.assertEqual(list(client.iter_sql('select 1', max_rows=2)),
+                         [[1], [2]])
+        self.assertEqual(
+            [c[0][:2] for c in mock_request.call_args_list],
+            [('POST', '/v1/statement'), ('DELETE', '/v1/statement/q/1')])
+
+    @patch.object(PrestoClient, '_create_auth_headers', return_value={})
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_closing_iter_sql_cancels_query(self, mock_conn, mock_auth_header,
+                                            mock_presto_config):
+        mock_request = self._serve_pages(mock_conn, [[[1], [2]], [[3]], []])
+        client = PrestoClient('any_host', 'any_user')
+
+        rows = client.iter_sql('select 1')
+        next(rows)
+        rows.close()
+        self.assertEqual(mock_request.call_args[0][:2],
+                         ('DELETE', '/v1/statement/q/1'))
+        self.assertEqual(mock_request.call_count, 2)
+
+    @patch.object(PrestoClient, '_create_auth_headers', return_value={})
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_finished_query_is_not_cancelled(self, mock_conn, mock_auth_header,
+                                             mock_presto_config):
+        mock_request = self._serve_pages(mock_conn, [[[1]], [[2]]])
+        client = PrestoClient('any_host', 'any_user')
+
+        rows = client.iter_sql('select 1', max_rows=2)
+        self.assertEqual(list(rows), [[1], [2]])
+        rows.close()
+        self.assertEqual(mock_request.call_count, 2)
+
+    @patch.object(PrestoClient, '_create_auth_headers', return_value={})
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_run_sql_stops_at_row_limit(self, mock_conn, mock_auth_header,
+                                        mock_presto_config):
+        pages = [[[i]] * NUM_ROWS for i in range(3)]
+        mock_request = self._serve_pages(mock_conn, pages)
+        client = PrestoClient('any_host', 'any_user')
+
+        self.assertEqual(client.run_sql('select 1'), pages[0])
+        self.assertEqual(mock_request.call_args[0][:2],
+                         ('DELETE', '/v1/statement/q/1'))
+
+    @patch.object(PrestoClient, '_create_auth_headers', return_value={})
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_run_sql_failed_page(self, mock_conn, mock_auth_header,
+                                 mock_presto_config):
+        self._serve_pages(mock_conn, [[[1]], [[2]]])
+        first_page = mock_conn.return_value.getresponse.return_value
+        failed_page = MagicMock(status=500)
+        mock_conn.return_value.getresponse.side_effect = [first_page,
+                                                          failed_page]
+        client = PrestoClient('any_host', 'any_user')
+
+        self.assertEqual(client.run_sql('select 1'), [])
+
+    def test_poll_delay_backs_off(self, mock_presto_config):
+        delays = [PrestoClient._poll_delay(n) for n in range(8)]
+        self.assertEqual(delays[:3], [0, 0, POLL_INITIAL_INTERVAL])
+        self.assertEqual(delays[3], 2 * POLL_INITIAL_INTERVAL)
+        self.assertEqual(delays[-1], POLL_MAX_INTERVAL)
+        self.assertEqual(delays, sorted(delays))
+
+    def _start_stub_server(self, pages):
+        server = HTTPServer(('localhost', 0), _StubStatementHandler)
+        server.pages = pages
+        server.requests = []
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+        self.addCleanup(stop)
+
+        return server
+
+    def _stub_client(self, server, max_wait=None):
+        config = PrestoConfig({'http-server.http.port': str(server.server_port),
+                               'internal-communication.shared-secret': 'any'},
+                              {}, None, None)
+        client = PrestoClient('localhost', 'any_user', config, max_wait)
+        self.addCleanup(client.close)
+        return client
+
+    def test_polls_back_off_while_query_has_no_rows(self, mock_presto_config):
+        # The POST and three GETs return no rows, then two pages of rows.
+        server = self._start_stub_server([[], [], [], [[1]], [[2]]])
+        client = self._stub_client(server)
+
+        self.assertEqual(client.run_sql('select 1'), [[1], [2]])
+        self.assertEqual(client.poll_stats.requests, 6)
+        self.assertEqual(len(server.requests), 6)
+        self.assertTrue(client.poll_stats.bytes > 0)
+        # No wait after the first empty response, then the backoff.
+        self.assertAlmostEqual(client.poll_stats.waited,
+                               POLL_INITIAL_INTERVAL * 3)
+        self.assertTrue(client.poll_stats.elapsed() >=
+                        client.poll_stats.waited)
+
+    def test_query_cancelled_after_max_wait(self, mock_presto_config):
+        server = self._start_stub_server([[]] * 100)
+        client = self._stub_client(server, max_wait=0.2)
+
+        self.assertEqual(client.run_sql('select 1'), [])
+        self.assertTrue(client.query_failed)
+        # Without max_wait the stub would keep the query running for over a
+        # minute.
+        self.assertTrue(client.poll_stats.elapsed() < 1)
+        self.assertEqual(server.requests[-1][0], 'DELETE')
+
+    def test_max_wait_defaults_to_option(self, mock_presto_config):
+        env.query_max_wait = 30.0
+        self.assertEqual(PrestoClient('any_host', 'any_user').max_wait, 30.0)
+        self.assertEqual(PrestoClient('any_host', 'any_user', max_wait=5).max_wait, 5)
+        env.query_max_wait = None
+        self.assertIsNone(PrestoClient('any_host', 'any_user').max_wait)
@@ -15,12 +15,18 @@
 """
 Tests the presto install
 """
+import itertools
 import os
+import shutil
 import tempfile
+import threading
+import time
+import sys
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 
 from fabric.api import env
 from fabric.operations import _AttributeString
-from mock import patch, call, MagicMock
+from mock import patch, MagicMock
 
 from prestoadmin import server
 from prestoadmin.prestoclient import PrestoClient
@@ -33,6 +39,36 @@ from prestoadmin.util.local_config_util import get_catalog_directory
 from tests.unit.base_unit_case import BaseUnitCase, PRESTO_CONFIG
 
 
+class _RpmHandler(BaseHTTPRequestHandler):
+    """
+    Serves server.content, honoring Range headers if server.ranges is set.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        content = self.server.content
+        range_header = self.headers.getheader('Range')
+        self.server.ranges_requested.append(range_header)
+        if range_header and self.server.ranges:
+            start, end = range_header[len('bytes='):].split('-')
+            end = int(end) if end else len(content) - 1
+            body = content[int(start):end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %s-%d/%d' % (start, end, len(content)))
+        else:
+            body = content
+            self.send_response(200)
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Content-Disposition', 'attachment; filename="test.rpm"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
 class TestInstall(BaseUnitCase):
     SERVER_FAIL_MSG = 'Could not verify server status for: failed_node1\n' \
                       'This could mean that the server failed to start or that there was no coordinator or worker up.' \
@@ -42,7 +78,9 @@ class TestInstall(BaseUnitCase):
 
     def setUp(self):
         self.remove_runs_once_flag(server.status)
+        self.remove_runs_once_flag(server.rolling_restart)
         self.remove_runs_once_flag(server.install)
+        self.remove_runs_once_flag(server.upgrade)
         self.maxDiff = None
         super(TestInstall, self).setUp(capture_output=True)
 
@@ -166,8 +204,9 @@ class TestInstall(BaseUnitCase):
     def test_get_download_file_name_not_in_header_with_version_returns_default_name(self):
         self.check_download_file_name(is_header_present=False, is_version_present=True)
 
+    @patch('prestoadmin.server.LocalPrestoRpmFinder._check_rpm_uncorrupted', return_value=True)
     @patch('prestoadmin.server.UrlHandler')
-    def test_download_rpm(self, mock_url_handler):
+    def test_download_rpm(self, mock_url_handler, mock_check):
         instance_url_handler = mock_url_handler.return_value
         instance_url_handler.read_block.side_effect = ['abc', 'def', None]
         instance_url_handler.get_content_length.return_value = 6
@@ -185,6 +224,97 @@ class TestInstall(BaseUnitCase):
             os.close(fd)
             os.remove(absolute_path_valid_rpm)
 
+    def _start_rpm_server(self, content, ranges=True):
+        rpm_server = HTTPServer(('localhost', 0), _RpmHandler)
+        rpm_server.content = content
+        rpm_server.ranges = ranges
+        rpm_server.ranges_requested = []
+        thread = threading.Thread(target=rpm_server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        def stop():
+            rpm_server.shutdown()
+            rpm_server.server_close()
+        self.addCleanup(stop)
+
+        return rpm_server
+
+    def _download_from(self, rpm_server, connections=1, partial_files={}):
+        download_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, download_dir)
+        url = 'http://localhost:%d/rpm' % rpm_server.server_port
+        with patch('prestoadmin.server.DOWNLOAD_DIRECTORY', download_dir):
+            part_path = os.path.join(download_dir, 'test.rpm.part')
+            for name, content in partial_files.items():
+                with open(os.path.join(download_dir, name), 'wb') as f:
+                    f.write(content)
+            with server.UrlHandler(url) as url_handler:
+                downloader = server.PrestoRpmDownloader(url_handler, connections)
+                path = downloader.download_rpm()
+        self.assertFalse(os.path.exists(part_path))
+        with open(path, 'rb') as f:
+            return path, f.read()
+
+    @patch('prestoadmin.server.LocalPrestoRpmFinder._check_rpm_uncorrupted', return_value=True)
+    def test_download_rpm_resumes_part_file(self, mock_check):
+        rpm_server = self._start_rpm_server('0123456789')
+        path, content = self._download_from(rpm_server, partial_files={'test.rpm.part': '0123'})
+        self.assertEqual(os.path.basename(path), 'test.rpm')
+        self.assertEqual(content, '0123456789')
+        self.assertEqual(rpm_server.ranges_requested, [None, 'bytes=4-9'])
+        mock_check.assert_called_with(path + '.part')
+
+    @patch('prestoadmin.server.LocalPrestoRpmFinder._check_rpm_uncorrupted', return_value=True)
+    def test_download_rpm_restarts_without_range_support(self, mock_check):
+        rpm_server = self._start_rpm_server('0123456789', ranges=False)
+        path, content = self._download_from(rpm_server, partial_files={'test.rpm.part': 'xxxx'})
+        self.assertEqual(content, '0123456789')
+        self.assertEqual(rpm_server.ranges_requested, [None])
+
+    @patch('prestoadmin.server.MIN_PARALLEL_DOWNLOAD_SIZE', 1)
+    @patch('prestoadmin.server.LocalPrestoRpmFinder._check_rpm_uncorrupted', return_value=True)
+    def test_download_rpm_in_parallel_segments(self, mock_check):
+        rpm_server = self._start_rpm_server('0123456789')
+        path, content = self._download_from(rpm_server, connections=3, partial_files={'test.rpm.part.2': '89'})
+        self.assertEqual(content, '0123456789')
+        self.assertEqual(sorted(rpm_server.ranges_requested), [None, 'bytes=4-7'])
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['test.rpm'])
+
+    @patch('prestoadmin.server.LocalPrestoRpmFinder._check_rpm_uncorrupted', return_value=False)
+    def test_download_rpm_corrupted(self, mock_check):
+        rpm_server = self._start_rpm_server('0123456789')
+        self.assertRaisesRegexp(SystemExit, 'The rpm downloaded from .* is corrupted',
+                                self._download_from, rpm_server)
+
+    @patch('prestoadmin.server.UrlHandler')
+    @patch('prestoadmin.server.RpmCache')
+    def test_version_found_in_rpm_cache(self, mock_rpm_cache, mock_url_handler):
+        mock_rpm_cache.return_value.find_version.return_value = '/cache/presto-server-rpm-0.215.rpm'
+        rpm_fetcher = server.PrestoRpmFetcher('0.215')
+        self.assertEqual(rpm_fetcher.get_path_to_presto_rpm(), '/cache/presto-server-rpm-0.215.rpm')
+        mock_rpm_cache.return_value.find_version.assert_called_with('0.215')
+        self.assertFalse(mock_url_handler.called)
+
+    @patch('prestoadmin.util.rpm_cache._query_rpm', return_value=('presto-server-rpm', '0.215', '1'))
+    @patch('prestoadmin.server.LocalPrestoRpmFinder._check_rpm_uncorrupted', return_value=True)
+    def test_downloaded_rpm_is_found_in_rpm_cache(self, mock_check, mock_query_rpm):
+        rpm_server = self._start_rpm_server('0123456789')
+        url = 'http://localhost:%d/rpm' % rpm_server.server_port
+        cache_dir = tempfile.mkdtemp()
+        download_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.addCleanup(shutil.rmtree, download_dir)
+        with patch('prestoadmin.util.rpm_cache.get_rpm_cache_directory', return_value=cache_dir):
+            with patch('prestoadmin.server.DOWNLOAD_DIRECTORY', download_dir):
+                rpm_path = server.PrestoRpmFetcher.find_or_download_rpm_by_url(url)
+                self.assertEqual(server.PrestoRpmFetcher.find_or_download_rpm_by_url(url), rpm_path)
+                self.assertEqual(server.PrestoRpmFetcher('0.215').get_path_to_presto_rpm(), rpm_path)
+        self.assertTrue(rpm_path.startswith(cache_dir))
+        self.assertEqual(os.path.basename(rpm_path), 'test.rpm')
+        self.assertEqual(os.listdir(download_dir), [])
+        self.assertEqual(len(rpm_server.ranges_requested), 1)
+
     def check_version(self, version, expect_valid):
         rpm_fetcher = server.PrestoRpmFetcher(version)
         is_valid_version = rpm_fetcher.check_valid_version()
@@ -254,14 +384,20 @@ class TestInstall(BaseUnitCase):
         else:
             exit('Cannot assert because of invalid location: %s' % location)
 
+    @patch('prestoadmin.server.RpmCache')
+    @patch('prestoadmin.server.package.local_checksum')
     @patch('prestoadmin.server.execute')
     @patch('prestoadmin.server.package.check_if_valid_rpm')
     @patch('prestoadmin.server.LocalPrestoRpmFinder.find_local_presto_rpm')
     @patch('prestoadmin.server.PrestoRpmDownloader.download_rpm')
     def check_rpm_specifier_with_location(self, mock_download_rpm, mock_find_local,
-                                          mock_check_rpm, mock_execute, rpm_specifier, location=None):
+                                          mock_check_rpm, mock_execute, mock_checksum, mock_rpm_cache,
+                                          rpm_specifier, location=None):
         # This function should not mock the UrlHandler class so that urls will be opened
         # This checks that the urls that the installer tries to reach are still valid
+        mock_rpm_cache.return_value.find_version.return_value = None
+        mock_rpm_cache.return_value.find_url.return_value = None
+        mock_rpm_cache.return_value.add.side_effect = lambda path, urls: path
         rpm_path = '/path/to/download_or_found/rpm'
         TestInstall.set_up_specifier_find_and_download_mocks(mock_download_rpm, mock_find_local, rpm_path, location)
         self.call_and_assert_install_with_rpm_specifier(mock_download_rpm, mock_check_rpm, mock_execute, location,
@@ -341,20 +477,68 @@ class TestInstall(BaseUnitCase):
         self.assertTrue(mock_update.called)
         mock_sudo.assert_called_with('getent passwd presto', quiet=True)
 
+    @patch('prestoadmin.server.execute')
+    @patch('prestoadmin.server.configure_cmds')
+    @patch('prestoadmin.server.stop')
+    @patch('prestoadmin.package.rpm_upgrade')
+    @patch('prestoadmin.package._upload')
+    @patch('prestoadmin.package._has_checksum', return_value=False)
+    @patch('prestoadmin.package.read_sidecar', return_value=None)
+    @patch('prestoadmin.package.sha256_of_file', return_value='abc')
+    def test_upgrade_hashes_rpm_once(self, mock_sha256, unused_mock_sidecar, unused_mock_checksum,
+                                     mock_upload, mock_upgrade, mock_stop, mock_configure,
+                                     mock_execute):
+        def execute_in_workers(task, *args, **kwargs):
+            # Like parallel workers, each host runs with its own copy of env.
+            for host in kwargs['hosts']:
+                saved_env = env.copy()
+                env.host = host
+                task(*args)
+                env.clear()
+                env.update(saved_env)
+        mock_execute.side_effect = execute_in_workers
+        env.hosts = ['master', 'slave1', 'slave2']
+        fd, rpm_path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, rpm_path)
+
+        server.upgrade(rpm_path)
+
+        mock_sha256.assert_called_once_with(rpm_path)
+        self.assertEqual([args[0][2] for args in mock_upload.call_args_list], ['abc'] * 3)
+        self.assertEqual(mock_upgrade.call_count, 3)
+        self.assertEqual(mock_stop.call_count, 3)
+
+    def test_upgrade_rpm_not_found(self):
+        self.assertRaisesRegexp(SystemExit, 'RPM file not found at /does/not/exist.rpm',
+                                server.upgrade, '/does/not/exist.rpm')
+
     @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.package.is_rpm_installed')
+    @patch('prestoadmin.util.package_facts.run')
     @patch('prestoadmin.package.rpm_uninstall')
-    def test_uninstall_is_called(self, mock_package_rpm_uninstall, mock_package_is_rpm_installed, mock_version_check):
+    def test_uninstall_is_called(self, mock_package_rpm_uninstall, mock_run, mock_version_check):
         env.host = "any_host"
-        mock_package_is_rpm_installed.side_effect = [False, True]
+        mock_run.return_value = _AttributeString('package presto is not installed\n'
+                                                 'presto-server 0.100\n'
+                                                 'package presto-server-rpm is not installed')
 
         server.uninstall()
 
         mock_version_check.assert_called_with()
-        mock_package_is_rpm_installed.assert_called_with('presto-server')
-        mock_package_rpm_uninstall.assert_called_with('presto-server')
-        self.assertTrue(mock_package_is_rpm_installed.call_count == 2)
-        self.assertTrue(mock_package_rpm_uninstall.call_count == 1)
+        self.assertEqual(mock_run.call_count, 1)
+        mock_package_rpm_uninstall.assert_called_once_with('presto-server')
+
+    @patch('prestoadmin.server.check_presto_version')
+    @patch('prestoadmin.util.package_facts.run')
+    @patch('prestoadmin.package.rpm_uninstall')
+    def test_uninstall_without_presto(self, mock_package_rpm_uninstall, mock_run,
+                                      unused_version_check):
+        env.host = "any_host"
+        mock_run.return_value = _AttributeString('package presto is not installed')
+
+        self.assertRaisesRegexp(SystemExit, '', server.uninstall)
+        self.assertFalse(mock_package_rpm_uninstall.called)
+        self.assertTrue('Unable to uninstall package on: any_host' in self.test_stderr.getvalue())
 
     @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
            return_value=PRESTO_CONFIG)
@@ -517,8 +701,8 @@ class TestInstall(BaseUnitCase):
            return_value=PRESTO_CONFIG)
     @patch('prestoadmin.server.run')
     @patch('prestoadmin.server.lookup_string_config')
-    @patch.object(PrestoClient, 'run_sql')
-    def test_check_success_status(self, mock_run_sql, string_config_mock, mock_run, mock_presto_config):
+    @patch.object(PrestoClient, 'iter_sql')
+    def test_check_success_status(self, mock_iter_sql, string_config_mock, mock_run, mock_presto_config):
         env.roledefs = {
             'coordinator': ['Node1'],
             'worker': ['Node1', 'Node2', 'Node3', 'Node4'],
@@ -527,7 +711,8 @@ class TestInstall(BaseUnitCase):
         env.hosts = env.roledefs['all']
         env.host = 'Node1'
         string_config_mock.return_value = 'Node1'
-        mock_run_sql.return_value = [['Node2', 'some stuff'], ['Node1', 'some other stuff']]
+        rows = [['Node2', 'some stuff'], ['Node1', 'some other stuff']]
+        mock_iter_sql.side_effect = lambda sql: (row for row in rows)
         self.assertEqual(server.check_server_status(), True)
 
     @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
@@ -551,11 +736,9 @@ class TestInstall(BaseUnitCase):
     @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
            return_value=PRESTO_CONFIG)
     @patch('prestoadmin.server.execute')
-    @patch('prestoadmin.server.get_presto_version')
-    @patch('prestoadmin.server.presto_installed')
     @patch.object(PrestoClient, 'run_sql')
     def test_status_from_each_node(
-            self, mock_run_sql, mock_presto_installed, mock_get_presto_version, mock_execute, mock_presto_config):
+            self, mock_run_sql, mock_execute, mock_presto_config):
         env.roledefs = {
             'coordinator': ['Node1'],
             'worker': ['Node1', 'Node2', 'Node3', 'Node4'],
@@ -563,19 +746,17 @@ class TestInstall(BaseUnitCase):
         }
         env.hosts = env.roledefs['all']
 
-        mock_get_presto_version.return_value = '0.97-SNAPSHOT'
         mock_run_sql.side_effect = [
-            [['select * from system.runtime.nodes']],
-            [['hive'], ['system'], ['tpch']],
-            [['http://active/statement', 'presto-main:0.97-SNAPSHOT', True]],
-            [['http://inactive/stmt', 'presto-main:0.99-SNAPSHOT', False]],
-            [[]],
-            [['http://servrdown/statement', 'any', True]]
+            [['id1', 'http://ip1/statement', 'presto-main:0.97-SNAPSHOT',
+              True],
+             ['id2', 'http://ip2/stmt', 'presto-main:0.99-SNAPSHOT', False],
+             ['id5', 'http://ip5/statement', 'any', True]],
+            [['hive'], ['system'], ['tpch']]
         ]
         mock_execute.side_effect = [{
-            'Node1': ('IP1', True, ''),
-            'Node2': ('IP2', True, ''),
-            'Node3': ('IP3', True, ''),
+            'Node1': ('id1', True, '', '0.97-SNAPSHOT'),
+            'Node2': ('id2', True, '', '0.99-SNAPSHOT'),
+            'Node3': ('id3', True, '', '0.97-SNAPSHOT'),
             'Node4': Exception('Timed out trying to connect to Node4')
         }]
         env.host = 'Node1'
@@ -586,42 +767,183 @@ class TestInstall(BaseUnitCase):
             expected.splitlines(),
             self.test_stdout.getvalue().splitlines()
         )
+        self.assertEqual(mock_execute.call_count, 1)
+        self.assertEqual(mock_run_sql.call_count, 2)
+        self.assertTrue(mock_run_sql.call_args_list[0][0][0].endswith(
+            'active from system.runtime.nodes'))
 
     @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
            return_value=PRESTO_CONFIG)
-    @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.server.service')
-    @patch('prestoadmin.server.get_ext_ip_of_node')
-    def test_collect_node_information(self, mock_ext_ip, mock_service,
-                                      mock_version, mock_presto_config):
+    @patch('prestoadmin.server.execute')
+    @patch.object(PrestoClient, 'run_sql')
+    def test_status_unable_to_query_coordinator(
+            self, mock_run_sql, mock_execute, mock_presto_config):
         env.roledefs = {
             'coordinator': ['Node1'],
+            'worker': ['Node1'],
             'all': ['Node1']
         }
-        mock_ext_ip.side_effect = ['IP1', 'IP3', 'IP4']
+        env.hosts = env.roledefs['all']
+        mock_run_sql.side_effect = ConfigurationError('Connection refused')
+        mock_execute.return_value = {
+            'Node1': ('id1', True, '', '0.150')
+        }
+        server.get_status_from_coordinator()
+
+        self.assertEqual(
+            ['Server Status:',
+             '\tNode1(IP: Unknown, Roles: coordinator, worker): Running',
+             '\tNo information available: unable to query coordinator'],
+            self.test_stdout.getvalue().splitlines()
+        )
+
+    @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
+           return_value=PRESTO_CONFIG)
+    @patch('prestoadmin.server.time.sleep')
+    @patch('prestoadmin.server.execute')
+    @patch.object(PrestoClient, 'run_sql')
+    def test_watch_status_probes_changed_nodes(
+            self, mock_run_sql, mock_execute, mock_sleep, mock_presto_config):
+        env.roledefs = {
+            'coordinator': ['Node1'],
+            'worker': ['Node1', 'Node2'],
+            'all': ['Node1', 'Node2']
+        }
+        env.hosts = env.roledefs['all']
+        both_active = [['id1', 'http://ip1/statement', 'presto-main:0.150', 'active'],
+                       ['id2', 'http://ip2/statement', 'presto-main:0.150', 'active']]
+        node2_gone = both_active[:1]
+        mock_run_sql.side_effect = [both_active, [['tpch']], both_active, node2_gone]
+        mock_execute.side_effect = [
+            {'Node1': ('id1', True, '', '0.150'), 'Node2': ('id2', True, '', '0.150')},
+            {'Node2': ('id2', False, '', '0.150')}]
+        mock_sleep.side_effect = [None, None, KeyboardInterrupt()]
+
+        server.watch_status()
+
+        self.assertEqual(mock_execute.call_args_list[1][0][0], server.reprobe_node_information)
+        self.assertEqual(mock_execute.call_args_list[1][1]['hosts'], ['Node2'])
+        output = self.test_stdout.getvalue().splitlines()
+        self.assertTrue(output[0].endswith(': 2 of 2 nodes changed'))
+        self.assertTrue(output[-4].endswith(': 1 of 2 nodes changed'))
+        self.assertEqual(output[-3:], ['Server Status:',
+                                       '\tNode2(IP: Unknown, Roles: worker): Not Running',
+                                       '\tNo information available'])
+        self.assertEqual(output.count('Server Status:'), 3)
+
+    @patch('prestoadmin.server.collect_node_information')
+    @patch('prestoadmin.server.clear_config_snapshot')
+    @patch('prestoadmin.server.clear_package_facts')
+    def test_reprobe_node_information_clears_host_caches(
+            self, mock_clear_facts, mock_clear_snapshot, mock_collect):
+        env.host = 'Node2'
+        mock_collect.side_effect = lambda: (mock_clear_facts.assert_called_with('Node2'),
+                                            mock_clear_snapshot.assert_called_with('Node2'))
+
+        server.reprobe_node_information()
+
+        self.assertTrue(mock_collect.called)
+
+    @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
+           return_value=PRESTO_CONFIG)
+    @patch('prestoadmin.server.execute')
+    @patch.object(PrestoClient, 'run_sql')
+    def test_collect_status_snapshot(self, mock_run_sql, mock_execute, mock_presto_config):
+        env.roledefs = {
+            'coordinator': ['Node1'],
+            'worker': ['Node1', 'Node2', 'Node3'],
+            'all': ['Node1', 'Node2', 'Node3']
+        }
+        env.hosts = env.roledefs['all']
+        mock_run_sql.side_effect = [
+            [['id1', 'http://ip1/statement', 'presto-main:0.150', 'active']],
+            [['system'], ['tpch']]]
+        mock_execute.return_value = {
+            'Node1': ('id1', True, '', '0.150', 0.5),
+            'Node2': (None, False, 'Presto is not installed.', '', 0.25),
+            'Node3': Exception('Timed out trying to connect to Node3')}
+
+        hosts = server.collect_status_snapshot()['hosts']
+
+        self.assertEqual(hosts['Node1'], {'ip': 'ip1', 'roles': ['coordinator', 'worker'],
+                                          'running': True, 'node_id': 'id1', 'version': '0.150',
+                                          'state': 'active', 'catalogs': ['system', 'tpch'],
+                                          'error': None, 'latency': 0.5})
+        self.assertEqual(hosts['Node2']['error'], 'Presto is not installed.')
+        self.assertEqual(hosts['Node2']['catalogs'], [])
+        self.assertEqual(hosts['Node3']['error'], 'Timed out trying to connect to Node3')
+        self.assertEqual(hosts['Node3']['latency'], None)
+
+    @patch('prestoadmin.server.collect_status_snapshot')
+    def test_status_snapshot_is_cached(self, mock_collect):
+        env.hosts = ['Node1']
+        mock_collect.side_effect = lambda: {'collected_at': time.time(), 'hosts': {'Node1': {}}}
+        cache_dir = tempfile.mkdtemp()
+        try:
+            with patch('prestoadmin.server.get_status_cache_path',
+                       return_value=os.path.join(cache_dir, 'status_cache.json')):
+                server.get_status_snapshot(60)
+                server.get_status_snapshot(60)
+                self.assertEqual(mock_collect.call_count, 1)
+
+                with patch('prestoadmin.server.fcntl.flock') as mock_flock:
+                    server.get_status_snapshot(0)
+                self.assertEqual(mock_collect.call_count, 2)
+                self.assertFalse(mock_flock.called)
+
+                env.hosts = ['Node1', 'Node2']
+                server.get_status_snapshot(60)
+                self.assertEqual(mock_collect.call_count, 3)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_query_version_prefers_coordinator(self):
+        env.roledefs = {
+            'coordinator': ['Node2'],
+            'worker': ['Node1', 'Node2'],
+            'all': ['Node1', 'Node2']
+        }
+        env.hosts = env.roledefs['all']
+        self.assertEqual((0, 127), server.get_query_version({
+            'Node1': ('id1', True, '', '0.150'),
+            'Node2': ('id2', True, '', '0.127-SNAPSHOT')}))
+        self.assertEqual((0, 150), server.get_query_version({
+            'Node1': ('id1', True, '', '0.150'),
+            'Node2': Exception('Timed out')}))
+        self.assertEqual((sys.maxsize,), server.get_query_version({
+            'Node1': (None, False, 'Presto is not installed.', ''),
+            'Node2': Exception('Timed out')}))
+
+    @patch('prestoadmin.server.get_presto_version')
+    @patch('prestoadmin.server.check_presto_version')
+    @patch('prestoadmin.server.service')
+    @patch('prestoadmin.server.get_node_id')
+    def test_collect_node_information(self, mock_node_id, mock_service,
+                                      mock_version, mock_presto_version):
+        mock_node_id.side_effect = ['id1', 'id3', Exception('No node.id')]
         mock_service.side_effect = [True, False, Exception('Not running')]
         mock_version.side_effect = ['', 'Presto not installed', '', '']
+        mock_presto_version.return_value = '0.150'
 
-        self.assertEqual(('IP1', True, ''), server.collect_node_information())
-        self.assertEqual(('Unknown', False, 'Presto not installed'),
+        self.assertEqual(('id1', True, '', '0.150'),
+                         server.collect_node_information())
+        self.assertEqual((None, False, 'Presto not installed', ''),
+                         server.collect_node_information())
+        self.assertEqual(('id3', False, '', '0.150'),
                          server.collect_node_information())
-        self.assertEqual(('IP3', False, ''), server.collect_node_information())
-        self.assertEqual(('IP4', False, ''),
+        self.assertEqual((None, False, '', '0.150'),
                          server.collect_node_information())
 
-    @patch('prestoadmin.server.sudo')
-    def test_get_external_ip(self, mock_nodeuuid):
-        client_mock = MagicMock(PrestoClient)
-        client_mock.run_sql.return_value = [['IP']]
-        self.assertEqual(server.get_ext_ip_of_node(client_mock), 'IP')
+    def test_get_external_ip(self):
+        self.assertEqual(server.get_ext_ip_from(
+            {'http://ip:8080/statement': ['0.150', 'active']}, 'node'), 'ip')
+        self.assertEqual(server.get_ext_ip_from({}, 'node'), 'Unknown')
 
-    @patch('prestoadmin.server.sudo')
     @patch('prestoadmin.server.warn')
-    def test_warn_external_ip(self, mock_warn, mock_nodeuuid):
-        env.host = 'node'
-        client_mock = MagicMock(PrestoClient)
-        client_mock.run_sql.return_value = [['IP1'], ['IP2']]
-        server.get_ext_ip_of_node(client_mock)
+    def test_warn_external_ip(self, mock_warn):
+        server.get_ext_ip_from({'http://IP1:8080': ['0.150', 'active'],
+                                'http://IP2:8080': ['0.150', 'active']},
+                               'node')
         mock_warn.assert_called_with("More than one external ip found for "
                                      "node. There could be multiple nodes "
                                      "associated with the same node.id")
@@ -636,7 +958,7 @@ class TestInstall(BaseUnitCase):
     @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
            return_value=PRESTO_CONFIG)
     @patch.object(PrestoClient, 'run_sql')
-    @patch('prestoadmin.server.run')
+    @patch('prestoadmin.util.package_facts.run')
     @patch('prestoadmin.server.warn')
     def test_warning_presto_version_not_installed(self, mock_warn, mock_run,
                                                   mock_run_sql, mock_presto_config):
@@ -683,25 +1005,123 @@ class TestInstall(BaseUnitCase):
         self.assertFalse(server.is_port_in_use(env.host))
         self.assertEqual(False, mock_warn.called)
 
-    @patch('prestoadmin.server.run')
+    def _rolling_restart_roles(self):
+        env.roledefs['coordinator'] = ['master']
+        env.roledefs['worker'] = ['slave1', 'slave2', 'slave3']
+        env.roledefs['all'] = ['master', 'slave1', 'slave2', 'slave3']
+        env.hosts = env.roledefs['all']
+
+    @patch('prestoadmin.server.time.sleep')
+    @patch('prestoadmin.server.get_node_id', side_effect=lambda host: host + '-id')
+    @patch('prestoadmin.server.PrestoClient')
+    @patch('prestoadmin.server.execute')
+    def test_rolling_restart_batches(self, mock_execute, mock_client, mock_node_id, mock_sleep):
+        self._rolling_restart_roles()
+        mock_execute.side_effect = lambda task, hosts: dict((host, True) for host in hosts)
+        client = mock_client.return_value
+        client.run_sql.side_effect = [
+            [['slave1-id', 'active'], ['slave2-id', 'shutting_down']],
+            [['slave1-id', 'active'], ['slave2-id', 'active']],
+            [],
+            [['slave1-id', 'active'], ['slave2-id', 'active']],
+            [['slave3-id', 'inactive']], [['slave3-id', 'active']],
+            None, [['master-id', 'active']]]
+
+        server.rolling_restart('2')
+
+        self.assertEqual([c[1]['hosts'] for c in mock_execute.call_args_list],
+                         [['slave1', 'slave2'], ['slave3'], ['master']])
+        self.assertEqual(client.run_sql.call_args[0][0], server.NODE_STATES)
+        self.assertEqual(mock_sleep.call_count, 5)
+        self.assertTrue('Restarting batch 3 of 3: master' in self.test_stdout.getvalue())
+        self.assertTrue('Rolling restart complete. Slowest nodes to rejoin: '
+                        in self.test_stdout.getvalue())
+
+    @patch('prestoadmin.server.get_node_id', side_effect=lambda host: host + '-id')
+    @patch('prestoadmin.server.PrestoClient')
+    @patch('prestoadmin.server.execute')
+    def test_rolling_restart_stops_on_failed_batch(self, mock_execute, mock_client, mock_node_id):
+        self._rolling_restart_roles()
+        mock_execute.return_value = {'slave1': False}
+
+        self.assertRaisesRegexp(SystemExit, 'Could not restart the Presto server on slave1',
+                                server.rolling_restart)
+        self.assertEqual(mock_execute.call_count, 1)
+
+    @patch('prestoadmin.server.time')
+    @patch('prestoadmin.server.get_node_id', side_effect=lambda host: host + '-id')
+    @patch('prestoadmin.server.PrestoClient')
+    @patch('prestoadmin.server.execute')
+    def test_rolling_restart_times_out(self, mock_execute, mock_client, mock_node_id, mock_time):
+        self._rolling_restart_roles()
+        mock_execute.side_effect = lambda task, hosts: dict((host, True) for host in hosts)
+        mock_client.return_value.run_sql.return_value = [['slave2-id', 'uri']]
+        mock_time.time.side_effect = itertools.count(0, 10)
+
+        self.assertRaisesRegexp(SystemExit, 'slave1 did not rejoin the cluster within 30 seconds',
+                                server.rolling_restart, '1', '30')
+        self.assertEqual(mock_execute.call_count, 1)
+
+    @patch('prestoadmin.server.time')
+    @patch('prestoadmin.server.get_node_id', side_effect=lambda host: host + '-id')
+    @patch('prestoadmin.server.PrestoClient')
+    @patch('prestoadmin.server.execute')
+    def test_rolling_restart_waits_for_the_node_to_leave(self, mock_execute, mock_client,
+                                                         mock_node_id, mock_time):
+        self._rolling_restart_roles()
+        mock_execute.side_effect = lambda task, hosts: dict((host, True) for host in hosts)
+        mock_client.return_value.run_sql.return_value = [['slave1-id', 'active']]
+        mock_time.time.side_effect = itertools.count(0, 10)
+
+        self.assertRaisesRegexp(SystemExit, 'slave1 did not rejoin the cluster within 30 seconds',
+                                server.rolling_restart, '1', '30')
+
+    @patch('prestoadmin.server.time.sleep')
+    @patch('prestoadmin.server.get_node_id', side_effect=lambda host: host + '-id')
+    @patch('prestoadmin.server.PrestoClient')
+    @patch('prestoadmin.server.execute')
+    def test_rolling_restart_skips_excluded_coordinator(self, mock_execute, mock_client,
+                                                        mock_node_id, mock_sleep):
+        self._rolling_restart_roles()
+        env.exclude_hosts = ['master', 'slave2']
+        mock_execute.side_effect = lambda task, hosts: dict((host, True) for host in hosts)
+        mock_client.return_value.run_sql.side_effect = [
+            [], [['slave1-id', 'active']], [], [['slave3-id', 'active']]]
+
+        server.rolling_restart()
+
+        self.assertEqual([c[1]['hosts'] for c in mock_execute.call_args_list],
+                         [['slave1'], ['slave3']])
+        mock_client.assert_called_with('master', env.user)
+
+    def test_rolling_restart_invalid_batch_size(self):
+        self.assertRaisesRegexp(SystemExit, 'batch_size must be a positive integer, not none',
+                                server.rolling_restart, 'none')
+
+    @patch('prestoadmin.util.package_facts.run')
     def test_multiple_version_rpms(self, mock_run):
-        output1 = _AttributeString('package presto is not installed')
-        output1.succeeded = False
-        output2 = _AttributeString('presto-server-rpm-0.115t-1.x86_64')
-        output2.succeeded = True
-        output3 = _AttributeString('Presto is not installed.')
-        output3.succeeded = False
-        output4 = _AttributeString('0.111.SNAPSHOT')
-        output4.succeeded = True
-
-        mock_run.side_effect = [output1, output2, output3, output4]
-
-        expected = server.check_presto_version()
-        mock_run.assert_has_calls([
-            call('rpm -q presto'),
-            call('rpm -q presto-server-rpm')
-        ])
-        self.assertEqual(expected, '')
+        output = _AttributeString('package presto is not installed\n'
+                                  'presto-server-rpm 0.115t\n'
+                                  'package starburst-presto-server-rpm is not installed')
+        output.succeeded = False
+        mock_run.return_value = output
+        env.host = 'node1'
+
+        self.assertEqual(server.check_presto_version(), '')
+        self.assertEqual(server.get_presto_version(), '0.115t')
+        self.assertEqual(mock_run.call_count, 1)
+
+    @patch('prestoadmin.util.package_facts.run')
+    def test_presto_not_installed(self, mock_run):
+        output = _AttributeString('package presto is not installed\n'
+                                  'package presto-server-rpm is not installed\n'
+                                  'package starburst-presto-server-rpm is not installed')
+        output.succeeded = False
+        mock_run.return_value = output
+        env.host = 'node1'
+
+        self.assertFalse(server.presto_installed())
+        self.assertEqual(server.get_presto_version(), '')
 
     def mock_fail_then_succeed(self):
         output1 = _AttributeString()
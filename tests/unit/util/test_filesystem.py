@@ -13,6 +13,10 @@
 # limitations under the License.
 
 import errno
+import os
+import shutil
+import tempfile
+
 from mock import patch
 from prestoadmin.util import filesystem
 from tests.base_test_case import BaseTestCase
@@ -42,3 +46,25 @@ class TestFilesystem(BaseTestCase):
         self.assertRaisesRegexp(OSError, 'message',
                                 filesystem.write_to_file_if_not_exists,
                                 'content', 'path/to/anyfile')
+
+    def test_sidecar_is_invalidated_by_changes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'file')
+        with open(path, 'w') as f:
+            f.write('content')
+
+        self.assertIsNone(filesystem.read_sidecar(path))
+        filesystem.write_sidecar(path, {'checked': True})
+        self.assertEqual(filesystem.read_sidecar(path), {'checked': True})
+
+        moved_path = os.path.join(directory, 'moved')
+        filesystem.move_with_sidecar(path, moved_path)
+        self.assertEqual(filesystem.read_sidecar(moved_path), {'checked': True})
+
+        with open(moved_path, 'a') as f:
+            f.write('more content')
+        self.assertIsNone(filesystem.read_sidecar(moved_path))
+
+        filesystem.remove_with_sidecar(moved_path)
+        self.assertEqual(os.listdir(directory), [])
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import datetime
+import gzip
+import os
+import shutil
+import tarfile
+import tempfile
+
+from prestoadmin.util import log_slicer
+from tests.base_test_case import BaseTestCase
+
+
+def _log_lines(minutes, zone='-0700'):
+    lines = []
+    for minute in minutes:
+        lines.append('2019-10-01T12:%02d:00.000%s\tINFO\tmain\tentry %d\n' % (minute, zone, minute))
+        if minute % 3 == 0:
+            lines.append('java.lang.RuntimeException: at minute %d\n' % minute)
+            lines.append('\tat Foo.bar(Foo.java:%d)\n' % minute)
+    return lines
+
+
+class TestLogSlicer(BaseTestCase):
+    def setUp(self):
+        super(TestLogSlicer, self).setUp()
+        self.log_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+        super(TestLogSlicer, self).tearDown()
+
+    def _write_log(self, name, lines, mtime=None):
+        path = os.path.join(self.log_dir, name)
+        log_file = gzip.open(path, 'wb') if name.endswith('.gz') else open(path, 'wb')
+        log_file.write(''.join(lines))
+        log_file.close()
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def _slice(self, path, since=None, until=None):
+        log_file, start, end, _ = log_slicer.slice_log(path, since, until)
+        log_file.seek(start)
+        return log_file.read(end - start)
+
+    def test_slice_matches_linear_scan(self):
+        lines = _log_lines(range(0, 60, 2))
+        path = self._write_log('server.log', lines)
+        for since_minute in range(-1, 62, 3):
+            for until_minute in range(since_minute, 62, 5):
+                since = '2019-10-01T12:%02d:00' % since_minute if since_minute >= 0 else None
+                until = '2019-10-01T12:%02d:00' % until_minute if until_minute < 60 else None
+                expected = []
+                in_window = False
+                for line in lines:
+                    timestamp = log_slicer.line_timestamp(line)
+                    if timestamp is not None:
+                        in_window = (not since or timestamp >= since) and (not until or timestamp <= until)
+                    if in_window:
+                        expected.append(line)
+                self.assertEqual(self._slice(path, since, until), ''.join(expected),
+                                 'window %s to %s' % (since, until))
+
+    def test_slice_gzipped_log(self):
+        path = self._write_log('server.log-1.gz', _log_lines(range(10)))
+        sliced = self._slice(path, '2019-10-01T12:03:00', '2019-10-01T12:04:00')
+        self.assertEqual(sliced, ''.join(_log_lines([3, 4])))
+
+    def test_relative_time_uses_zone_of_log(self):
+        now = datetime.datetime.utcnow() + datetime.timedelta(hours=2)
+        path = self._write_log('server.log', [now.strftime('%Y-%m-%dT%H:%M:%S.000+0200\tINFO\n')])
+        with open(path, 'rb') as log_file:
+            resolved = log_slicer.resolve_time('-3600', log_file)
+        difference = datetime.datetime.strptime(resolved, log_slicer.TIMESTAMP_FORMAT) - \
+            (now - datetime.timedelta(hours=1))
+        self.assertTrue(abs(difference) < datetime.timedelta(minutes=1))
+
+    def test_cap_keeps_newest_entries(self):
+        old_path = self._write_log('server.log-1', _log_lines(range(10)), mtime=1000)
+        new_path = self._write_log('server.log', _log_lines(range(10, 20)), mtime=2000)
+        slices = []
+        for name, path in [('server.log-1', old_path), ('server.log', new_path)]:
+            log_file, start, end, _ = log_slicer.slice_log(path, None, None)
+            slices.append((name, log_file, start, end, os.path.getmtime(path)))
+        new_size = os.path.getsize(new_path)
+
+        capped = log_slicer.cap_slices(slices, new_size + 100)
+
+        self.assertEqual([s[0] for s in capped], ['server.log', 'server.log-1'])
+        name, log_file, start, end, _ = capped[1]
+        self.assertTrue(end - start <= 100)
+        log_file.seek(start)
+        self.assertTrue(log_slicer.line_timestamp(log_file.readline()) is not None or start == end)
+
+    def test_main_writes_archive(self):
+        self._write_log('server.log', _log_lines(range(10)))
+        self._write_log('server.log-2', _log_lines(range(5)))
+        archive = os.path.join(self.log_dir, 'node1.tar.gz')
+
+        log_slicer.main(['--since=2019-10-01T12:05:00', archive, 'node1',
+                         os.path.join(self.log_dir, 'server.log*'),
+                         os.path.join(self.log_dir, 'launcher.log*')])
+
+        tar = tarfile.open(archive)
+        try:
+            self.assertEqual(tar.getnames(), ['node1/server.log'])
+            self.assertEqual(tar.extractfile('node1/server.log').read(),
+                             ''.join(_log_lines(range(5, 10))))
+        finally:
+            tar.close()
+
+    def _run_incremental(self, offsets_path):
+        archive = os.path.join(self.log_dir, 'node1.tar.gz')
+        log_slicer.main(['--offsets=' + offsets_path, archive, 'node1',
+                         os.path.join(self.log_dir, 'server.log*')])
+        tar = tarfile.open(archive)
+        try:
+            return dict((name, tar.extractfile(name).read()) for name in tar.getnames())
+        finally:
+            tar.close()
+
+    def test_incremental_collects_appended_bytes(self):
+        offsets_path = os.path.join(self.log_dir, 'offsets.json')
+        with open(offsets_path, 'w') as f:
+            f.write('{}')
+        path = self._write_log('server.log', _log_lines(range(5)))
+        self.assertEqual(self._run_incremental(offsets_path),
+                         {'node1/server.log': ''.join(_log_lines(range(5)))})
+
+        with open(path, 'ab') as log_file:
+            log_file.write(''.join(_log_lines(range(5, 8))))
+        self.assertEqual(self._run_incremental(offsets_path),
+                         {'node1/server.log': ''.join(_log_lines(range(5, 8)))})
+        self.assertEqual(self._run_incremental(offsets_path), {})
+
+    def test_incremental_follows_rotated_log(self):
+        offsets_path = os.path.join(self.log_dir, 'offsets.json')
+        with open(offsets_path, 'w') as f:
+            f.write('{}')
+        path = self._write_log('server.log', _log_lines(range(5)))
+        self._run_incremental(offsets_path)
+
+        with open(path, 'ab') as log_file:
+            log_file.write(''.join(_log_lines(range(5, 8))))
+        os.rename(path, os.path.join(self.log_dir, 'server.log-1'))
+        self._write_log('server.log', _log_lines(range(8, 10)))
+        self.assertEqual(self._run_incremental(offsets_path),
+                         {'node1/server.log-1': ''.join(_log_lines(range(5, 8))),
+                          'node1/server.log': ''.join(_log_lines(range(8, 10)))})
+
+    def test_incremental_rereads_truncated_log(self):
+        offsets_path = os.path.join(self.log_dir, 'offsets.json')
+        with open(offsets_path, 'w') as f:
+            f.write('{}')
+        path = self._write_log('server.log', _log_lines(range(5)))
+        self._run_incremental(offsets_path)
+
+        with open(path, 'wb') as log_file:
+            log_file.write(''.join(_log_lines(range(20, 30))))
+        self.assertEqual(self._run_incremental(offsets_path),
+                         {'node1/server.log': ''.join(_log_lines(range(20, 30)))})
+
+    def test_incremental_gzipped_log(self):
+        path = self._write_log('server.log-1.gz', _log_lines(range(10)))
+        size = len(''.join(_log_lines(range(4))))
+        saved = {'offset': size, 'head': log_slicer.head_digest(path, size)}
+        offset = log_slicer.resume_offset(path, saved)
+        log_file, start, end, total = log_slicer.slice_log(path, None, None, offset)
+        log_file.seek(start)
+        self.assertEqual(log_file.read(end - start), ''.join(_log_lines(range(4, 10))))
+        self.assertEqual(total, len(''.join(_log_lines(range(10)))))
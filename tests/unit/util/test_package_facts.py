@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from fabric.api import env
+from fabric.operations import _AttributeString
+from mock import patch
+
+from prestoadmin import package
+from prestoadmin.util import package_facts
+from prestoadmin.util.package_facts import clear_package_facts, get_presto_package, \
+    ALL_PRESTO_PACKAGE_NAMES
+from tests.base_test_case import BaseTestCase
+
+
+def rpm_output(*lines):
+    output = _AttributeString('\n'.join(lines))
+    output.succeeded = True
+    return output
+
+
+class TestPackageFacts(BaseTestCase):
+    def setUp(self):
+        super(TestPackageFacts, self).setUp()
+        clear_package_facts()
+        env.host = 'node1'
+        env.nodeps = False
+
+    def tearDown(self):
+        clear_package_facts()
+        super(TestPackageFacts, self).tearDown()
+
+    @patch('prestoadmin.util.package_facts.run')
+    def test_all_names_are_queried_at_once(self, run_mock):
+        run_mock.return_value = rpm_output('package presto is not installed',
+                                           'package presto-server-rpm is not installed',
+                                           'starburst-presto-server-rpm 0.213')
+
+        self.assertEqual(get_presto_package(), ('starburst-presto-server-rpm', '0.213'))
+        run_mock.assert_called_once_with(
+            "rpm -q --qf '%{NAME} %{VERSION}\\n' presto presto-server presto-server-rpm "
+            "starburst-presto-server-rpm")
+
+    @patch('prestoadmin.util.package_facts.run')
+    def test_preferred_name_wins(self, run_mock):
+        run_mock.return_value = rpm_output('presto 0.100', 'presto-server-rpm 0.200')
+        self.assertEqual(get_presto_package(), ('presto', '0.100'))
+
+    @patch('prestoadmin.util.package_facts.run')
+    def test_presto_server_is_only_looked_up_for_uninstall(self, run_mock):
+        run_mock.return_value = rpm_output('presto-server 0.100')
+        self.assertIsNone(get_presto_package())
+        self.assertEqual(get_presto_package(ALL_PRESTO_PACKAGE_NAMES), ('presto-server', '0.100'))
+        self.assertEqual(run_mock.call_count, 1)
+
+    @patch('prestoadmin.util.package_facts.run')
+    def test_facts_are_kept_per_host(self, run_mock):
+        run_mock.return_value = rpm_output('presto 0.100')
+        get_presto_package()
+        get_presto_package()
+        self.assertEqual(run_mock.call_count, 1)
+
+        env.host = 'node2'
+        run_mock.return_value = rpm_output('package presto is not installed')
+        self.assertIsNone(get_presto_package())
+        self.assertEqual(run_mock.call_count, 2)
+
+    @patch('prestoadmin.package.sudo')
+    @patch('prestoadmin.util.package_facts.run')
+    def test_rpm_changes_clear_facts(self, run_mock, sudo_mock):
+        run_mock.return_value = rpm_output('presto 0.100')
+        for change in [lambda: package.rpm_install('presto.rpm'),
+                       lambda: package._rpm_upgrade('presto.rpm'),
+                       lambda: package.rpm_uninstall('presto')]:
+            get_presto_package()
+            change()
+            get_presto_package()
+        self.assertEqual(run_mock.call_count, 4)
+
+    def test_clear_one_host(self):
+        package_facts._package_facts.update({'node1': {}, 'node2': {}})
+        clear_package_facts('node1')
+        self.assertEqual(package_facts._package_facts, {'node2': {}})
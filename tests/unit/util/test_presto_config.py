@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import multiprocessing
+import os
+from StringIO import StringIO
+
+from fabric.state import env
+from mock import patch
+
+from prestoadmin.util import presto_config
+from prestoadmin.util.presto_config import PrestoConfig
+from tests.base_test_case import BaseTestCase
+
+REMOTE_FILES = {
+    '/etc/presto/config.properties': 'http-server.http.port=8081\n',
+    '/etc/presto/node.properties': 'node.environment=test\n'
+}
+
+
+def _read_file(config_host, config_path):
+    return StringIO(REMOTE_FILES[config_path])
+
+
+def _fetch_in_child():
+    process = multiprocessing.Process(target=PrestoConfig.coordinator_config)
+    process.start()
+    process.join()
+
+
+class TestPrestoConfig(BaseTestCase):
+    def setUp(self):
+        super(TestPrestoConfig, self).setUp()
+        env.roledefs['coordinator'] = ['master']
+
+    def tearDown(self):
+        presto_config.end_config_cache()
+        super(TestPrestoConfig, self).tearDown()
+
+    @patch.object(PrestoConfig, 'read_file', side_effect=_read_file)
+    def test_coordinator_config_without_cache(self, read_file_mock):
+        config = PrestoConfig.coordinator_config()
+        self.assertEqual(config.get_http_port(), 8081)
+        self.assertEqual(config.get_node_environment(), 'test')
+        PrestoConfig.coordinator_config()
+        self.assertEqual(read_file_mock.call_count, 4)
+
+    @patch.object(PrestoConfig, 'read_file', side_effect=_read_file)
+    def test_coordinator_config_is_read_once(self, read_file_mock):
+        presto_config.start_config_cache()
+        PrestoConfig.coordinator_config()
+        config = PrestoConfig.coordinator_config()
+        self.assertEqual(config.get_http_port(), 8081)
+        self.assertEqual(config.get_node_environment(), 'test')
+        self.assertEqual(config.config_host, 'master')
+        self.assertEqual(read_file_mock.call_count, 2)
+
+    @patch.object(PrestoConfig, 'read_file', side_effect=_read_file)
+    def test_cache_is_shared_with_worker_processes(self, read_file_mock):
+        presto_config.start_config_cache()
+        _fetch_in_child()
+        self.assertEqual(PrestoConfig.coordinator_config().get_http_port(),
+                         8081)
+        self.assertEqual(read_file_mock.call_count, 0)
+
+    @patch.object(PrestoConfig, 'read_file')
+    def test_defaults_are_not_cached(self, read_file_mock):
+        presto_config.start_config_cache()
+        read_file_mock.side_effect = IOError('No such file')
+        self.assertEqual(PrestoConfig.coordinator_config().get_http_port(),
+                         8080)
+
+        read_file_mock.side_effect = _read_file
+        self.assertEqual(PrestoConfig.coordinator_config().get_http_port(),
+                         8081)
+
+    @patch.object(PrestoConfig, 'read_file', side_effect=_read_file)
+    def test_clear_coordinator_config_cache(self, read_file_mock):
+        presto_config.start_config_cache()
+        PrestoConfig.coordinator_config()
+        PrestoConfig.clear_coordinator_config_cache('worker')
+        PrestoConfig.coordinator_config()
+        self.assertEqual(read_file_mock.call_count, 2)
+
+        PrestoConfig.clear_coordinator_config_cache('master')
+        PrestoConfig.coordinator_config()
+        self.assertEqual(read_file_mock.call_count, 4)
+
+    def test_end_config_cache_removes_cache(self):
+        presto_config.start_config_cache()
+        cache_dir = env[presto_config.CACHE_DIR_ENV_KEY]
+        self.assertTrue(os.path.isdir(cache_dir))
+        presto_config.end_config_cache()
+        self.assertFalse(os.path.exists(cache_dir))
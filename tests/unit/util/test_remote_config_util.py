@@ -12,15 +12,46 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import os
+import shutil
+import subprocess
+import tempfile
+
 from fabric.operations import _AttributeString
 from mock import patch
+from prestoadmin.util import remote_config_util
 from prestoadmin.util.exception import ConfigurationError
 from prestoadmin.util.remote_config_util import lookup_port,\
-    lookup_string_config, NODE_CONFIG_FILE
+    lookup_string_config, lookup_server_log_file, lookup_launcher_log_file,\
+    clear_config_snapshot, NODE_CONFIG_FILE, GENERAL_CONFIG_FILE,\
+    FILE_HEADER, MISSING_FILE
 from tests.base_test_case import BaseTestCase
 
 
+def snapshot_output(node_properties='', config_properties=''):
+    lines = []
+    for path, content in [(NODE_CONFIG_FILE, node_properties),
+                          (GENERAL_CONFIG_FILE, config_properties)]:
+        lines.append(FILE_HEADER + path)
+        if content is None:
+            lines.extend(['', MISSING_FILE])
+        else:
+            lines.extend([content, ''])
+    output = _AttributeString('\n'.join(lines))
+    output.failed = False
+    output.return_code = 0
+    return output
+
+
 class TestRemoteConfigUtil(BaseTestCase):
+    def setUp(self):
+        super(TestRemoteConfigUtil, self).setUp()
+        clear_config_snapshot()
+
+    def tearDown(self):
+        clear_config_snapshot()
+        super(TestRemoteConfigUtil, self).tearDown()
+
     @patch('prestoadmin.util.remote_config_util.sudo')
     def test_lookup_port_failure(self, sudo_mock):
         sudo_mock.return_value = Exception('File not found')
@@ -33,10 +64,8 @@ class TestRemoteConfigUtil(BaseTestCase):
 
     @patch('prestoadmin.util.remote_config_util.sudo')
     def test_lookup_port_not_integer_failure(self, sudo_mock):
-        sudo_mock.return_value = _AttributeString(
-            'http-server.http.port=hello')
-        sudo_mock.return_value.failed = False
-        sudo_mock.return_value.return_code = 0
+        sudo_mock.return_value = snapshot_output(
+            config_properties='http-server.http.port=hello')
 
         self.assertRaisesRegexp(
             ConfigurationError,
@@ -47,18 +76,14 @@ class TestRemoteConfigUtil(BaseTestCase):
 
     @patch('prestoadmin.util.remote_config_util.sudo')
     def test_lookup_port_not_in_file(self, sudo_mock):
-        sudo_mock.return_value = _AttributeString('')
-        sudo_mock.return_value.failed = False
-        sudo_mock.return_value.return_code = 1
+        sudo_mock.return_value = snapshot_output()
         port = lookup_port('any_host')
         self.assertEqual(port, 8080)
 
     @patch('prestoadmin.util.remote_config_util.sudo')
     def test_lookup_port_out_of_range(self, sudo_mock):
-        sudo_mock.return_value = _AttributeString(
-            'http-server.http.port=99999')
-        sudo_mock.return_value.failed = False
-        sudo_mock.return_value.return_code = 0
+        sudo_mock.return_value = snapshot_output(
+            config_properties='http-server.http.port=99999')
         self.assertRaisesRegexp(
             ConfigurationError,
             'Invalid port number 99999: port must be a number between 1 and '
@@ -68,28 +93,22 @@ class TestRemoteConfigUtil(BaseTestCase):
 
     @patch('prestoadmin.util.remote_config_util.sudo')
     def test_lookup_string_config(self, sudo_mock):
-        sudo_mock.return_value = _AttributeString(
-            'config.to.lookup=/path/hello')
-        sudo_mock.return_value.failed = False
-        sudo_mock.return_value.return_code = 0
+        sudo_mock.return_value = snapshot_output(
+            node_properties='config.to.lookup=/path/hello')
         config_value = lookup_string_config('config.to.lookup',
                                             NODE_CONFIG_FILE, 'any_host')
         self.assertEqual(config_value, '/path/hello')
 
     @patch('prestoadmin.util.remote_config_util.sudo')
     def test_lookup_string_config_not_in_file(self, sudo_mock):
-        sudo_mock.return_value = _AttributeString('')
-        sudo_mock.return_value.failed = False
-        sudo_mock.return_value.return_code = 1
+        sudo_mock.return_value = snapshot_output()
         config_value = lookup_string_config('config.to.lookup',
                                             NODE_CONFIG_FILE, 'any_host')
         self.assertEqual(config_value, '')
 
     @patch('prestoadmin.util.remote_config_util.sudo')
     def test_lookup_string_config_file_not_found(self, sudo_mock):
-        sudo_mock.return_value = _AttributeString(
-            'grep: /etc/presto/node.properties does not exist')
-        sudo_mock.return_value.return_code = 2
+        sudo_mock.return_value = snapshot_output(node_properties=None)
 
         self.assertRaisesRegexp(
             ConfigurationError,
@@ -97,3 +116,83 @@ class TestRemoteConfigUtil(BaseTestCase):
             lookup_string_config, 'config.to.lookup', NODE_CONFIG_FILE,
             'any_host'
         )
+
+    @patch('prestoadmin.util.remote_config_util.execute')
+    def test_lookups_share_one_remote_command(self, execute_mock):
+        execute_mock.return_value = {'any_host': snapshot_output(
+            node_properties='node.id=abc\n'
+                            'node.server-log-file=/logs/server.log\n'
+                            'node.launcher-log-file=/logs/launcher.log',
+            config_properties='coordinator=true\n'
+                              'http-server.http.port=8081')}
+
+        self.assertEqual(lookup_server_log_file('any_host'),
+                         '/logs/server.log')
+        self.assertEqual(lookup_launcher_log_file('any_host'),
+                         '/logs/launcher.log')
+        self.assertEqual(lookup_port('any_host'), 8081)
+        self.assertEqual(
+            lookup_string_config('node.id', NODE_CONFIG_FILE, 'any_host'),
+            'abc')
+        self.assertEqual(execute_mock.call_count, 1)
+
+    @patch('prestoadmin.util.remote_config_util.execute')
+    def test_clear_config_snapshot_refetches(self, execute_mock):
+        execute_mock.return_value = {'any_host': snapshot_output(
+            config_properties='http-server.http.port=8081')}
+        self.assertEqual(lookup_port('any_host'), 8081)
+
+        execute_mock.return_value = {'any_host': snapshot_output(
+            config_properties='http-server.http.port=8082')}
+        self.assertEqual(lookup_port('any_host'), 8081)
+        clear_config_snapshot('any_host')
+        self.assertEqual(lookup_port('any_host'), 8082)
+
+    @patch('prestoadmin.util.remote_config_util.execute')
+    def test_incomplete_snapshot_is_not_kept(self, execute_mock):
+        execute_mock.return_value = {
+            'any_host': snapshot_output(node_properties=None)}
+        self.assertEqual(lookup_port('any_host'), 8080)
+        self.assertEqual(lookup_port('any_host'), 8080)
+        self.assertEqual(execute_mock.call_count, 2)
+        self.assertEqual(remote_config_util._snapshots, {})
+
+    @patch('prestoadmin.util.remote_config_util.execute')
+    def test_file_outside_snapshot_is_read_on_its_own(self, execute_mock):
+        catalog_file = '/etc/presto/catalog/tpch.properties'
+        execute_mock.return_value = {'any_host': _AttributeString(
+            FILE_HEADER + catalog_file + '\nconnector.name=tpch')}
+        self.assertEqual(
+            lookup_string_config('connector.name', catalog_file, 'any_host'),
+            'tpch')
+        command = execute_mock.call_args[0][1]
+        self.assertTrue(catalog_file in command)
+        self.assertFalse(NODE_CONFIG_FILE in command)
+
+    @patch('prestoadmin.util.remote_config_util.execute')
+    def test_file_without_trailing_newline(self, execute_mock):
+        config_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_dir)
+        node_file = os.path.join(config_dir, 'node.properties')
+        config_file = os.path.join(config_dir, 'config.properties')
+        with open(node_file, 'w') as f:
+            f.write('node.id=abc')
+        with open(config_file, 'w') as f:
+            f.write('http-server.http.port=8081')
+
+        def run_locally(unused_sudo, command, **kwargs):
+            return {'any_host': subprocess.check_output(['bash', '-c', command])}
+        execute_mock.side_effect = run_locally
+
+        config = remote_config_util._fetch_config_files(
+            [node_file, config_file, '/does/not/exist'], 'any_host')
+        self.assertEqual(config, {node_file: {'node.id': 'abc'},
+                                  config_file: {'http-server.http.port': '8081'},
+                                  '/does/not/exist': None})
+
+    @patch('prestoadmin.util.remote_config_util.execute')
+    def test_malformed_lines_are_skipped(self, execute_mock):
+        execute_mock.return_value = {'any_host': snapshot_output(
+            config_properties='# comment\nmalformed\n'
+                              'http-server.http.port=8081')}
+        self.assertEqual(lookup_port('any_host'), 8081)
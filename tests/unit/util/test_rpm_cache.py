@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from prestoadmin.util.rpm_cache import RpmCache
+from tests.base_test_case import BaseTestCase
+
+RPM_VERSIONS = {
+    'presto-server-rpm-0.215.rpm': ('presto-server-rpm', '0.215', '1'),
+    'presto-server-rpm-0.216.rpm': ('presto-server-rpm', '0.216', '1'),
+    'presto-server-rpm-0.217.rpm': ('presto-server-rpm', '0.217', '1'),
+    'other.rpm': ('other', '0.215', '1')
+}
+
+
+def _query_rpm(rpm_path):
+    return RPM_VERSIONS[os.path.basename(rpm_path)]
+
+
+@patch('prestoadmin.util.rpm_cache._query_rpm', side_effect=_query_rpm)
+class TestRpmCache(BaseTestCase):
+    def setUp(self):
+        super(TestRpmCache, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.download_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        shutil.rmtree(self.download_dir)
+        super(TestRpmCache, self).tearDown()
+
+    def _download(self, name, content=None):
+        path = os.path.join(self.download_dir, name)
+        with open(path, 'wb') as f:
+            f.write(content or name)
+        return path
+
+    def test_find_added_rpm(self, mock_query_rpm):
+        rpm_cache = RpmCache(self.cache_dir)
+        cached_path = rpm_cache.add(self._download('presto-server-rpm-0.215.rpm'), ['http://rpm'])
+        self.assertTrue(cached_path.startswith(self.cache_dir))
+        self.assertEqual(os.path.basename(cached_path), 'presto-server-rpm-0.215.rpm')
+        self.assertEqual(os.listdir(self.download_dir), [])
+
+        rpm_cache = RpmCache(self.cache_dir)
+        self.assertEqual(rpm_cache.find_version('0.215'), cached_path)
+        self.assertEqual(rpm_cache.find_url('http://rpm'), cached_path)
+        self.assertIsNone(rpm_cache.find_version('0.216'))
+        self.assertIsNone(rpm_cache.find_url('http://other'))
+
+    def test_find_version_ignores_other_rpms(self, mock_query_rpm):
+        rpm_cache = RpmCache(self.cache_dir)
+        rpm_cache.add(self._download('other.rpm'))
+        self.assertIsNone(rpm_cache.find_version('0.215'))
+
+    def test_identical_rpm_is_stored_once(self, mock_query_rpm):
+        rpm_cache = RpmCache(self.cache_dir)
+        first = rpm_cache.add(self._download('presto-server-rpm-0.215.rpm'), ['http://a'])
+        second = rpm_cache.add(self._download('presto-server-rpm-0.215.rpm'), ['http://b'])
+        self.assertEqual(first, second)
+        self.assertEqual(rpm_cache.find_url('http://a'), first)
+        self.assertEqual(rpm_cache.find_url('http://b'), first)
+        self.assertEqual(mock_query_rpm.call_count, 1)
+        self.assertEqual(os.listdir(self.download_dir), [])
+
+    def test_least_recently_used_rpm_is_evicted(self, mock_query_rpm):
+        rpm_cache = RpmCache(self.cache_dir, max_size=60)
+        first = rpm_cache.add(self._download('presto-server-rpm-0.215.rpm'))
+        rpm_cache.add(self._download('presto-server-rpm-0.216.rpm'))
+        rpm_cache.find_version('0.215')
+        rpm_cache.add(self._download('presto-server-rpm-0.217.rpm'))
+
+        self.assertEqual(rpm_cache.find_version('0.215'), first)
+        self.assertIsNone(rpm_cache.find_version('0.216'))
+        self.assertIsNotNone(rpm_cache.find_version('0.217'))
+        self.assertEqual(len(os.listdir(self.cache_dir)), 4)
+
+    def test_missing_rpm_is_removed_from_index(self, mock_query_rpm):
+        rpm_cache = RpmCache(self.cache_dir)
+        cached_path = rpm_cache.add(self._download('presto-server-rpm-0.215.rpm'), ['http://rpm'])
+        os.remove(cached_path)
+        self.assertIsNone(rpm_cache.find_version('0.215'))
+        self.assertIsNone(rpm_cache.find_url('http://rpm'))
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from fabric.api import env
+from fabric.operations import _AttributeList, _AttributeString
+from mock import patch
+
+from prestoadmin.util import timing
+from prestoadmin.util.timing import CommandTiming, format_timing_report, percentile, \
+    record_command, record_task, record_transfer, take_records, trace_events
+from tests.base_test_case import BaseTestCase
+
+
+def command_output(stdout, stderr='', return_code=0):
+    out = _AttributeString(stdout)
+    out.stderr = stderr
+    out.return_code = return_code
+    out.real_command = '/bin/bash -l -c "%s"' % 'true'
+    return out
+
+
+def timed(host, command, seconds, exit_code=0, operation='run', start=0):
+    return CommandTiming(host, 'server.status', operation, command, start, seconds, exit_code,
+                         10, 100)
+
+
+def transferred(paths, failed=()):
+    paths = _AttributeList(paths)
+    paths.failed = list(failed)
+    return paths
+
+
+class TestTiming(BaseTestCase):
+    def setUp(self):
+        super(TestTiming, self).setUp()
+        take_records()
+        env.host = 'node1'
+        env.command = 'server.status'
+        env.timing_report = True
+
+    def tearDown(self):
+        take_records()
+        super(TestTiming, self).tearDown()
+
+    @patch('prestoadmin.util.timing.time.time', return_value=12.5)
+    def test_record_command(self, unused_time_mock):
+        record_command('sudo', 'true', 10.0, command_output('out', 'err', 1))
+        self.assertEqual(take_records(),
+                         [CommandTiming('node1', 'server.status', 'sudo', 'true', 10.0, 2.5, 1,
+                                        len('/bin/bash -l -c "true"'), 6)])
+        self.assertEqual(take_records(), [])
+
+    def test_record_failed_command(self):
+        record_command('run', 'true', 10.0, None)
+        record = take_records()[0]
+        self.assertIsNone(record.exit_code)
+        self.assertEqual((record.bytes_out, record.bytes_in), (4, 0))
+
+    def test_record_transfer(self):
+        record_transfer('get', '/var/log/presto', 10.0, transferred(['a', 'b'], ['b']),
+                        bytes_in=20)
+        record_transfer('put', 'presto.rpm', 10.0, None, bytes_out=30)
+        self.assertEqual([(r.operation, r.command, r.exit_code, r.bytes_out, r.bytes_in)
+                          for r in take_records()],
+                         [('get', '/var/log/presto', 1, 0, 20),
+                          ('put', 'presto.rpm', None, 30, 0)])
+
+    def test_record_task(self):
+        record_task(10.0, True)
+        record_task(10.0, False)
+        self.assertEqual([(r.operation, r.command, r.exit_code) for r in take_records()],
+                         [('task', 'server.status', 0), ('task', 'server.status', 1)])
+
+    def test_nothing_is_recorded_without_timing_report_or_trace_file(self):
+        env.timing_report = False
+        record_command('run', 'true', 10.0, command_output('out'))
+        record_task(10.0, True)
+        self.assertEqual(take_records(), [])
+
+        env.trace_file = 'trace.json'
+        record_task(10.0, True)
+        self.assertEqual(len(take_records()), 1)
+
+    def test_percentile(self):
+        values = range(1, 21)
+        self.assertEqual(percentile(values, 0.5), 10)
+        self.assertEqual(percentile(values, 0.95), 19)
+        self.assertEqual(percentile([3], 0.95), 3)
+        self.assertEqual(percentile([3], 0), 3)
+
+    def test_report(self):
+        records = [timed('node1', 'rpm -q presto', 1.0),
+                   timed('node2', 'rpm -q presto', 3.0, exit_code=1),
+                   timed('node2', 'service presto status', 0.5),
+                   timed('node3', 'a' * 100, 0.25),
+                   timed('node3', 'server.status', 5.0, operation='task')]
+        self.assertEqual(format_timing_report(records), [
+            'Remote command timings: 4 commands on 3 hosts',
+            ' count failed      p50      p95      max   bytes in  command',
+            '     2      1    1.00s    3.00s    3.00s        200  rpm -q presto',
+            '     1      0    0.50s    0.50s    0.50s        100  service presto status',
+            '     1      0    0.25s    0.25s    0.25s        100  ' + 'a' * 57 + '...',
+            '',
+            'Slowest hosts:',
+            ' count    total      max  host',
+            '     2    3.50s    3.00s  node2',
+            '     1    1.00s    1.00s  node1',
+            '     1    0.25s    0.25s  node3'])
+
+    def test_report_lists_the_slowest_hosts(self):
+        records = [timed('node%d' % i, 'true', i) for i in range(10)]
+        hosts = format_timing_report(records)[-timing.SLOWEST_HOSTS_REPORTED:]
+        self.assertEqual([line.split()[-1] for line in hosts],
+                         ['node9', 'node8', 'node7', 'node6', 'node5'])
+
+    def test_empty_report(self):
+        self.assertEqual(format_timing_report([]), ['No remote commands were run.'])
+
+    def test_trace_events(self):
+        records = [timed('node2', 'server.status', 2.0, operation='task', start=100.0),
+                   timed('node2', 'rpm -q presto', 0.5, start=100.5),
+                   timed('node1', 'server.status', 1.0, operation='task', start=100.25)]
+        events = trace_events(records)
+        self.assertEqual(events[:3], [
+            {'name': 'process_name', 'ph': 'M', 'pid': 1, 'tid': 0,
+             'args': {'name': 'presto-admin'}},
+            {'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': 1, 'args': {'name': 'node1'}},
+            {'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': 2, 'args': {'name': 'node2'}}])
+        self.assertEqual([(e['name'], e['cat'], e['tid'], e['ts'], e['dur']) for e in events[3:]],
+                         [('server.status', 'task', 2, 0, 2000000),
+                          ('rpm -q presto', 'run', 2, 500000, 500000),
+                          ('server.status', 'task', 1, 250000, 1000000)])
+        self.assertEqual(events[4]['args'], {'task': 'server.status', 'command': 'rpm -q presto',
+                                             'exit_code': 0, 'bytes_out': 10, 'bytes_in': 100})
+
+    def test_no_trace_events(self):
+        self.assertEqual(trace_events([]), [])
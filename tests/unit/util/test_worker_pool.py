@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import multiprocessing
+import os
+import Queue
+import signal
+
+from fabric.state import env
+
+from prestoadmin.util import timing, worker_pool
+from prestoadmin.util.worker_pool import WorkerPool, WorkerSession
+from tests.base_test_case import BaseTestCase
+
+
+def _pid():
+    return os.getpid()
+
+
+def _echo(value):
+    return value
+
+
+def _fail():
+    raise ValueError('job failed')
+
+
+def _exit_hard():
+    os._exit(3)
+
+
+def _env_value(key):
+    return env.get(key)
+
+
+def _has_session():
+    return worker_pool.current_session() is not None
+
+
+def _record_command(host):
+    timing.add_records([timing.CommandTiming(host, 'task', 'run', 'true', 0, 1.0, 0, 4, 0)])
+
+
+def _set_env_key():
+    before = env.get('leaked_key')
+    env.leaked_key = 'leaked'
+    return before
+
+
+class TestWorkerPool(BaseTestCase):
+    def _run_pool(self, max_workers, jobs):
+        pool = WorkerPool(max_workers, multiprocessing.Queue())
+        for name, target, kwargs in jobs:
+            pool.append(name, target, kwargs)
+        pool.close()
+        return pool.run()
+
+    def test_returns_results_per_job(self):
+        results = self._run_pool(2, [('a', _echo, {'value': 1}),
+                                     ('b', _echo, {'value': 2}),
+                                     ('c', _echo, {'value': 3})])
+        self.assertEqual(results, {'a': {'exit_code': 0, 'results': 1},
+                                   'b': {'exit_code': 0, 'results': 2},
+                                   'c': {'exit_code': 0, 'results': 3}})
+
+    def test_number_of_processes_is_bounded(self):
+        jobs = [('host%d' % i, _pid, {}) for i in range(8)]
+        results = self._run_pool(2, jobs)
+        pids = set(result['results'] for result in results.values())
+        self.assertTrue(len(pids) <= 2)
+        self.assertNotIn(os.getpid(), pids)
+
+    def test_exception_is_returned_with_nonzero_exit_code(self):
+        results = self._run_pool(1, [('a', _fail, {}),
+                                     ('b', _echo, {'value': 'ok'})])
+        self.assertEqual(results['a']['exit_code'], 1)
+        self.assertTrue(isinstance(results['a']['results'], ValueError))
+        self.assertEqual(results['b'], {'exit_code': 0, 'results': 'ok'})
+
+    def test_env_changes_do_not_leak_between_jobs(self):
+        results = self._run_pool(1, [('a', _set_env_key, {}),
+                                     ('b', _set_env_key, {})])
+        self.assertIsNone(results['a']['results'])
+        self.assertIsNone(results['b']['results'])
+
+    def test_dead_worker_does_not_hang_the_parent(self):
+        results = self._run_pool(1, [('a', _exit_hard, {})])
+        self.assertEqual(results, {'a': {'exit_code': 1, 'results': None}})
+
+    def test_result_put_just_before_the_workers_exit_is_kept(self):
+        class LateQueue(object):
+            # The result only shows up after the wait for it timed out.
+            def get(self, timeout):
+                raise Queue.Empty()
+
+            def get_nowait(self):
+                return {'name': 'a', 'result': 1, 'exit_code': 0, 'timings': []}
+
+        class DeadWorker(object):
+            def is_alive(self):
+                return False
+
+        pool = WorkerPool(1, LateQueue())
+        pool.append('a', _echo, {'value': 1})
+        results = {'a': {'exit_code': None, 'results': None}}
+        pool._fill_results(results, [DeadWorker()])
+        self.assertEqual(results, {'a': {'exit_code': 0, 'results': 1}})
+
+    def test_command_timings_come_back_from_workers(self):
+        _record_command('parent')
+        self._run_pool(1, [('a', _record_command, {'host': 'a'}),
+                           ('b', _record_command, {'host': 'b'})])
+        hosts = [record.host for record in timing.take_records()]
+        self.assertEqual(sorted(hosts), ['a', 'b', 'parent'])
+
+    def test_run_before_close_fails(self):
+        pool = WorkerPool(1, multiprocessing.Queue())
+        self.assertRaisesRegexp(Exception, 'Need to close', pool.run)
+
+
+class TestWorkerSession(BaseTestCase):
+    def setUp(self):
+        super(TestWorkerSession, self).setUp()
+        worker_pool.start_session()
+
+    def tearDown(self):
+        worker_pool.end_session()
+        super(TestWorkerSession, self).tearDown()
+
+    def _run_pool(self, jobs, max_workers=10):
+        pool = WorkerPool(max_workers, multiprocessing.Queue())
+        for name, target, kwargs in jobs:
+            pool.append(name, target, kwargs)
+        pool.close()
+        return pool.run()
+
+    def _pids(self, hosts):
+        results = self._run_pool([(host, _pid, {}) for host in hosts])
+        return dict((host, result['results'])
+                    for host, result in results.items())
+
+    def test_host_keeps_its_worker_across_runs(self):
+        first = self._pids(['a', 'b'])
+        second = self._pids(['b', 'a'])
+        self.assertEqual(first, second)
+        self.assertNotEqual(first['a'], first['b'])
+
+    def test_max_workers_shares_workers_between_hosts(self):
+        worker_pool.start_session(max_workers=2)
+        pids = self._pids(['a', 'b', 'c', 'd'])
+        self.assertEqual(len(set(pids.values())), 2)
+
+    def test_jobs_see_env_at_time_of_run(self):
+        self._pids(['a'])
+        env.session_test_key = 'value'
+        results = self._run_pool([('a', _env_value,
+                                   {'key': 'session_test_key'})])
+        self.assertEqual(results['a']['results'], 'value')
+
+    def test_unpicklable_jobs_fall_back_to_forking(self):
+        results = self._run_pool([('a', lambda: os.getpid(), {})])
+        self.assertEqual(results['a']['exit_code'], 0)
+        self.assertNotEqual(results['a']['results'], self._pids(['a'])['a'])
+
+    def test_workers_do_not_use_the_session(self):
+        results = self._run_pool([('a', _has_session, {})])
+        self.assertEqual(results['a'], {'exit_code': 0, 'results': False})
+
+    def test_command_timings_come_back_from_session_workers(self):
+        self._run_pool([('a', _record_command, {'host': 'a'})])
+        self._run_pool([('a', _record_command, {'host': 'a'})])
+        hosts = [record.host for record in timing.take_records()]
+        self.assertEqual(hosts, ['a', 'a'])
+
+    def test_workers_ignore_ctrl_c(self):
+        pid = self._pids(['a'])['a']
+        os.kill(pid, signal.SIGINT)
+        self.assertEqual(self._pids(['a']), {'a': pid})
+
+    def test_dead_worker_is_replaced(self):
+        results = self._run_pool([('a', _exit_hard, {})])
+        self.assertEqual(results['a']['exit_code'], 1)
+        results = self._run_pool([('a', _echo, {'value': 1})])
+        self.assertEqual(results['a'], {'exit_code': 0, 'results': 1})
+
+    def test_session_is_only_used_by_its_owner(self):
+        session = WorkerSession()
+        session.owner = -1
+        worker_pool._session = session
+        self.assertIsNone(worker_pool.current_session())